@@ -0,0 +1,426 @@
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2018 Baidu.com, Inc. All Rights Reserved
+#
+################################################################################
+"""
+**bench** 性能基准测试模块，包括持久化驱动及执行器的基准测试：
+
+* ``PersistenceBenchmark`` 在不同节点数、数据大小下测量create/get/set/get_children/delete的延迟分位数及吞吐，
+  以及watch通知延迟和临时节点超时删除的延迟
+* ``make_driver`` 按后端名创建持久化驱动
+* ``ExecutorBenchmark`` 对比每个任务序列化执行器与只序列化operation两种分发方式的任务大小及分发延迟
+
+测试结果为可序列化为JSON的dict，便于在不同版本之间对比。
+"""
+
+import os
+import time
+import json
+import pickle
+import tempfile
+import threading
+
+import ark.are.config as config
+import ark.are.context as context
+import ark.are.exception as exception
+import ark.are.executor as executor
+import ark.are.persistence as persistence
+from ark.are.metrics import Metrics
+from ark.are.pool import ElasticPool
+
+
+BACKENDS = ("file", "tmpfs", "memory", "sqlite", "redis", "zookeeper")
+
+
+def make_driver(backend, hosts=None):
+    """
+    按后端名创建持久化驱动。持久化驱动均为单例，重复创建前会重置单例
+
+    :param str backend: 后端名，取值见 ``BACKENDS``
+    :param str hosts: 后端地址，为None时使用本地默认值（file/sqlite为临时目录，tmpfs为/dev/shm下的临时目录）
+    :return: 持久化驱动
+    :rtype: persistence.BasePersistence
+    :raises: exception.ETypeMismatch 不支持的后端
+    """
+    if backend == "tmpfs":
+        driver_class = persistence.FilePersistence
+        if hosts is None:
+            hosts = tempfile.mkdtemp(prefix="ark_bench_", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+    elif backend == "file":
+        driver_class = persistence.FilePersistence
+        if hosts is None:
+            hosts = tempfile.mkdtemp(prefix="ark_bench_")
+    elif backend == "sqlite":
+        driver_class = persistence.SqlitePersistence
+        if hosts is None:
+            hosts = tempfile.mkdtemp(prefix="ark_bench_") + "/bench.db"
+    elif backend == "memory":
+        driver_class = persistence.MemoryPersistence
+        persistence.MemoryPersistence.reset_store()
+        hosts = hosts or "memory"
+    elif backend == "redis":
+        driver_class = persistence.RedisPersistence
+        hosts = hosts or "redis://127.0.0.1:6379/0"
+    elif backend == "zookeeper":
+        driver_class = persistence.ZkPersistence
+        hosts = hosts or "127.0.0.1:2181"
+        driver_class._init = False
+    else:
+        raise exception.ETypeMismatch("unsupported backend:{}".format(backend))
+    config.GuardianConfig.set({config.STATE_SERVICE_HOSTS_NAME: hosts})
+    driver_class._instance = None
+    return driver_class()
+
+
+def summarize(latencies, cost):
+    """
+    汇总一组延迟样本
+
+    :param list(float) latencies: 延迟样本，单位秒
+    :param float cost: 总耗时，单位秒
+    :return: 样本数、p50/p99/平均延迟（毫秒）及吞吐（次/秒）
+    :rtype: dict
+    """
+    if not latencies:
+        return {"count": 0, "p50_ms": None, "p99_ms": None, "mean_ms": None, "throughput": None}
+    return {"count": len(latencies),
+            "p50_ms": Metrics.percentile(latencies, 50) * 1000,
+            "p99_ms": Metrics.percentile(latencies, 99) * 1000,
+            "mean_ms": sum(latencies) / len(latencies) * 1000,
+            "throughput": len(latencies) / cost if cost > 0 else None}
+
+
+class PersistenceBenchmark(object):
+    """
+    持久化驱动基准测试
+    """
+    BASE_PATH = "/ark_bench"
+
+    def __init__(self, driver, node_counts=(100,), value_sizes=(64, 4096),
+                 watch_samples=20, expiry_samples=10):
+        """
+        初始化方法
+
+        :param persistence.BasePersistence driver: 待测持久化驱动
+        :param list(int) node_counts: 节点数列表
+        :param list(int) value_sizes: 数据大小列表，单位字节
+        :param int watch_samples: watch通知延迟的采样次数
+        :param int expiry_samples: 临时节点超时删除延迟的采样节点数，为0时不测试
+        """
+        self._driver = driver
+        self._node_counts = node_counts
+        self._value_sizes = value_sizes
+        self._watch_samples = watch_samples
+        self._expiry_samples = expiry_samples
+
+    def _timed(self, func, args_list):
+        """
+        依次以args_list中的参数调用func，返回延迟样本及总耗时
+        """
+        latencies = []
+        start = time.time()
+        for args in args_list:
+            begin = time.time()
+            func(*args)
+            latencies.append(time.time() - begin)
+        return latencies, time.time() - start
+
+    def _record(self, results, case, nodes, value_size, latencies, cost):
+        """
+        记录一项测试结果
+        """
+        result = {"case": case, "nodes": nodes, "value_size": value_size}
+        result.update(summarize(latencies, cost))
+        results.append(result)
+
+    def _clean(self):
+        """
+        清理测试数据
+        """
+        if self._driver.exists(self.BASE_PATH):
+            self._driver.delete_node(self.BASE_PATH)
+
+    def bench_crud(self, nodes, value_size):
+        """
+        测试节点的增删改查
+
+        :param int nodes: 节点数
+        :param int value_size: 数据大小
+        :return: 测试结果列表
+        :rtype: list(dict)
+        """
+        results = []
+        driver = self._driver
+        base = "%s/crud_%d_%d" % (self.BASE_PATH, nodes, value_size)
+        driver.create_node(base, makepath=True)
+        value = os.urandom(value_size)
+        paths = [("%s/n%d" % (base, i),) for i in range(nodes)]
+
+        latencies, cost = self._timed(lambda path: driver.create_node(path, value), paths)
+        self._record(results, "create", nodes, value_size, latencies, cost)
+        latencies, cost = self._timed(driver.get_data, paths)
+        self._record(results, "get", nodes, value_size, latencies, cost)
+        latencies, cost = self._timed(lambda path: driver.save_data(path, value), paths)
+        self._record(results, "set", nodes, value_size, latencies, cost)
+        rounds = max(1, min(nodes, 100))
+        latencies, cost = self._timed(driver.get_children, [(base,)] * rounds)
+        self._record(results, "get_children", nodes, value_size, latencies, cost)
+        latencies, cost = self._timed(driver.delete_node, paths)
+        self._record(results, "delete", nodes, value_size, latencies, cost)
+        driver.delete_node(base)
+        return results
+
+    def bench_watch(self):
+        """
+        测试子节点变化的watch通知延迟：注册watch后创建子节点，测量到收到通知的时间
+
+        :return: 测试结果
+        :rtype: dict
+        """
+        driver = self._driver
+        base = "%s/watch" % self.BASE_PATH
+        driver.create_node(base, makepath=True)
+        latencies = []
+        start = time.time()
+        for i in range(self._watch_samples):
+            fired = threading.Event()
+            driver.get_children(base, lambda event: fired.set())
+            # 轮询型驱动需要先记录一次节点状态
+            time.sleep(0.05)
+            begin = time.time()
+            driver.create_node("%s/n%d" % (base, i))
+            if fired.wait(10):
+                latencies.append(time.time() - begin)
+        cost = time.time() - start
+        driver.delete_node(base)
+        result = {"case": "watch_latency", "nodes": self._watch_samples, "value_size": 0}
+        result.update(summarize(latencies, cost))
+        result["missed"] = self._watch_samples - len(latencies)
+        return result
+
+    def _abandon(self, paths):
+        """
+        停止对临时节点的续约，模拟实例异常退出
+
+        :return: 驱动是否支持
+        :rtype: bool
+        """
+        driver = self._driver
+        if not isinstance(driver, persistence.PlainPersistence):
+            return False
+        for path in paths:
+            driver._del_record_when_delnode(path)
+        return True
+
+    def bench_expiry(self):
+        """
+        测试临时节点超时删除的延迟：停止续约后，测量到节点对其他调用方不可见的时间
+
+        :return: 测试结果，驱动不支持时为None
+        :rtype: dict
+        """
+        if self._expiry_samples <= 0:
+            return None
+        driver = self._driver
+        base = "%s/expiry" % self.BASE_PATH
+        driver.create_node(base, makepath=True)
+        if isinstance(driver, persistence.MemoryPersistence):
+            # 内存驱动通过挂起一个独立会话模拟实例异常退出
+            owner = persistence.MemoryPersistence.new_session()
+            for i in range(self._expiry_samples):
+                owner.create_node("%s/n%d" % (base, i), ephemeral=True)
+            owner.suspend_session()
+        else:
+            paths = [driver.create_node("%s/n%d" % (base, i), ephemeral=True)
+                     for i in range(self._expiry_samples)]
+            if not self._abandon(paths):
+                driver.delete_node(base)
+                return None
+        begin = time.time()
+        alive = set(driver.get_children(base))
+        latencies = []
+        while alive and time.time() - begin < 60:
+            time.sleep(0.01)
+            current = set(driver.get_children(base))
+            latencies.extend([time.time() - begin] * len(alive - current))
+            alive = current
+        cost = time.time() - begin
+        driver.delete_node(base)
+        result = {"case": "ephemeral_expiry", "nodes": self._expiry_samples, "value_size": 0}
+        result.update(summarize(latencies, cost))
+        result["timeout"] = _persist_timeout()
+        return result
+
+    def run(self):
+        """
+        执行所有测试
+
+        :return: 测试结果
+        :rtype: dict
+        """
+        self._clean()
+        self._driver.create_node(self.BASE_PATH)
+        results = []
+        for nodes in self._node_counts:
+            for value_size in self._value_sizes:
+                results.extend(self.bench_crud(nodes, value_size))
+        if self._watch_samples > 0:
+            results.append(self.bench_watch())
+        expiry = self.bench_expiry()
+        if expiry is not None:
+            results.append(expiry)
+        self._clean()
+        return {"driver": self._driver.__class__.__name__,
+                "timestamp": time.time(),
+                "node_counts": list(self._node_counts),
+                "value_sizes": list(self._value_sizes),
+                "results": results}
+
+
+class _BenchExecutor(executor.MultiProcessExecutor):
+    """
+    执行器基准测试使用的执行器，以ballast模拟执行器中的节点、状态机等数据
+    """
+
+    def __init__(self, process_count, ballast_size):
+        """
+        初始化方法
+
+        :param int process_count: 进程数
+        :param int ballast_size: 执行器附带数据的大小，单位字节
+        """
+        super(_BenchExecutor, self).__init__(process_count)
+        self._ballast = "x" * ballast_size
+
+    def execute(self, operation):
+        """
+        记录子进程开始执行的时间
+        """
+        return {"started": time.time()}
+
+
+class ExecutorBenchmark(object):
+    """
+    执行器任务分发基准测试。分别以 ``run_process`` （每个任务序列化执行器及operation）和
+    ``run_operation`` （执行器在子进程启动时继承，每个任务只序列化operation）分发任务，
+    测量每个任务序列化后的大小，以及从提交到子进程开始执行的分发延迟
+    """
+    MODES = ("executor", "operation")
+
+    def __init__(self, tasks=1000, ballast_size=100000, process_count=2):
+        """
+        初始化方法
+
+        :param int tasks: 任务数
+        :param int ballast_size: 执行器附带数据的大小，单位字节
+        :param int process_count: 进程数
+        """
+        self._tasks = tasks
+        self._ballast_size = ballast_size
+        self._process_count = process_count
+
+    def _task(self, mode, bench_executor, operation):
+        """
+        按分发方式生成任务函数及参数
+        """
+        if mode == "executor":
+            return executor.run_process, (bench_executor, operation)
+        return executor.run_operation, (operation,)
+
+    def bench_dispatch(self, mode):
+        """
+        测试一种分发方式
+
+        :param str mode: 分发方式，取值见 ``MODES``
+        :return: 测试结果
+        :rtype: dict
+        """
+        bench_executor = _BenchExecutor(self._process_count, self._ballast_size)
+        shared = dict([(attr, getattr(bench_executor, attr)) for attr in bench_executor._shared_attrs])
+        pool = ElasticPool(self._process_count, self._process_count, initializer=executor.init_worker,
+                           initargs=(shared, bench_executor), name="bench_" + mode).start()
+        operations = [context.Operation("bench-%d" % i, {}) for i in range(self._tasks)]
+        payload = len(pickle.dumps(self._task(mode, bench_executor, operations[0])[1], pickle.HIGHEST_PROTOCOL))
+        submitted = {}
+        latencies = []
+        try:
+            start = time.time()
+            for operation in operations:
+                submitted[operation.operation_id] = time.time()
+                pool.apply_async(*self._task(mode, bench_executor, operation))
+            for _ in operations:
+                put_time, message = bench_executor._result_queue.get(timeout=60)
+                latencies.append(message.params["started"] - submitted[message.operation_id])
+            cost = time.time() - start
+        finally:
+            pool.terminate()
+        result = {"case": "dispatch_" + mode, "nodes": self._tasks, "value_size": payload}
+        result.update(summarize(latencies, cost))
+        return result
+
+    def run(self):
+        """
+        执行所有测试
+
+        :return: 测试结果
+        :rtype: dict
+        """
+        return {"driver": "ElasticPool",
+                "timestamp": time.time(),
+                "tasks": self._tasks,
+                "ballast_size": self._ballast_size,
+                "process_count": self._process_count,
+                "results": [self.bench_dispatch(mode) for mode in self.MODES]}
+
+
+def _persist_timeout():
+    """
+    获取当前配置的临时节点超时时间
+
+    :return: 超时时间，单位秒
+    :rtype: float
+    """
+    return float(config.GuardianConfig.get(persistence.BasePersistence.PERSIST_TIMEOUT_NAME, "3"))
+
+
+def format_results(report):
+    """
+    将测试结果格式化为便于阅读的表格
+
+    :param dict report: ``PersistenceBenchmark.run`` 的返回值
+    :return: 表格文本
+    :rtype: str
+    """
+    lines = ["driver: %s" % report["driver"],
+             "%-16s %8s %10s %8s %10s %10s %12s" % (
+                 "case", "nodes", "value_size", "count", "p50_ms", "p99_ms", "ops/s")]
+    for result in report["results"]:
+        lines.append("%-16s %8d %10d %8d %10s %10s %12s" % (
+            result["case"], result["nodes"], result["value_size"], result["count"],
+            _fmt(result["p50_ms"]), _fmt(result["p99_ms"]), _fmt(result["throughput"])))
+    return "\n".join(lines)
+
+
+def _fmt(value):
+    """
+    格式化数值，None显示为-
+    """
+    return "-" if value is None else "%.3f" % value
+
+
+def dump_results(report, output=None):
+    """
+    输出测试结果，output为None时输出到标准输出
+
+    :param dict report: 测试结果
+    :param str output: 输出的JSON文件路径
+    :return: 无返回
+    :rtype: None
+    """
+    if output is None:
+        print json.dumps(report, indent=2, sort_keys=True)
+        return
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
@@ -0,0 +1,476 @@
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2018 Baidu.com, Inc. All Rights Reserved
+#
+################################################################################
+"""
+**broker** 远程执行使用的任务代理。 ``RemoteExecutor`` 将操作放入代理的任务队列，独立运行的
+``ark worker`` 进程（可以在其他机器上）从代理拉取任务执行，并将执行结果及状态机的checkpoint交回代理，
+由 ``RemoteExecutor`` 取回后发送至消息泵：
+
+* ``Broker`` 代理服务，监听TCP（host:port）或Unix socket（unix:/path）地址
+* ``BrokerClient`` 代理客户端
+
+工作进程定期发送心跳，超过 ``BROKER_WORKER_TIMEOUT`` 秒（默认30）未收到心跳的工作进程视为丢失，
+其执行中的任务重新放回队列头部，并携带最近一次的checkpoint，由其他工作进程从checkpoint继续执行。
+丢失的工作进程之后交回的结果被丢弃。任务至少执行一次，执行逻辑应可重入。
+
+消息使用pickle序列化，配置项 ``BROKER_TOKEN`` 不为空时，每条消息使用该口令进行HMAC签名，
+签名校验失败的连接被断开。未设置口令时代理拒绝监听本机回环地址以外的TCP地址
+"""
+import SocketServer
+import collections
+import cPickle as pickle
+import hashlib
+import hmac
+import os
+import socket
+import string
+import struct
+import threading
+import time
+
+import ark.are.config as config
+import ark.are.exception as exception
+import ark.are.log as log
+from ark.are.metrics import Metrics
+
+
+WORKER_TIMEOUT_NAME = "BROKER_WORKER_TIMEOUT"
+TOKEN_NAME = "BROKER_TOKEN"
+DEFAULT_ADDRESS = "127.0.0.1:8650"
+
+_HEADER = struct.Struct("!I")
+_DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+def parse_address(address):
+    """
+    解析代理地址
+
+    :param str address: 地址，格式为host:port或unix:/path
+    :return: 地址族，socket地址
+    :rtype: int, object
+    :raises ETypeMismatch: 地址格式错误
+    """
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:"):]
+    host, sep, port = address.rpartition(":")
+    if not sep or not port.isdigit():
+        raise exception.ETypeMismatch("invalid broker address:{}".format(address))
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def is_loopback(host):
+    """
+    判断主机是否为本机回环地址
+
+    :param str host: 主机名或IP
+    :return: True或False
+    :rtype: bool
+    """
+    try:
+        return socket.gethostbyname(host).startswith("127.")
+    except socket.error:
+        return False
+
+
+class _Channel(object):
+    """
+    基于socket的消息通道，消息格式为长度（4字节）+ 签名（设置口令时）+ pickle数据
+    """
+    def __init__(self, sock, token):
+        self._sock = sock
+        self._token = token
+
+    def _digest(self, data):
+        return hmac.new(self._token, data, hashlib.sha256).digest()
+
+    def _recv_exact(self, size):
+        chunks = []
+        while size:
+            chunk = self._sock.recv(size)
+            if not chunk:
+                raise EOFError("connection closed")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return "".join(chunks)
+
+    def send(self, obj):
+        data = pickle.dumps(obj, pickle.HIGHEST_PROTOCOL)
+        if self._token:
+            data = self._digest(data) + data
+        self._sock.sendall(_HEADER.pack(len(data)) + data)
+
+    def recv(self):
+        size, = _HEADER.unpack(self._recv_exact(_HEADER.size))
+        data = self._recv_exact(size)
+        if self._token:
+            digest, data = data[:_DIGEST_SIZE], data[_DIGEST_SIZE:]
+            if not hmac.compare_digest(digest, self._digest(data)):
+                raise exception.EFailedRequest("broker message signature mismatch")
+        return pickle.loads(data)
+
+    def close(self):
+        self._sock.close()
+
+
+class _Task(object):
+    """
+    代理中的任务
+    """
+    def __init__(self, task_id, payload, reply_to):
+        self.task_id = task_id
+        self.payload = payload
+        self.reply_to = reply_to
+        self.worker = None
+        self.checkpoint = None
+        self.controls = []
+        self.attempts = 0
+
+
+class Broker(object):
+    """
+    任务代理服务。任务按放入顺序分配，同一任务id在完成前重复放入只更新结果的接收方，
+    以便故障切换后新的主实例重新分发未完成的操作时不会重复执行
+    """
+    _METHODS = ("put", "get", "heartbeat", "result", "fetch", "control", "stats")
+    _MAX_WAIT = 30
+
+    def __init__(self, address=DEFAULT_ADDRESS, worker_timeout=None, token=None):
+        """
+        初始化方法
+
+        :param str address: 监听地址，格式为host:port或unix:/path
+        :param float worker_timeout: 工作进程心跳超时时间，单位秒，默认取配置项BROKER_WORKER_TIMEOUT
+        :param str token: 消息签名口令，默认取配置项BROKER_TOKEN
+        """
+        self._address = address
+        if worker_timeout is None:
+            worker_timeout = string.atof(config.GuardianConfig.get(WORKER_TIMEOUT_NAME, "30"))
+        self._worker_timeout = worker_timeout
+        self._token = token if token is not None else config.GuardianConfig.get(TOKEN_NAME, "")
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._tasks = {}
+        self._workers = {}
+        self._results = {}
+        self._server = None
+        self._running = False
+
+    def put(self, task_id, payload, reply_to):
+        """
+        放入任务
+
+        :param str task_id: 任务id
+        :param object payload: 任务内容
+        :param str reply_to: 结果的接收方
+        :return: 是否为新任务
+        :rtype: bool
+        """
+        with self._cond:
+            task = self._tasks.get(task_id)
+            if task is not None:
+                task.reply_to = reply_to
+                return False
+            self._tasks[task_id] = _Task(task_id, payload, reply_to)
+            self._queue.append(task_id)
+            self._cond.notify_all()
+            return True
+
+    def get(self, worker_id, timeout=0):
+        """
+        工作进程获取任务，无任务时最多等待timeout秒
+
+        :param str worker_id: 工作进程id
+        :param float timeout: 等待时间，单位秒
+        :return: (任务id, 任务内容, checkpoint)，无任务时返回None
+        :rtype: tuple
+        """
+        deadline = time.time() + min(timeout, self._MAX_WAIT)
+        with self._cond:
+            self._workers[worker_id] = time.time()
+            while not self._queue:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+            task = self._tasks[self._queue.popleft()]
+            task.worker = worker_id
+            task.attempts += 1
+            self._workers[worker_id] = time.time()
+            return task.task_id, task.payload, task.checkpoint
+
+    def heartbeat(self, worker_id):
+        """
+        工作进程心跳，同时取回发给该工作进程执行中任务的控制消息
+
+        :param str worker_id: 工作进程id
+        :return: 任务id到控制消息列表的映射
+        :rtype: dict
+        """
+        controls = {}
+        with self._cond:
+            self._workers[worker_id] = time.time()
+            for task in self._tasks.itervalues():
+                if task.worker == worker_id and task.controls:
+                    controls[task.task_id] = task.controls
+                    task.controls = []
+        return controls
+
+    def result(self, worker_id, task_id, message, final=False, checkpoint=None):
+        """
+        工作进程交回结果
+
+        :param str worker_id: 工作进程id
+        :param str task_id: 任务id
+        :param object message: 结果消息
+        :param bool final: 是否为最终结果，最终结果交回后任务完成
+        :param object checkpoint: 任务的checkpoint，任务重新分配时交给新的工作进程
+        :return: 结果是否被接受，任务已分配给其他工作进程时不接受
+        :rtype: bool
+        """
+        with self._cond:
+            self._workers[worker_id] = time.time()
+            task = self._tasks.get(task_id)
+            if task is None or task.worker != worker_id:
+                log.w("drop result of task {} from worker {}".format(task_id, worker_id))
+                return False
+            if checkpoint is not None:
+                task.checkpoint = checkpoint
+            if final:
+                del self._tasks[task_id]
+            self._results.setdefault(task.reply_to, collections.deque()).append(message)
+            self._cond.notify_all()
+            return True
+
+    def fetch(self, reply_to, max_count=100, timeout=0):
+        """
+        取回结果，无结果时最多等待timeout秒
+
+        :param str reply_to: 结果的接收方
+        :param int max_count: 最多取回的结果数
+        :param float timeout: 等待时间，单位秒
+        :return: 结果消息列表
+        :rtype: list
+        """
+        deadline = time.time() + min(timeout, self._MAX_WAIT)
+        with self._cond:
+            while not self._results.get(reply_to):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return []
+                self._cond.wait(remaining)
+            results = self._results[reply_to]
+            return [results.popleft() for _ in range(min(max_count, len(results)))]
+
+    def control(self, task_id, message):
+        """
+        向任务发送控制消息，由执行该任务的工作进程在下次心跳时取回
+
+        :param str task_id: 任务id
+        :param object message: 控制消息
+        :return: 任务是否存在
+        :rtype: bool
+        """
+        with self._cond:
+            task = self._tasks.get(task_id)
+            if task is None:
+                return False
+            task.controls.append(message)
+            return True
+
+    def stats(self):
+        """
+        获取代理状态
+
+        :return: 排队、执行中的任务数，各工作进程执行中的任务数及待取回的结果数
+        :rtype: dict
+        """
+        with self._cond:
+            workers = dict([(worker_id, 0) for worker_id in self._workers])
+            for task in self._tasks.itervalues():
+                if task.worker is not None:
+                    workers[task.worker] = workers.get(task.worker, 0) + 1
+            return {"queued": len(self._queue),
+                    "running": len(self._tasks) - len(self._queue),
+                    "workers": workers,
+                    "results": dict([(name, len(results)) for name, results in self._results.iteritems()])}
+
+    def reap(self, now=None):
+        """
+        清理心跳超时的工作进程，将其执行中的任务重新放回队列头部
+
+        :param float now: 当前时间
+        :return: 重新分配的任务数
+        :rtype: int
+        """
+        now = now or time.time()
+        redelivered = 0
+        with self._cond:
+            lost = set([worker_id for worker_id, seen in self._workers.iteritems()
+                        if now - seen > self._worker_timeout])
+            if not lost:
+                return 0
+            for task in self._tasks.itervalues():
+                if task.worker in lost:
+                    log.w("worker {} lost, redeliver task {}".format(task.worker, task.task_id))
+                    task.worker = None
+                    self._queue.appendleft(task.task_id)
+                    redelivered += 1
+            for worker_id in lost:
+                del self._workers[worker_id]
+            if redelivered:
+                self._cond.notify_all()
+        Metrics().incr("broker.redelivered", redelivered)
+        return redelivered
+
+    def _reap_run(self):
+        while self._running:
+            time.sleep(max(self._worker_timeout / 3.0, 0.1))
+            try:
+                self.reap()
+            except Exception as e:
+                log.f("reap lost workers fail")
+
+    def _handle(self, sock):
+        """
+        处理一个客户端连接上的请求，直至连接关闭
+        """
+        channel = _Channel(sock, self._token)
+        while self._running:
+            try:
+                method, args = channel.recv()
+            except (EOFError, socket.error):
+                break
+            except Exception as e:
+                log.f("broker receive request fail")
+                break
+            if method not in self._METHODS:
+                channel.send(("err", "unknown method:{}".format(method)))
+                continue
+            try:
+                reply = ("ok", getattr(self, method)(*args))
+            except Exception as e:
+                log.f("broker handle {} fail".format(method))
+                reply = ("err", str(e))
+            try:
+                channel.send(reply)
+            except socket.error:
+                break
+        channel.close()
+
+    def start(self):
+        """
+        启动代理服务，在后台线程中监听
+
+        :return: 代理本身
+        :rtype: Broker
+        :raises EInvalidOperation: 未设置口令时监听非本机回环地址
+        """
+        family, address = parse_address(self._address)
+        if family == socket.AF_INET and not self._token and not is_loopback(address[0]):
+            raise exception.EInvalidOperation(
+                "broker without {} can only listen on loopback address, got:{}".format(
+                    TOKEN_NAME, self._address))
+        broker = self
+
+        class Handler(SocketServer.BaseRequestHandler):
+            def handle(self):
+                broker._handle(self.request)
+
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.unlink(address)
+            self._server = SocketServer.ThreadingUnixStreamServer(address, Handler)
+        else:
+            SocketServer.ThreadingTCPServer.allow_reuse_address = True
+            self._server = SocketServer.ThreadingTCPServer(address, Handler)
+        self._server.daemon_threads = True
+        self._running = True
+        for target in (self._server.serve_forever, self._reap_run):
+            thread = threading.Thread(target=target)
+            thread.setDaemon(True)
+            thread.start()
+        log.i("broker listen on {}".format(self._address))
+        return self
+
+    def stop(self):
+        """
+        停止代理服务
+
+        :return: 无返回
+        :rtype: None
+        """
+        self._running = False
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class BrokerClient(object):
+    """
+    代理客户端，方法与 ``Broker`` 相同。请求失败时关闭连接并抛出异常，下次请求时重新连接，
+    请求不自动重试，避免get等非幂等请求被重复执行。
+
+    .. Note:: 客户端不是线程安全的，每个线程应使用各自的客户端
+    """
+    _CONNECT_TIMEOUT = 5
+
+    def __init__(self, address=DEFAULT_ADDRESS, token=None):
+        """
+        初始化方法
+
+        :param str address: 代理地址，格式为host:port或unix:/path
+        :param str token: 消息签名口令，默认取配置项BROKER_TOKEN
+        """
+        self._address = address
+        self._token = token if token is not None else config.GuardianConfig.get(TOKEN_NAME, "")
+        self._channel = None
+
+    def _connect(self):
+        family, address = parse_address(self._address)
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.settimeout(self._CONNECT_TIMEOUT)
+        sock.connect(address)
+        # 长轮询请求可能长时间没有返回，连接建立后不再设置超时
+        sock.settimeout(None)
+        self._channel = _Channel(sock, self._token)
+
+    def close(self):
+        """
+        关闭连接
+
+        :return: 无返回
+        :rtype: None
+        """
+        if self._channel is not None:
+            self._channel.close()
+            self._channel = None
+
+    def call(self, method, *args):
+        """
+        调用代理方法
+
+        :param str method: 方法名
+        :return: 方法返回值
+        :raises EFailedRequest: 代理返回错误
+        """
+        try:
+            if self._channel is None:
+                self._connect()
+            self._channel.send((method, args))
+            status, value = self._channel.recv()
+        except Exception:
+            self.close()
+            raise
+        if status != "ok":
+            raise exception.EFailedRequest("broker {} fail:{}".format(method, value))
+        return value
+
+    def __getattr__(self, method):
+        if method not in Broker._METHODS:
+            raise AttributeError(method)
+        return lambda *args: self.call(method, *args)
@@ -12,10 +12,13 @@
 * ``SingleDict`` 单例字典基类
 * ``OpObject`` 运维对象基类，对多种运维对象(如，机器、实例、服务和应用等)公共属性的统一抽象
 * ``StringUtil`` 字符串操作工具类，统一封装字符串相关的处理接口
+* ``HashRing`` 一致性哈希环，用于在多个实例间划分操作的归属
 """
 
 import ark.are.exception as exception
 import re
+import bisect
+import hashlib
 import os
 import threading
 import traceback
@@ -161,6 +164,61 @@ class StringUtil(object):
         return camel_format
 
 
+class HashRing(object):
+    """
+    一致性哈希环。每个成员在环上映射为若干虚拟节点，键归属于环上顺时针方向第一个虚拟节点所属的成员，
+    成员增减时只有相邻区间内的键会迁移
+    """
+
+    def __init__(self, members, vnodes=100):
+        """
+        初始化方法
+
+        :param list(str) members: 成员列表
+        :param int vnodes: 每个成员的虚拟节点数
+        """
+        self._members = sorted(set(members))
+        ring = []
+        for member in self._members:
+            for i in range(vnodes):
+                ring.append((self._hash("{}#{}".format(member, i)), member))
+        ring.sort()
+        self._hashes = [item[0] for item in ring]
+        self._owners = [item[1] for item in ring]
+
+    @staticmethod
+    def _hash(key):
+        """
+        计算键在环上的位置
+        """
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        return int(hashlib.md5(str(key)).hexdigest()[:16], 16)
+
+    @property
+    def members(self):
+        """
+        环上的所有成员
+
+        :return: 成员列表
+        :rtype: list(str)
+        """
+        return list(self._members)
+
+    def get_node(self, key):
+        """
+        获取键所归属的成员
+
+        :param str key: 键
+        :return: 成员，环为空时返回None
+        :rtype: str
+        """
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
 class ParametrizedTestCase(unittest.TestCase):
     """ TestCase classes that want to be parametrized should
         inherit from this class.
@@ -20,6 +20,7 @@ GUARDIAN_ID_NAME = "GUARDIAN_ID"
 INSTANCE_ID_NAME = "INSTANCE_ID"
 STATE_SERVICE_HOSTS_NAME = "STATE_SERVICE_HOSTS"
 PERSISTENT_BASEPATH_NAME = "PERSISTENT_BASEPATH"
+PERSISTENT_BUCKET_LEVEL_NAME = "PERSISTENT_BUCKET_LEVEL"
 
 
 class GuardianConfig(object):
@@ -164,3 +165,32 @@ class GuardianConfig(object):
             return "/".join([persistent_base, sub_path]).format(GuardianConfig.get(GUARDIAN_ID_NAME))
         else:
             return persistent_base.format(GuardianConfig.get(GUARDIAN_ID_NAME))
+
+    @classmethod
+    def get_bucket_level(cls):
+        """
+        获取持久化节点的分桶层数，0表示不分桶。每层使用节点名md5值的两位十六进制前缀作为桶名，即每层256个桶
+
+        .. Note:: 分桶层数随操作数据持久化，已有操作数据时修改分桶层数会导致启动失败
+
+        :return: 分桶层数
+        :rtype: int
+        """
+        return int(GuardianConfig.get(PERSISTENT_BUCKET_LEVEL_NAME, "0"))
+
+    @classmethod
+    def get_bucketed_path(cls, sub_path, name):
+        """
+        获取分桶布局下节点的完整持久化路径，如分桶层数为2时，operations下的节点abc的路径为::
+
+            /{guardian_id}/operations/90/01/abc
+
+        :param str sub_path: 子路径，如operations
+        :param str name: 节点名
+        :return: 返回完整的持久化路径
+        :rtype: str
+        """
+        import hashlib
+        digest = hashlib.md5(name).hexdigest()
+        buckets = [digest[i * 2:i * 2 + 2] for i in range(cls.get_bucket_level())]
+        return "/".join([cls.get_persistent_path(sub_path)] + buckets + [name])
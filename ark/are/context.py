@@ -13,6 +13,7 @@
 import pickle
 import time
 import copy
+import json
 
 import ark.are.config as config
 import ark.are.persistence as persistence
@@ -24,8 +25,14 @@ from ark.are.common import Singleton
 class GuardianContext(Singleton):
     """
     Guardian运行状态数据类，为单例类，避免生成多个context对象
+
+    分区模式下（ ``HA_MODE`` 为partition），各实例的context分别保存在 ``partitions/{INSTANCE_ID}`` 节点中，
+    只加载和处理分区键归属于本实例的操作
     """
     _context = None
+    _ring = None
+    _member = None
+    __DEFERRED_INTERVAL = 1
 
     @classmethod
     def get_context(cls):
@@ -43,6 +50,54 @@ class GuardianContext(Singleton):
                 "guardian context is not init yet")
         return cls._context
 
+    @classmethod
+    def set_partition(cls, ring, member):
+        """
+        设置分区模式下的一致性哈希环及本实例的成员名，设置后只有分区键归属于本实例的操作会被处理
+
+        :param HashRing ring: 一致性哈希环
+        :param str member: 本实例的成员名
+        :return: 无返回
+        :rtype: None
+        """
+        cls._ring = ring
+        cls._member = member
+
+    @classmethod
+    def get_member(cls):
+        """
+        获取本实例的成员名
+
+        :return: 分区模式下为本实例的成员名，否则为None
+        :rtype: str
+        """
+        return cls._member
+
+    @classmethod
+    def owns(cls, partition_key):
+        """
+        判断分区键是否归属于本实例，非分区模式下总是归属于本实例
+
+        :param str partition_key: 分区键
+        :return: True或False
+        :rtype: bool
+        """
+        if cls._ring is None:
+            return True
+        return cls._ring.get_node(partition_key) == cls._member
+
+    @classmethod
+    def get_context_path(cls):
+        """
+        获取context的持久化路径
+
+        :return: 持久化路径
+        :rtype: str
+        """
+        if cls._member is None:
+            return config.GuardianConfig.get_persistent_path("context")
+        return config.GuardianConfig.get_persistent_path("partitions") + "/" + cls._member
+
     @classmethod
     def load_context(cls):
         """
@@ -51,27 +106,101 @@ class GuardianContext(Singleton):
         :return: context对象
         :rtype: GuardianContext
         """
-        context_path = config.GuardianConfig.get_persistent_path("context")
-        data = persistence.PersistenceDriver().get_data(context_path)
+        context_path = cls.get_context_path()
+        try:
+            data = persistence.PersistenceDriver().get_data(context_path)
+        except exception.EPNoNodeError:
+            persistence.PersistenceDriver().create_node(context_path, makepath=True)
+            data = None
         log.i("load context success")
         guardian_context = pickle.loads(data) if data else GuardianContext()
-        # load状态机信息
-        operations_path = config.GuardianConfig.get_persistent_path("operations")
-        # operations子节点名称均为operation_id
-        operation_ids = persistence.PersistenceDriver().get_children(operations_path)
-        for operation_id in operation_ids:
-            operation_path = operations_path + "/" + operation_id
-            try:
-                operation_data = persistence.PersistenceDriver().get_data(operation_path)
-                log.i("load operation[{}] success".format(operation_id))
-                operation = pickle.loads(operation_data)
-                guardian_context.operations[operation_id] = operation
-            except Exception as e:
-                log.f("load operation {} failed".format(operation_id))
-
+        guardian_context.operations = {}
+        guardian_context.rebalance()
         cls._context = guardian_context
         return guardian_context
 
+    @classmethod
+    def _load_operations(cls, exclude=(), deferred=None):
+        """
+        从状态服务加载归属于本实例的操作
+
+        :param exclude: 无需加载的操作id
+        :param set deferred: 收集正由其他实例执行、暂不接管的操作id
+        :return: 操作id到操作对象的映射
+        :rtype: dict
+        """
+        operations = {}
+        operations_path = config.GuardianConfig.get_persistent_path("operations")
+        cls._check_bucket_level(operations_path)
+        # operations下的叶子节点名称均为operation_id，分桶布局下逐桶加载
+        buckets = persistence.PersistenceDriver().iter_buckets(
+            operations_path, config.GuardianConfig.get_bucket_level())
+        for bucket_path, operation_ids in buckets:
+            # 同一个桶内的请求先全部发出再依次获取结果
+            futures = [(operation_id, persistence.PersistenceDriver().get_data_async(
+                bucket_path + "/" + operation_id))
+                for operation_id in operation_ids if operation_id not in exclude]
+            for operation_id, future in futures:
+                try:
+                    operation_data = future.get()
+                    operation = pickle.loads(operation_data)
+                    if not cls.owns(operation.get_partition_key()):
+                        continue
+                    if cls._held_elsewhere(operation):
+                        if deferred is not None:
+                            deferred.add(operation_id)
+                        continue
+                    log.i("load operation[{}] success".format(operation_id))
+                    operations[operation_id] = operation
+                except Exception as e:
+                    log.f("load operation {} failed".format(operation_id))
+        return operations
+
+    @classmethod
+    def _held_elsewhere(cls, operation):
+        """
+        判断操作是否正由哈希环上的其他实例执行。分区变化后，已在旧实例上开始执行的操作由旧实例执行完成，
+        新的归属实例在此之前不接管，执行实例离开哈希环后才由新的归属实例接管
+
+        :param Operation operation: 操作对象
+        :return: True或False
+        :rtype: bool
+        """
+        holder = operation.get_holder()
+        return cls._ring is not None and holder is not None and holder != cls._member \
+            and holder in cls._ring.members
+
+    @classmethod
+    def _check_bucket_level(cls, operations_path):
+        """
+        校验已持久化的操作的分桶层数与配置一致。分桶层数记录在operations节点的数据中，
+        未记录且已有操作时按不分桶的早期布局处理
+
+        :param str operations_path: operations节点路径
+        :return: 无返回
+        :rtype: None
+        :raises EInvalidOperation: 分桶层数与配置不一致
+        """
+        driver = persistence.PersistenceDriver()
+        level = config.GuardianConfig.get_bucket_level()
+        try:
+            raw = driver.get_data(operations_path)
+        except exception.EPNoNodeError:
+            raw = None
+        if raw:
+            persisted = json.loads(raw)["bucket_level"]
+        elif raw is not None and driver.get_children(operations_path):
+            persisted = 0
+        else:
+            persisted = level
+        if persisted != level:
+            log.e("operations are persisted with bucket level {}, but {} is {}".format(
+                persisted, config.PERSISTENT_BUCKET_LEVEL_NAME, level))
+            raise exception.EInvalidOperation(
+                "bucket level mismatch, persisted:{}, config:{}".format(persisted, level))
+        if not raw:
+            driver.save_or_create(operations_path, json.dumps({"bucket_level": level}), makepath=True)
+
     def __init__(self):
         """
         初始化。GuardianContext保存的数据除消息队列与所有operation信息外，
@@ -89,6 +218,118 @@ class GuardianContext(Singleton):
         self.operations = {}
         self.extend = {}
         self.lock = False
+        self.fence_token = None
+        self.deferred = set()
+
+    def rebalance(self):
+        """
+        分区变化后重新划分本实例负责的操作：释放分区键不再归属于本实例的操作及其消息（不删除持久化数据，由新的归属实例接管），
+        并从状态服务加载新归属于本实例的操作。
+
+        已在本实例开始执行的操作不释放，执行完成后删除；正由其他实例执行的操作暂不接管，
+        记录在 ``deferred`` 中由 ``acquire_deferred`` 定期检查。接管的操作在已离开哈希环的实例的context中尚未处理的消息合并到本实例的消息列表
+
+        :return: 新加载的操作id列表
+        :rtype: list(str)
+        """
+        released = [operation_id for operation_id, operation in self.operations.iteritems()
+                    if not self.owns(operation.get_partition_key())
+                    and (self._member is None or operation.get_holder() != self._member)]
+        for operation_id in released:
+            del self.operations[operation_id]
+        self.deferred = set()
+        acquired = self._load_operations(exclude=self.operations, deferred=self.deferred)
+        self.operations.update(acquired)
+        if self._ring is not None:
+            self.message_list[:] = [message for message in self.message_list
+                                    if getattr(message, "operation_id", None) in self.operations]
+            self._adopt_messages(acquired)
+        log.i("rebalance context, released:{}, acquired:{}, deferred:{}".format(
+            len(released), len(acquired), len(self.deferred)))
+        return acquired.keys()
+
+    def acquire_deferred(self):
+        """
+        检查暂不接管的操作：操作已删除或分区键不再归属于本实例时不再等待，执行实例离开哈希环后由本实例接管。
+        检查间隔为1秒
+
+        :return: 新接管的操作id列表
+        :rtype: list(str)
+        """
+        now = time.time()
+        if not self.deferred or now - getattr(self, "deferred_checked_at", 0) < self.__DEFERRED_INTERVAL:
+            return []
+        self.deferred_checked_at = now
+        acquired = {}
+        # 先全部发出请求再依次获取结果，避免在消息泵线程上逐个同步读取
+        driver = persistence.PersistenceDriver()
+        futures = [(operation_id, driver.get_data_async(
+            config.GuardianConfig.get_bucketed_path("operations", operation_id)))
+            for operation_id in list(self.deferred)]
+        for operation_id, future in futures:
+            try:
+                operation = pickle.loads(future.get())
+            except exception.EPNoNodeError:
+                self.deferred.discard(operation_id)
+                continue
+            if not self.owns(operation.get_partition_key()):
+                self.deferred.discard(operation_id)
+            elif not self._held_elsewhere(operation):
+                self.deferred.discard(operation_id)
+                acquired[operation_id] = operation
+        if acquired:
+            self.operations.update(acquired)
+            self._adopt_messages(acquired)
+            log.i("acquire deferred operations:{}".format(acquired.keys()))
+        return acquired.keys()
+
+    def _adopt_messages(self, operation_ids):
+        """
+        将已离开哈希环的实例的context中属于指定操作的消息合并到本实例的消息列表
+
+        :param operation_ids: 新接管的操作id
+        :return: 无返回
+        :rtype: None
+        """
+        if not operation_ids:
+            return
+        # 本实例已有消息的操作无需合并
+        pending = set(operation_id for operation_id in operation_ids
+                      if not self.is_operation_id_in_message_list(operation_id))
+        driver = persistence.PersistenceDriver()
+        partitions_path = config.GuardianConfig.get_persistent_path("partitions")
+        try:
+            members = driver.get_children(partitions_path)
+        except exception.EPNoNodeError:
+            return
+        for member in set(members) - set(self._ring.members):
+            if not pending:
+                break
+            try:
+                data = driver.get_data(partitions_path + "/" + member)
+            except exception.EPNoNodeError:
+                continue
+            if not data:
+                continue
+            messages = [message for message in pickle.loads(data).message_list
+                        if getattr(message, "operation_id", None) in pending]
+            self.message_list.extend(messages)
+            pending -= set(message.operation_id for message in messages)
+            if messages:
+                log.i("adopt {} messages from departed member {}".format(len(messages), member))
+
+    def claim_operation(self, operation):
+        """
+        分区模式下记录操作由本实例执行，执行完成前分区变化时其他实例不接管该操作
+
+        :param Operation operation: 操作对象
+        :return: 无返回
+        :rtype: None
+        """
+        if self._member is None or operation.get_holder() == self._member:
+            return
+        operation.holder = self._member
+        self.save_operation(operation)
 
     def save_operation(self, operation):
         """
@@ -100,10 +341,9 @@ class GuardianContext(Singleton):
             log.e("current guardian instance no privilege to save operation")
             raise exception.EInvalidOperation(
                 "current guardian instance no privilege to save operation")
-        operation_path = config.GuardianConfig.get_persistent_path("operations") + "/" + operation.operation_id
-        if not persistence.PersistenceDriver().exists(operation_path):
-            persistence.PersistenceDriver().create_node(path=operation_path)
-        persistence.PersistenceDriver().save_data(operation_path, pickle.dumps(operation))
+        operation_path = config.GuardianConfig.get_bucketed_path("operations", operation.operation_id)
+        operation.fence_token = persistence.PersistenceDriver().fence_token
+        persistence.PersistenceDriver().save_or_create(operation_path, pickle.dumps(operation), makepath=True)
         log.d("save operation_id:{} success".format(operation.operation_id))
 
     def save_context(self):
@@ -118,8 +358,9 @@ class GuardianContext(Singleton):
             log.e("current guardian instance no privilege to save context")
             raise exception.EInvalidOperation(
                 "current guardian instance no privilege to save context")
-        context_path = config.GuardianConfig.get_persistent_path("context")
+        context_path = self.get_context_path()
         context_to_persist = self
+        context_to_persist.fence_token = persistence.PersistenceDriver().fence_token
         operations_tmp = self.operations
         context_to_persist.operations = {}
         try:
@@ -164,8 +405,9 @@ class GuardianContext(Singleton):
         :return: 无返回
         :rtype: None
         """
+        operation_path = config.GuardianConfig.get_bucketed_path("operations", operation_id)
+        persistence.PersistenceDriver().check_fence(operation_path)
         del self.operations[operation_id]
-        operation_path = config.GuardianConfig.get_persistent_path("operations") + "/" + operation_id
         persistence.PersistenceDriver().delete_node(operation_path)
         log.d("delete operation from context success, operation_id:{}".
               format(operation_id))
@@ -254,12 +496,22 @@ class GuardianContext(Singleton):
                     operation = guardian_context.get_operation(
                         message.operation_id)
                 except KeyError:
+                    partition_key = send_obj.partition_key(message) \
+                        if hasattr(send_obj, "partition_key") else message.operation_id
+                    # 分区模式下，分区键不归属于本实例的新操作由其他实例处理
+                    if not GuardianContext.owns(partition_key):
+                        log.d("operation {} not owned, skip message:{}".format(
+                            message.operation_id, message.name))
+                        return None
                     # 此处使用深拷贝，防止后续处理中造成环形引用
                     operation = Operation(
-                        message.operation_id, copy.deepcopy(message.params))
+                        message.operation_id, copy.deepcopy(message.params),
+                        partition_key=partition_key)
                     guardian_context.create_operation(
                         message.operation_id, operation)
                 operation.append_period(message.name)
+                if message.name == "DECIDED_MESSAGE":
+                    guardian_context.claim_operation(operation)
             ret = func(send_obj, message)
             return ret
 
@@ -355,16 +607,18 @@ class Operation(object):
     操作类，操作类描述了一个外部事件从感知到执行完成的所有状态信息
     """
     def __init__(self, operation_id, operation_params,
-                 session=None):
+                 session=None, partition_key=None):
         """
         初始化方法，``Operation`` 对象包含操作id、当前操作状态、操作参数、
         操作各阶段信息、执行过程信息、运行session信息
         * periods: 表示一个事件的各个执行时期，主要包含感知、决策、执行等各个阶段性信息
         * actions: 表示一个事件在执行期，各执行过程信息
+        * attempts: 表示操作执行失败后重试的记录
 
         :param str operation_id: 操作id
         :param dict operation_params: 操作参数
         :param dict session: 运行session信息，默认为None。状态机相关operation的session用来保存状态机session
+        :param str partition_key: 分区键，分区模式下决定操作归属的实例，默认为操作id
         """
         self.operation_id = operation_id
         self.status = "CREATE"
@@ -372,6 +626,51 @@ class Operation(object):
         self.periods = Periods()
         self.actions = Actions()
         self.session = session
+        self.fence_token = None
+        self.partition_key = partition_key
+        self.attempts = []
+        self.holder = None
+
+    def get_partition_key(self):
+        """
+        获取分区键
+
+        :return: 分区键，未设置时为操作id
+        :rtype: str
+        """
+        return getattr(self, "partition_key", None) or self.operation_id
+
+    def get_holder(self):
+        """
+        获取执行操作的实例，分区模式下操作决策后记录
+
+        :return: 实例的成员名，未开始执行时为None
+        :rtype: str
+        """
+        return getattr(self, "holder", None)
+
+    def get_attempts(self):
+        """
+        获取执行失败的记录
+
+        :return: 每次执行失败的记录，按执行次数排序
+        :rtype: list(dict)
+        """
+        return getattr(self, "attempts", [])
+
+    def record_attempt(self, error, retry_at):
+        """
+        记录一次执行失败
+
+        :param str error: 失败原因
+        :param float retry_at: 计划重试的时间戳
+        :return: 无返回
+        :rtype: None
+        """
+        attempts = self.get_attempts()
+        attempts.append({"attempt": len(attempts) + 1, "error": error,
+                         "timestamp": time.time(), "retry_at": retry_at})
+        self.attempts = attempts
 
     def append_period(self, name):
         """
@@ -0,0 +1,514 @@
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2018 Baidu.com, Inc. All Rights Reserved
+#
+################################################################################
+"""
+**coroutine** 基于生成器的协程及事件循环，用于在单个线程中并发执行大量以IO等待为主的操作。
+
+协程为生成器函数，通过yield等待以下对象，等待结束后yield表达式的值为等待的结果：
+
+* ``sleep(seconds)`` 等待指定时间，结果为None
+* ``call(func, *args, **kwargs)`` 在事件循环的辅助线程中执行阻塞调用（如网络请求），结果为调用的返回值，
+  调用抛出的异常在yield处重新抛出
+* 生成器 作为子协程执行，结果为子协程的返回值
+* 列表或元组 并发等待其中的所有对象，结果为按顺序排列的结果列表，任一对象异常时在yield处抛出
+* None 让出执行权，结果为None
+
+Python 2的生成器不能return返回值，协程通过 ``raise Return(value)`` 返回结果::
+
+    def deploy(params):
+        task_id = yield call(api.deploy, params["service"])
+        while True:
+            status = yield call(api.status, task_id)
+            if status != "running":
+                raise Return(status)
+            yield sleep(10)
+
+``run_sync`` 在当前线程中同步执行协程，``EventLoop`` 在单个线程中并发执行多个协程
+"""
+import Queue
+import collections
+import heapq
+import itertools
+import multiprocessing.pool
+import sys
+import threading
+import time
+import types
+
+import ark.are.exception as exception
+import ark.are.log as log
+
+
+class Return(Exception):
+    """
+    协程返回结果
+    """
+    def __init__(self, value=None):
+        """
+        初始化方法
+
+        :param value: 协程的返回值
+        """
+        super(Return, self).__init__(value)
+        self.value = value
+
+
+class Sleep(object):
+    """
+    等待指定时间
+    """
+    def __init__(self, seconds):
+        """
+        初始化方法
+
+        :param float seconds: 等待时间，单位秒
+        """
+        self.seconds = seconds
+
+
+class Call(object):
+    """
+    在辅助线程中执行的阻塞调用
+    """
+    def __init__(self, func, args, kwargs):
+        """
+        初始化方法
+
+        :param func func: 调用的函数
+        :param tuple args: 位置参数
+        :param dict kwargs: 关键字参数
+        """
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+
+def sleep(seconds):
+    """
+    生成等待指定时间的对象
+
+    :param float seconds: 等待时间，单位秒
+    :return: 等待对象
+    :rtype: Sleep
+    """
+    return Sleep(seconds)
+
+
+def call(func, *args, **kwargs):
+    """
+    生成在辅助线程中执行阻塞调用的对象
+
+    :param func func: 调用的函数
+    :return: 等待对象
+    :rtype: Call
+    """
+    return Call(func, args, kwargs)
+
+
+def is_coroutine(obj):
+    """
+    判断是否为协程（生成器）
+
+    :param obj: 待判断的对象
+    :return: 是否为协程
+    :rtype: bool
+    """
+    return isinstance(obj, types.GeneratorType)
+
+
+def _resolve_sync(yielded):
+    """
+    同步获取等待对象的结果
+    """
+    if yielded is None:
+        return None
+    elif isinstance(yielded, Sleep):
+        time.sleep(yielded.seconds)
+        return None
+    elif isinstance(yielded, Call):
+        return yielded.func(*yielded.args, **yielded.kwargs)
+    elif is_coroutine(yielded):
+        return run_sync(yielded)
+    elif isinstance(yielded, (list, tuple)):
+        return [_resolve_sync(item) for item in yielded]
+    raise exception.ETypeMismatch("unsupported yield value:{}".format(type(yielded)))
+
+
+def run_sync(coroutine):
+    """
+    在当前线程中同步执行协程，等待对象依次阻塞执行
+
+    :param generator coroutine: 协程
+    :return: 协程的返回值
+    :raises Exception: 协程抛出的异常
+    """
+    value, exc_info = None, None
+    while True:
+        try:
+            if exc_info:
+                yielded = coroutine.throw(*exc_info)
+            else:
+                yielded = coroutine.send(value)
+        except Return as e:
+            return e.value
+        except StopIteration:
+            return None
+        value, exc_info = None, None
+        try:
+            value = _resolve_sync(yielded)
+        except Exception:
+            exc_info = sys.exc_info()
+
+
+class Future(object):
+    """
+    等待对象在事件循环中的结果。结果只在事件循环线程中设置，回调也在事件循环线程中执行
+    """
+    def __init__(self, loop):
+        """
+        初始化方法
+
+        :param EventLoop loop: 事件循环
+        """
+        self._loop = loop
+        self._callbacks = []
+        # 并发等待时的各个子Future，取消时一并取消
+        self._children = []
+        self.done = False
+        self.result = None
+        self.exc_info = None
+
+    def set_result(self, result):
+        """
+        设置结果
+
+        :param result: 结果
+        :return: 无返回
+        :rtype: None
+        """
+        self._finish(result, None)
+
+    def set_exception(self, exc_info):
+        """
+        设置异常
+
+        :param tuple exc_info: sys.exc_info()格式的异常信息
+        :return: 无返回
+        :rtype: None
+        """
+        self._finish(None, exc_info)
+
+    def _finish(self, result, exc_info):
+        if self.done:
+            return
+        self.done = True
+        self.result = result
+        self.exc_info = exc_info
+        for callback in self._callbacks:
+            self._loop.call_soon(callback, self)
+        self._callbacks = []
+
+    def add_done_callback(self, callback):
+        """
+        添加结果设置后的回调，回调参数为Future本身
+
+        :param func callback: 回调
+        :return: 无返回
+        :rtype: None
+        """
+        if self.done:
+            self._loop.call_soon(callback, self)
+        else:
+            self._callbacks.append(callback)
+
+    def cancel(self, error):
+        """
+        取消等待，结果设置为error异常，之后设置的结果被丢弃。并发等待时各个子Future一并取消
+
+        :param Exception error: 作为结果的异常
+        :return: 是否取消成功，已完成的返回False
+        :rtype: bool
+        """
+        if self.done:
+            return False
+        for child in self._children:
+            child.cancel(error)
+        try:
+            raise error
+        except Exception:
+            self.set_exception(sys.exc_info())
+        return True
+
+
+class Task(Future):
+    """
+    事件循环中执行的协程，结果为协程的返回值
+    """
+    def __init__(self, loop, coroutine):
+        """
+        初始化方法
+
+        :param EventLoop loop: 事件循环
+        :param generator coroutine: 协程
+        """
+        super(Task, self).__init__(loop)
+        self._coroutine = coroutine
+        # 协程当前正在等待的Future
+        self._waiting = None
+        loop.call_soon(self._step, None, None)
+
+    def _step(self, value, exc_info):
+        if self.done:
+            return
+        try:
+            if exc_info:
+                yielded = self._coroutine.throw(*exc_info)
+            else:
+                yielded = self._coroutine.send(value)
+        except Return as e:
+            self.set_result(e.value)
+            return
+        except StopIteration:
+            self.set_result(None)
+            return
+        except Exception:
+            self.set_exception(sys.exc_info())
+            return
+        try:
+            future = self._loop.to_future(yielded)
+        except Exception:
+            self._loop.call_soon(self._step, None, sys.exc_info())
+            return
+        self._waiting = future
+        future.add_done_callback(self._wakeup)
+
+    def _wakeup(self, future):
+        self._waiting = None
+        self._step(future.result, future.exc_info)
+
+    def cancel(self, error):
+        """
+        取消协程，协程在当前yield处收到GeneratorExit。协程正在等待的子协程逐层取消，
+        阻塞调用不会被中断，结果被丢弃
+
+        :param Exception error: 作为结果的异常
+        :return: 是否取消成功，已完成的协程返回False
+        :rtype: bool
+        """
+        if self.done:
+            return False
+        waiting, self._waiting = self._waiting, None
+        if waiting is not None:
+            waiting.cancel(error)
+        try:
+            self._coroutine.close()
+        except Exception:
+            log.f("close coroutine fail")
+        try:
+            raise error
+        except Exception:
+            self.set_exception(sys.exc_info())
+        return True
+
+
+class EventLoop(object):
+    """
+    单线程事件循环，并发执行多个协程。 ``call`` 发起的阻塞调用在辅助线程池中执行，
+    完成后由事件循环线程恢复对应的协程，协程本身始终在事件循环线程中执行，无需加锁
+    """
+    _POLL_INTERVAL = 1.0
+
+    def __init__(self, threads=16):
+        """
+        初始化方法
+
+        :param int threads: 执行阻塞调用的辅助线程数
+        """
+        self._threads = threads
+        self._pool = None
+        self._events = Queue.Queue()
+        self._ready = collections.deque()
+        self._timers = []
+        self._sequence = itertools.count()
+        self._stopping = False
+
+    def call_soon(self, func, *args):
+        """
+        在事件循环的下一轮执行函数，只能在事件循环线程中调用
+
+        :param func func: 函数
+        :return: 无返回
+        :rtype: None
+        """
+        self._ready.append((func, args))
+
+    def call_later(self, delay, func, *args):
+        """
+        在指定时间后执行函数，只能在事件循环线程中调用
+
+        :param float delay: 延迟时间，单位秒
+        :param func func: 函数
+        :return: 无返回
+        :rtype: None
+        """
+        heapq.heappush(self._timers, (time.time() + delay, next(self._sequence), func, args))
+
+    def call_threadsafe(self, func, *args):
+        """
+        从其他线程提交在事件循环线程中执行的函数
+
+        :param func func: 函数
+        :return: 无返回
+        :rtype: None
+        """
+        self._events.put((func, args))
+
+    def spawn(self, coroutine, timeout=0):
+        """
+        在事件循环中启动协程，只能在事件循环线程中调用
+
+        :param generator coroutine: 协程
+        :param float timeout: 超时时间，超时后协程被取消，结果为 ``ETimeout`` 异常，0为不限制
+        :return: 协程任务
+        :rtype: Task
+        """
+        task = Task(self, coroutine)
+        if timeout:
+            self.call_later(timeout, task.cancel, exception.ETimeout("timeout after {}s".format(timeout)))
+        return task
+
+    def to_future(self, yielded):
+        """
+        将协程yield的等待对象转换为Future
+
+        :param yielded: 等待对象
+        :return: 等待对象的结果
+        :rtype: Future
+        :raises ETypeMismatch: 不支持的等待对象
+        """
+        if isinstance(yielded, Future):
+            return yielded
+        if is_coroutine(yielded):
+            return Task(self, yielded)
+        if isinstance(yielded, (list, tuple)):
+            return self._gather([self.to_future(item) for item in yielded])
+        future = Future(self)
+        if yielded is None:
+            future.set_result(None)
+        elif isinstance(yielded, Sleep):
+            self.call_later(yielded.seconds, future.set_result, None)
+        elif isinstance(yielded, Call):
+            if self._pool is None:
+                self._pool = multiprocessing.pool.ThreadPool(processes=self._threads)
+            self._pool.apply_async(self._invoke, (yielded, future))
+        else:
+            raise exception.ETypeMismatch("unsupported yield value:{}".format(type(yielded)))
+        return future
+
+    def _invoke(self, yielded, future):
+        """
+        在辅助线程中执行阻塞调用，结果交由事件循环线程设置
+        """
+        try:
+            result = yielded.func(*yielded.args, **yielded.kwargs)
+        except Exception:
+            self.call_threadsafe(future.set_exception, sys.exc_info())
+            return
+        self.call_threadsafe(future.set_result, result)
+
+    def _gather(self, futures):
+        """
+        并发等待多个Future
+        """
+        gathered = Future(self)
+        gathered._children = futures
+        pending = [len(futures)]
+        if not futures:
+            gathered.set_result([])
+
+        def _done(future):
+            if gathered.done:
+                return
+            if future.exc_info:
+                gathered.set_exception(future.exc_info)
+                return
+            pending[0] -= 1
+            if not pending[0]:
+                gathered.set_result([item.result for item in futures])
+
+        for future in futures:
+            future.add_done_callback(_done)
+        return gathered
+
+    def run_once(self, poll=_POLL_INTERVAL):
+        """
+        执行一轮事件循环：接收其他线程提交的函数、触发到期的定时器并执行就绪的回调
+
+        :param float poll: 无事可做时的最长等待时间，单位秒
+        :return: 无返回
+        :rtype: None
+        """
+        timeout = poll
+        if self._ready:
+            timeout = 0
+        elif self._timers:
+            timeout = min(max(self._timers[0][0] - time.time(), 0), poll)
+        try:
+            self._ready.append(self._events.get(timeout=timeout))
+            while True:
+                self._ready.append(self._events.get_nowait())
+        except Queue.Empty:
+            pass
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            _, _, func, args = heapq.heappop(self._timers)
+            self._ready.append((func, args))
+        for _ in range(len(self._ready)):
+            func, args = self._ready.popleft()
+            try:
+                func(*args)
+            except Exception:
+                log.f("event loop callback fail")
+
+    def run(self, inbox=None, handler=None):
+        """
+        运行事件循环直至stop。指定inbox时，由后台线程从inbox中取出对象，在事件循环线程中交由handler处理
+
+        :param Queue inbox: 输入队列，可以是 ``Queue.Queue`` 或 ``multiprocessing.Queue``
+        :param func handler: 输入对象的处理函数
+        :return: 无返回
+        :rtype: None
+        """
+        if inbox is not None:
+            feeder = threading.Thread(target=self._feed, args=(inbox, handler))
+            feeder.setDaemon(True)
+            feeder.start()
+        try:
+            while not self._stopping:
+                self.run_once()
+        finally:
+            if self._pool is not None:
+                self._pool.terminate()
+                self._pool = None
+
+    def _feed(self, inbox, handler):
+        """
+        将输入队列中的对象转交事件循环线程，取到None时结束
+        """
+        while True:
+            item = inbox.get()
+            self.call_threadsafe(handler, item)
+            if item is None:
+                break
+
+    def stop(self):
+        """
+        停止事件循环，未完成的协程不再执行
+
+        :return: 无返回
+        :rtype: None
+        """
+        self._stopping = True
@@ -93,6 +93,13 @@ class ControlFailed(Exception):
     pass
 
 
+class ETimeout(Exception):
+    """
+    执行超时
+    """
+    pass
+
+
 class EPNoNodeError(Exception):
     """
     持久化节点不存在
@@ -118,4 +125,11 @@ class EPServerError(Exception):
     """
     持久化Server端异常, 如redis、zookeeper
     """
-    pass
\ No newline at end of file
+    pass
+
+
+class EPStaleToken(Exception):
+    """
+    持久化写入携带的fencing token已过期，说明当前实例已失去领导权
+    """
+    pass
@@ -9,15 +9,29 @@
 """
 import Queue
 import copy
+import collections
 import multiprocessing
+import multiprocessing.pool
+import os
+import signal
+import socket
+import string
+import threading
 import time
 import uuid
 
+import ark.are.config as config
 import ark.are.graph as graph
 import ark.are.context as context
 import ark.are.framework as framework
 import ark.are.log as log
 import ark.are.exception as exception
+import ark.are.coroutine as coroutine
+import ark.are.broker as broker
+from ark.are.ipc import ControlTable
+from ark.are.pool import ElasticPool
+from ark.are.scheduler import AdmissionScheduler
+from ark.are.metrics import Metrics
 
 
 class BaseExecFuncSet(object):
@@ -70,18 +84,110 @@ def run_process(cls_instance, operation):
     return cls_instance.message_handler(operation)
 
 
+# 进程池子进程中由父进程继承的共享对象，反序列化执行器时恢复
+_worker_shared = {}
+# 进程池子进程中由父进程继承的执行器
+_worker_executor = None
+
+
+def init_worker(shared, executor=None):
+    """
+    进程池子进程的初始化函数，保存通过fork继承的共享对象（结果队列、控制消息表等）及执行器。
+    执行器在子进程启动时继承一次，之后每个任务只需传递operation
+
+    :param dict shared: 属性名到共享对象的映射
+    :param MultiProcessExecutor executor: 执行器
+    :return: 无返回
+    :rtype: None
+    """
+    global _worker_executor
+    _worker_shared.clear()
+    _worker_shared.update(shared)
+    _worker_executor = executor
+
+
+def run_operation(operation):
+    """
+    在进程池子进程中，使用初始化时继承的执行器处理operation
+
+    :param Operation operation: operation操作对象
+    :return: 执行结果
+    :rtype: dict
+    """
+    return _worker_executor.message_handler(operation)
+
+
 class MultiProcessExecutor(framework.BaseExecutor):
     """
     并发执行器基类。 ``MultiProcessExecutor`` 继承自 ``BaseExecutor`` 并提供了多进程
     执行的能力。 ``MultiProcessExecutor`` 会根据指定的最大进程数开启进程池，并对待执行
     消息进行异步处理。 ``MultiProcessExecutor`` 关注空闲消息，并在空闲消息到达后进行任务
     启动和结果获取。
+
+    子进程的执行结果由主进程中的收集线程持续从结果队列取出并暂存，每个空闲消息到达时批量发送至消息泵，
+    每次最多发送 ``EXECUTOR_RESULT_BATCH`` 个（默认100）。结果从放入结果队列到发送至消息泵的耗时
+    记录在 ``executor.result_latency`` 指标中
+
+    结果队列为 ``multiprocessing.Queue`` ，与其他共享对象一样在创建进程池时通过fork继承给子进程，
+    不经过 ``multiprocessing.Manager`` 服务进程。执行器本身也在子进程启动时继承，
+    分发任务时只序列化operation
+
+    执行方式可按执行器选择：
+
+    * process 进程池（默认），适用于CPU密集型操作。进程池为 ``ElasticPool`` ，指定最大进程数时按积压任务数
+      及排队时间在 ``process_count`` 与 ``max_process_count`` 之间自动伸缩
+    * thread 线程池，适用于以网络请求为主的IO密集型操作，避免创建进程及序列化执行器、操作的开销
+    * inline 在消息泵线程中同步执行，适用于耗时很短的操作
+
+    进程池方式下支持操作级的执行超时，超时时间取operation参数中的 ``.inner_timeout`` ，未指定时取配置项
+    ``EXECUTOR_TIMEOUT`` （默认0，即不限制），单位秒。收集线程发现操作执行超时后，终止并替换执行该操作的子进程，
+    并发送执行结果为超时错误的完成消息，由context完成清理。子进程异常退出（如被OOM终止）时，
+    其执行中的操作同样以错误结果完成。各操作占用子进程的情况记录在 ``executor.{执行器类名}.occupancy`` 指标中
+
+    待执行消息先经过 ``AdmissionScheduler`` 准入再分发执行。并发限制的键由 ``concurrency_key`` 获取，
+    默认取operation参数中的 ``.inner_concurrency_key`` ，子类可重写为按服务、集群等提取。
+    总并发数（默认为最大进程数）、每个键的并发数及排队顺序分别由配置项 ``EXECUTOR_GLOBAL_LIMIT`` 、
+    ``EXECUTOR_KEY_LIMIT`` 、 ``EXECUTOR_SCHEDULE_ORDER`` 指定，单个键的并发数可通过 ``set_concurrency_limit`` 调整。
+    各键执行中、排队中的操作数记录在 ``executor.{执行器类名}.admission`` 指标中
+
+    排队顺序默认为priority，按有效优先级从高到低，同级按截止时间从早到晚（EDF），再按到达时间排序。
+    优先级取operation参数中的 ``.inner_priority`` （值越大越优先，默认0），截止时间取 ``.inner_deadline`` （时间戳），
+    可由外部事件或决策器写入参数，也可由子类重写 ``priority`` 、 ``deadline`` 提取。
+    操作每等待 ``EXECUTOR_AGING_INTERVAL`` 秒（默认60）有效优先级提升一级。到达时间为操作的创建时间，
+    随operation持久化，故障切换后恢复的操作保留已等待的时间
+
+    执行失败的操作可按重试策略（ ``ark.are.retry.RetryPolicy`` ，通过类属性 ``retry_policy`` 声明）重试。
+    可重试时子进程发送 ``RETRY_MESSAGE`` 代替完成消息，主进程将本次失败记录在operation的attempts中，
+    并通过消息泵的延迟消息在退避时间后重新发送决策消息，等待期间不占用子进程。执行超时的操作不重试
     """
-    def __init__(self, process_count=1):
+    BACKEND_PROCESS = "process"
+    BACKEND_THREAD = "thread"
+    BACKEND_INLINE = "inline"
+    RESULT_BATCH_NAME = "EXECUTOR_RESULT_BATCH"
+    TIMEOUT_NAME = "EXECUTOR_TIMEOUT"
+    GLOBAL_LIMIT_NAME = "EXECUTOR_GLOBAL_LIMIT"
+    KEY_LIMIT_NAME = "EXECUTOR_KEY_LIMIT"
+    SCHEDULE_ORDER_NAME = "EXECUTOR_SCHEDULE_ORDER"
+    AGING_INTERVAL_NAME = "EXECUTOR_AGING_INTERVAL"
+    retry_policy = None
+    _timeout_key = ".inner_timeout"
+    _concurrency_key = ".inner_concurrency_key"
+    _priority_key = ".inner_priority"
+    _deadline_key = ".inner_deadline"
+    _COLLECT_TIMEOUT = 0.5
+    # 操作结束的结果消息，收到后释放操作占用的并发数
+    _FINAL_MESSAGES = ("COMPLETE_MESSAGE", "RETRY_MESSAGE")
+    # 不随执行器序列化、由子进程继承的共享对象的属性名
+    _shared_attrs = ("_result_queue",)
+    _result_sink = None
+
+    def __init__(self, process_count=1, backend=BACKEND_PROCESS, max_process_count=None):
         """
         初始化方法
 
-        :param int process_count: 进程数
+        :param int process_count: 进程数，线程池方式下为线程数。进程池自动伸缩时为最小进程数
+        :param str backend: 执行方式，可选process、thread、inline
+        :param int max_process_count: 进程池自动伸缩的最大进程数，默认为None，即不伸缩
         :return: 无返回
         :rtype: None
         :raises ETypeMismatch: 参数类型不匹配
@@ -90,26 +196,344 @@ class MultiProcessExecutor(framework.BaseExecutor):
                 or process_count > 1000:
             raise exception.ETypeMismatch(
                 "param process_count must be 1-1000 integer")
-        self._manager = multiprocessing.Manager()
-        self._result_queue = self._manager.Queue()
+        if max_process_count is not None and (not isinstance(max_process_count, int)
+                                              or max_process_count < process_count
+                                              or max_process_count > 1000):
+            raise exception.ETypeMismatch(
+                "param max_process_count must be process_count-1000 integer")
+        if backend not in (self.BACKEND_PROCESS, self.BACKEND_THREAD, self.BACKEND_INLINE):
+            raise exception.ETypeMismatch("unsupported executor backend:{}".format(backend))
+        self._backend = backend
+        # 线程池及同步执行方式下结果无需跨进程传递
+        if backend == self.BACKEND_PROCESS:
+            self._result_queue = multiprocessing.Queue()
+        else:
+            self._result_queue = Queue.Queue()
         self._concerned_message_list = ["IDLE_MESSAGE", "DECIDED_MESSAGE"]
         self._process_count = process_count
+        self._max_process_count = max_process_count or process_count
         self._process_pool = None
+        self._result_batch = string.atoi(config.GuardianConfig.get(self.RESULT_BATCH_NAME, "100"))
+        self._results = collections.deque()
+        self._collecting = False
+        self._collector = None
+        self._timeout = string.atof(config.GuardianConfig.get(self.TIMEOUT_NAME, "0"))
+        # 已分发的操作id -> (任务编号, 超时时间)
+        self._inflight = {}
+        # 总并发数的默认值因执行器而异，不能通过get写回配置，否则会被同一进程中的其他执行器沿用
+        try:
+            global_limit = string.atoi(config.GuardianConfig.get(self.GLOBAL_LIMIT_NAME))
+        except KeyError:
+            global_limit = self._default_global_limit()
+        self._scheduler = AdmissionScheduler(
+            global_limit,
+            string.atoi(config.GuardianConfig.get(self.KEY_LIMIT_NAME, "0")),
+            config.GuardianConfig.get(self.SCHEDULE_ORDER_NAME, AdmissionScheduler.ORDER_PRIORITY),
+            string.atof(config.GuardianConfig.get(self.AGING_INTERVAL_NAME, "60")))
 
     def __getstate__(self):
         self_dict = self.__dict__.copy()
         del self_dict['_process_pool']
-        del self_dict['_manager']
+        del self_dict['_results']
+        del self_dict['_collector']
+        del self_dict['_scheduler']
+        self_dict.pop('_result_sink', None)
+        for attr in self._shared_attrs:
+            del self_dict[attr]
         return self_dict
 
     def __setstate__(self, state):
         self.__dict__.update(state)
+        self.__dict__.update(_worker_shared)
+
+    def _default_global_limit(self):
+        """
+        总并发数的默认值。默认为最大进程（线程）数，使排队的操作留在调度器中按优先级准入，而不是在进程池中按提交顺序排队
+        """
+        return 0 if self._backend == self.BACKEND_INLINE else self._max_process_count
 
     def active(self):
-        self._process_pool = multiprocessing.Pool(processes=self._process_count)
+        self._scheduler.clear()
+        if self._backend == self.BACKEND_PROCESS:
+            shared = dict([(attr, getattr(self, attr)) for attr in self._shared_attrs])
+            self._process_pool = ElasticPool(self._process_count, self._max_process_count,
+                                             initializer=init_worker, initargs=(shared, self),
+                                             name=self.__class__.__name__).start()
+        elif self._backend == self.BACKEND_THREAD:
+            self._process_pool = multiprocessing.pool.ThreadPool(processes=self._process_count)
+        self._start_collector()
 
     def inactive(self):
-        self._process_pool.terminate()
+        if self._process_pool:
+            self._process_pool.terminate()
+            self._process_pool = None
+        self._stop_collector()
+
+    def _start_collector(self):
+        """
+        启动结果收集线程
+        """
+        self._collecting = True
+        self._collector = threading.Thread(target=self._collect_run)
+        self._collector.setDaemon(True)
+        self._collector.start()
+
+    def _stop_collector(self):
+        """
+        停止结果收集线程
+        """
+        self._collecting = False
+        self._collector.join()
+
+    def set_result_sink(self, sink):
+        """
+        设置结果消息的接收函数，设置后执行产生的结果消息交给该函数，不再放入结果队列。
+        用于在消息泵之外直接调用 ``message_handler`` 执行操作的场景，如 ``RemoteWorker``
+
+        :param function sink: 接收函数，参数为结果消息，None为恢复放入结果队列
+        :return: 无返回
+        :rtype: None
+        """
+        self._result_sink = sink
+
+    def _put_result(self, message):
+        """
+        子进程将结果消息放入结果队列，同时记录放入时间
+        """
+        if self._result_sink is not None:
+            self._result_sink(message)
+            return
+        self._result_queue.put((time.time(), message))
+
+    def _collect_run(self):
+        """
+        收集线程，持续从结果队列中取出结果并暂存，由空闲消息批量发送至消息泵
+        """
+        last_check = time.time()
+        while self._collecting:
+            if time.time() - last_check >= self._COLLECT_TIMEOUT:
+                last_check = time.time()
+                try:
+                    self._check_deadlines(last_check)
+                except Exception as e:
+                    log.f("check operation deadlines fail")
+            try:
+                result = self._result_queue.get(timeout=self._COLLECT_TIMEOUT)
+            except Queue.Empty:
+                continue
+            except Exception as e:
+                log.f("collect result fail")
+                time.sleep(self._COLLECT_TIMEOUT)
+                continue
+            if result[1].name in self._FINAL_MESSAGES:
+                self._inflight.pop(result[1].operation_id, None)
+            self._results.append(result)
+
+    def _operation_timeout(self, operation):
+        """
+        获取操作的超时时间，0为不限制
+        """
+        return float(operation.operation_params.get(self._timeout_key, self._timeout) or 0)
+
+    def occupancy(self, now=None):
+        """
+        获取各操作占用子进程的情况，仅进程池方式下有效
+
+        :param float now: 当前时间，默认为time.time()
+        :return: 操作id到占用情况的映射，占用情况包括子进程编号（worker）、已执行时间（elapsed）及超时时间（timeout）
+        :rtype: dict
+        """
+        pool = self._process_pool
+        if self._backend != self.BACKEND_PROCESS or pool is None:
+            return {}
+        now = now or time.time()
+        running = pool.running_tasks()
+        occupancy = {}
+        for operation_id, (task_id, timeout) in self._inflight.items():
+            if task_id in running:
+                worker_id, start = running[task_id]
+                occupancy[operation_id] = {"task": task_id, "worker": worker_id,
+                                           "elapsed": now - start, "timeout": timeout}
+        return occupancy
+
+    def _check_deadlines(self, now):
+        """
+        检查执行超时的操作，终止并替换执行该操作的子进程，并发送超时的完成消息
+        """
+        self._check_lost(now)
+        occupancy = self.occupancy(now)
+        Metrics().set("executor.{}.occupancy".format(self.__class__.__name__), occupancy)
+        for operation_id, slot in occupancy.iteritems():
+            if not slot["timeout"] or slot["elapsed"] <= slot["timeout"]:
+                continue
+            if not self._process_pool.cancel(slot["task"]):
+                continue
+            self._inflight.pop(operation_id, None)
+            Metrics().incr("executor.timeouts")
+            log.e("operation {} timeout after {:.1f}s, worker {} replaced".format(
+                operation_id, slot["elapsed"], slot["worker"]))
+            self.on_timeout(operation_id)
+            message = framework.OperationMessage(
+                "COMPLETE_MESSAGE", operation_id, "err:timeout after {:.1f}s".format(slot["elapsed"]))
+            self._results.append((now, message))
+
+    def _check_lost(self, now):
+        """
+        子进程异常退出（如被OOM终止）时，以错误结果完成其执行中的操作，释放操作占用的并发数
+        """
+        pool = self._process_pool
+        if self._backend != self.BACKEND_PROCESS or pool is None:
+            return
+        lost = set(pool.pop_lost())
+        if not lost:
+            return
+        for operation_id, (task_id, _) in self._inflight.items():
+            if task_id not in lost:
+                continue
+            self._inflight.pop(operation_id, None)
+            Metrics().incr("executor.lost")
+            log.e("operation {} lost, worker exited unexpectedly".format(operation_id))
+            message = framework.OperationMessage(
+                "COMPLETE_MESSAGE", operation_id, "err:worker exited unexpectedly")
+            self._results.append((now, message))
+
+    def _send_results(self):
+        """
+        将暂存的结果批量发送至消息泵，单条结果发送失败不影响其他结果
+        """
+        count = 0
+        while self._results and count < self._result_batch:
+            put_time, message = self._results.popleft()
+            count += 1
+            if message.name in self._FINAL_MESSAGES:
+                self._scheduler.release(message.operation_id)
+            try:
+                if message.name == "RETRY_MESSAGE":
+                    self._schedule_retry(message)
+                else:
+                    self.send(message)
+            except Exception as e:
+                log.f("send result message fail, operation_id:{}".format(message.operation_id))
+            Metrics().observe("executor.result_latency", time.time() - put_time)
+        Metrics().set("executor.result_backlog", len(self._results))
+
+    def get_retry_policy(self, operation):
+        """
+        获取操作的重试策略
+
+        :param Operation operation: operation操作对象
+        :return: 重试策略，None为不重试
+        :rtype: RetryPolicy
+        """
+        return self.retry_policy
+
+    def _failure_message(self, operation, error):
+        """
+        生成执行失败的结果消息，可重试时为 ``RETRY_MESSAGE`` ，否则为执行结果为错误的完成消息
+        """
+        policy = self.get_retry_policy(operation)
+        attempt = len(operation.get_attempts()) + 1
+        if policy is not None and policy.should_retry(error, attempt):
+            params = {"error": "err:{}".format(error), "attempt": attempt, "delay": policy.delay(attempt)}
+            return framework.OperationMessage("RETRY_MESSAGE", operation.operation_id, params)
+        return framework.OperationMessage("COMPLETE_MESSAGE", operation.operation_id, "err:{}".format(error))
+
+    def _schedule_retry(self, message):
+        """
+        记录本次失败，并在退避时间后重新发送决策消息
+        """
+        guardian_context = context.GuardianContext.get_context()
+        operation = guardian_context.get_operation(message.operation_id)
+        delay = message.params["delay"]
+        operation.record_attempt(message.params["error"], time.time() + delay)
+        guardian_context.update_operation(operation.operation_id, operation)
+        self._message_pump.put_later(
+            framework.OperationMessage("DECIDED_MESSAGE", message.operation_id, {}), delay)
+        Metrics().incr("executor.retries")
+        log.w("operation {} attempt {} fail, retry in {:.1f}s, error:{}".format(
+            message.operation_id, message.params["attempt"], delay, message.params["error"]))
+
+    def _run_operation(self, operation):
+        """
+        按执行方式执行准入的操作
+        """
+        if self._backend == self.BACKEND_INLINE:
+            run_process(self, operation)
+        elif self._backend == self.BACKEND_THREAD:
+            self._process_pool.apply_async(run_process, (self, operation, ))
+        else:
+            task_id = self._process_pool.apply_async(run_operation, (operation, ))
+            self._inflight[operation.operation_id] = (task_id, self._operation_timeout(operation))
+
+    def concurrency_key(self, operation):
+        """
+        获取操作并发限制的键，相同键的操作受同一并发数限制
+
+        :param Operation operation: operation操作对象
+        :return: 键，None为不限制
+        :rtype: str
+        """
+        return operation.operation_params.get(self._concurrency_key)
+
+    def priority(self, operation):
+        """
+        获取操作的优先级
+
+        :param Operation operation: operation操作对象
+        :return: 优先级，值越大越优先
+        :rtype: int
+        """
+        return int(operation.operation_params.get(self._priority_key, 0))
+
+    def deadline(self, operation):
+        """
+        获取操作的截止时间
+
+        :param Operation operation: operation操作对象
+        :return: 截止时间（时间戳），None为无截止时间
+        :rtype: float
+        """
+        deadline = operation.operation_params.get(self._deadline_key)
+        return float(deadline) if deadline is not None else None
+
+    def _submit(self, operation):
+        """
+        将操作提交至准入调度，到达时间取操作首个阶段的时间
+        """
+        periods = operation.periods.periods
+        arrival = periods[0].timestamp if periods else None
+        self._scheduler.submit(operation.operation_id, self.concurrency_key(operation), operation,
+                               self.priority(operation), self.deadline(operation), arrival)
+
+    def set_concurrency_limit(self, key, limit):
+        """
+        设置指定键的并发数
+
+        :param str key: 键
+        :param int limit: 并发数，0为不限制，None为恢复默认值
+        :return: 无返回
+        :rtype: None
+        """
+        self._scheduler.set_limit(key, limit)
+        self._dispatch()
+
+    def admission(self):
+        """
+        获取准入情况
+
+        :return: 总执行中、排队中的操作数，及各键执行中、排队中的操作数
+        :rtype: dict
+        """
+        return self._scheduler.stats()
+
+    def _dispatch(self):
+        """
+        准入排队中的操作并分发执行
+        """
+        for _, _, operation in self._scheduler.admit():
+            self.on_pre_action(operation)
+            self._run_operation(operation)
+        Metrics().set("executor.{}.admission".format(self.__class__.__name__), self._scheduler.stats())
 
     def _persist_operation(self, message):
         """
@@ -141,16 +565,14 @@ class MultiProcessExecutor(framework.BaseExecutor):
         """
         if message.name == "DECIDED_MESSAGE":
             operation = self._persist_operation(message)
-            self.on_pre_action(operation)
-            self._process_pool.apply_async(run_process, (self, operation, ))
+            self._submit(operation)
+            self._dispatch()
 
         elif message.name == "IDLE_MESSAGE":
-            try:
-                ret = self._result_queue.get(block=False)
-            except Queue.Empty:
-                pass
-            else:
-                return ret
+            if self._results:
+                self._send_results()
+            if self._scheduler.waiting:
+                self._dispatch()
         elif message.name in self._concerned_message_list:
             self.on_extend_message(message)
         else:
@@ -167,6 +589,15 @@ class MultiProcessExecutor(framework.BaseExecutor):
         """
         pass
 
+    def on_timeout(self, operation_id):
+        """
+        操作执行超时后的清理动作，在执行该操作的子进程被终止之后、发送超时的完成消息之前调用
+
+        :param str operation_id: 操作id
+        :return: 无返回
+        """
+        pass
+
     def on_pre_action(self, operation):
         """
         操作前的前置动作，在开启子进程执行操作之前调用
@@ -192,13 +623,16 @@ class MultiProcessExecutor(framework.BaseExecutor):
             log.i("operation execute")
             log.d("operation execute, param:%s" % str(operation.operation_params))
             ret = self.execute(operation)
+            # 协程形式的execute在当前线程中同步执行
+            if coroutine.is_coroutine(ret):
+                ret = coroutine.run_sync(ret)
         except Exception as e:
             log.f("execute_message fail")
-            ret = "err:{}".format(e)
-
-        message = framework.OperationMessage(
-            "COMPLETE_MESSAGE", operation.operation_id, ret)
-        self._result_queue.put(message)
+            message = self._failure_message(operation, e)
+        else:
+            message = framework.OperationMessage(
+                "COMPLETE_MESSAGE", operation.operation_id, ret)
+        self._put_result(message)
         log.Logger.clearoid()
         return
 
@@ -221,14 +655,17 @@ class CallbackExecutor(MultiProcessExecutor):
     """
     _exec_key = ".inner_executor_key"
 
-    def __init__(self, func_set, process_count=1):
+    def __init__(self, func_set, process_count=1, backend=MultiProcessExecutor.BACKEND_PROCESS,
+                 max_process_count=None):
         """
         初始化方法
 
         :param BaseExecFuncSet func_set: 回调方法对象
         :param int process_count: 进程数
+        :param str backend: 执行方式，可选process、thread、inline
+        :param int max_process_count: 进程池自动伸缩的最大进程数
         """
-        super(CallbackExecutor, self).__init__(process_count)
+        super(CallbackExecutor, self).__init__(process_count, backend, max_process_count)
         self._func_set = func_set
 
     def execute(self, operation):
@@ -242,6 +679,18 @@ class CallbackExecutor(MultiProcessExecutor):
         return self._func_set.exec_func(
             operation.operation_params[self._exec_key], operation.operation_params)
 
+    def get_retry_policy(self, operation):
+        """
+        获取操作的重试策略，优先使用回调方法上以 ``retry`` 装饰器声明的策略，其次为执行器的策略
+
+        :param Operation operation: operation操作对象
+        :return: 重试策略，None为不重试
+        :rtype: RetryPolicy
+        """
+        func = getattr(self._func_set, operation.operation_params.get(self._exec_key, ""), None)
+        policy = getattr(func, "retry_policy", None)
+        return policy if policy is not None else self.retry_policy
+
 
 class StateMachineExecutor(MultiProcessExecutor, graph.PersistedStateMachineHelper):
     """
@@ -254,21 +703,34 @@ class StateMachineExecutor(MultiProcessExecutor, graph.PersistedStateMachineHelp
     .. Note:: ``StateMachineExecutor`` 状态机执行器额外关注控制消息，并在控制消息到来时
             传递给运行中的状态机，用户可用状态机session.control_message获得该控制消息
             的参数。
+
+    控制消息保存在共享内存的 ``ControlTable`` 中，状态机每次轮转读取控制消息时无需进程间通信。
+    控制消息表的槽位数及每条控制消息序列化后的最大字节数分别由 ``EXECUTOR_CONTROL_SLOTS`` （默认1024）、
+    ``EXECUTOR_CONTROL_SLOT_SIZE`` （默认4096）配置
     """
+    CONTROL_SLOTS_NAME = "EXECUTOR_CONTROL_SLOTS"
+    CONTROL_SLOT_SIZE_NAME = "EXECUTOR_CONTROL_SLOT_SIZE"
+    _shared_attrs = MultiProcessExecutor._shared_attrs + ("_control_message",)
 
-    def __init__(self, nodes, process_count=1):
+    def __init__(self, nodes, process_count=1, backend=MultiProcessExecutor.BACKEND_PROCESS,
+                 max_process_count=None):
         """
         初始化方法
 
         :param list(Node) nodes: 节点列表
         :param int process_count: 最大进程数
+        :param str backend: 执行方式，可选process、thread、inline。inline方式下状态机在消息泵线程中运行至结束，
+               运行期间无法接收控制消息
+        :param int max_process_count: 进程池自动伸缩的最大进程数
         """
-        super(StateMachineExecutor, self).__init__(process_count)
+        super(StateMachineExecutor, self).__init__(process_count, backend, max_process_count)
         self._nodes = nodes
         self._concerned_message_list.append("CONTROL_MESSAGE")
 
         self._graphs = {}
-        self._control_message = self._manager.dict()
+        self._control_message = ControlTable(
+            string.atoi(config.GuardianConfig.get(self.CONTROL_SLOTS_NAME, "1024")),
+            string.atoi(config.GuardianConfig.get(self.CONTROL_SLOT_SIZE_NAME, "4096")))
 
     def execute(self, operation):
         """
@@ -280,7 +742,10 @@ class StateMachineExecutor(MultiProcessExecutor, graph.PersistedStateMachineHelp
         """
         state_machine = self._create_state_machine(operation, self._nodes)
         # 状态机启动
-        state_machine.start()
+        try:
+            state_machine.start()
+        finally:
+            self._graphs.pop(state_machine.session.id, None)
         try:
             del self._control_message[state_machine.session.id]
         except Exception as e:
@@ -319,13 +784,25 @@ class StateMachineExecutor(MultiProcessExecutor, graph.PersistedStateMachineHelp
                 message_name,
                 str(session.id), params)
             try:
-                self._result_queue.put(notice)
+                self._put_result(notice)
             except IOError:
                 log.f("result_queue.put fail, retry")
-                self._result_queue.put(notice)
+                self._put_result(notice)
         else:
             log.e("operation persist but session is None or reason unknown")
 
+    def on_timeout(self, operation_id):
+        """
+        清理超时状态机的控制消息
+
+        :param str operation_id: 操作id
+        :return: 无返回
+        """
+        try:
+            del self._control_message[operation_id]
+        except KeyError:
+            pass
+
     def get_control_message(self, session):
         """
         获取当前是否有控制消息需要处理。如果没有，则应返回None, None
@@ -410,3 +887,435 @@ class StateMachineExecutor(MultiProcessExecutor, graph.PersistedStateMachineHelp
             'control_id': uuid.uuid1()
         }
         self._control_message[message.operation_id] = copy.deepcopy(control)
+
+
+class AsyncExecutor(MultiProcessExecutor):
+    """
+    协程执行器。 ``execute`` 可以实现为协程（生成器函数，见 ``ark.are.coroutine`` ），所有操作在同一个事件循环中并发执行，
+    适用于“调用接口、轮询、校验”等以等待为主的大量并发操作。事件循环所在的线程（thread方式，默认）或子进程（process方式）
+    依次从输入队列中取出准入的操作，操作完成后与 ``MultiProcessExecutor`` 一样将完成消息放入结果队列::
+
+        class DeployExecutor(AsyncExecutor):
+            def execute(self, operation):
+                task_id = yield coroutine.call(api.deploy, operation.operation_params["service"])
+                while (yield coroutine.call(api.status, task_id)) == "running":
+                    yield coroutine.sleep(10)
+                raise coroutine.Return({"task_id": task_id})
+
+    ``execute`` 不是协程时在事件循环中直接执行，会阻塞其他操作。协程中的阻塞调用应通过 ``coroutine.call`` 在辅助线程中执行，
+    辅助线程数由配置项 ``EXECUTOR_ASYNC_THREADS`` 指定（默认16）。同时执行的操作数默认为 ``concurrency`` ，
+    超出的操作在准入调度中排队。操作的超时时间与 ``MultiProcessExecutor`` 相同，超时后协程在当前yield处被关闭
+
+    .. Note:: 事件循环中的协程交替执行，日志中的operation_id不随协程切换
+    """
+    ASYNC_THREADS_NAME = "EXECUTOR_ASYNC_THREADS"
+    _STOP_TIMEOUT = 5
+
+    def __init__(self, concurrency=1000, backend=MultiProcessExecutor.BACKEND_THREAD):
+        """
+        初始化方法
+
+        :param int concurrency: 同时执行的最大操作数
+        :param str backend: 事件循环的运行方式，可选thread、process
+        :raises ETypeMismatch: 参数类型不匹配
+        """
+        self._init_async(concurrency, backend)
+        super(AsyncExecutor, self).__init__(1, backend)
+
+    def _init_async(self, concurrency, backend):
+        """
+        检查并保存协程执行器的参数，需在父类初始化之前调用
+        """
+        if not isinstance(concurrency, int) or concurrency < 1 or concurrency > 100000:
+            raise exception.ETypeMismatch("param concurrency must be 1-100000 integer")
+        if backend not in (self.BACKEND_THREAD, self.BACKEND_PROCESS):
+            raise exception.ETypeMismatch("unsupported async executor backend:{}".format(backend))
+        self._concurrency = concurrency
+        self._inbox = None
+        self._loop_worker = None
+        self._loop = None
+
+    def __getstate__(self):
+        self_dict = super(AsyncExecutor, self).__getstate__()
+        for attr in ("_inbox", "_loop_worker", "_loop"):
+            self_dict.pop(attr, None)
+        return self_dict
+
+    def _default_global_limit(self):
+        return self._concurrency
+
+    def active(self):
+        self._scheduler.clear()
+        name = "{}-loop".format(self.__class__.__name__)
+        if self._backend == self.BACKEND_PROCESS:
+            self._inbox = multiprocessing.Queue()
+            self._loop_worker = multiprocessing.Process(target=self._loop_run, name=name)
+        else:
+            self._inbox = Queue.Queue()
+            self._loop_worker = threading.Thread(target=self._loop_run, name=name)
+        self._loop_worker.daemon = True
+        self._loop_worker.start()
+        self._start_collector()
+
+    def inactive(self):
+        self._inbox.put(None)
+        self._loop_worker.join(self._STOP_TIMEOUT)
+        if self._backend == self.BACKEND_PROCESS and self._loop_worker.is_alive():
+            self._loop_worker.terminate()
+        self._loop_worker = None
+        self._stop_collector()
+
+    def _run_operation(self, operation):
+        """
+        将准入的操作交给事件循环
+        """
+        self._inbox.put(operation)
+
+    def _loop_run(self):
+        """
+        事件循环线程（进程）主函数
+        """
+        if self._backend == self.BACKEND_PROCESS:
+            # 不继承父进程（如Guardian）的SIGTERM处理函数，保证terminate可以终止事件循环进程
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        self._loop = coroutine.EventLoop(
+            string.atoi(config.GuardianConfig.get(self.ASYNC_THREADS_NAME, "16")))
+        self._loop.run(self._inbox, self._on_operation)
+
+    def _on_operation(self, operation):
+        """
+        在事件循环中启动操作，收到None时停止事件循环
+        """
+        if operation is None:
+            self._loop.stop()
+            return
+        log.i("operation execute, operation_id:{}".format(operation.operation_id))
+        try:
+            ret = self.execute(operation)
+        except Exception as e:
+            log.f("execute_message fail, operation_id:{}".format(operation.operation_id))
+            self._put_result(self._failure_message(operation, e))
+            return
+        if not coroutine.is_coroutine(ret):
+            self._complete(operation.operation_id, ret)
+            return
+        task = self._loop.spawn(ret, self._operation_timeout(operation))
+        task.add_done_callback(lambda done: self._on_done(operation, done))
+
+    def _on_done(self, operation, task):
+        """
+        协程结束后发送完成消息，执行失败时按重试策略发送重试消息
+        """
+        operation_id = operation.operation_id
+        if task.exc_info is None:
+            self._complete(operation_id, task.result)
+            return
+        error = task.exc_info[1]
+        if isinstance(error, exception.ETimeout):
+            Metrics().incr("executor.timeouts")
+            log.e("operation {} {}".format(operation_id, error))
+            self.on_timeout(operation_id)
+            self._complete(operation_id, "err:{}".format(error))
+            return
+        log.e("execute_message fail, operation_id:{}, error:{}".format(operation_id, error))
+        self._put_result(self._failure_message(operation, error))
+
+    def _complete(self, operation_id, ret):
+        """
+        将完成消息放入结果队列
+        """
+        self._put_result(framework.OperationMessage("COMPLETE_MESSAGE", operation_id, ret))
+
+
+class AsyncStateMachineExecutor(AsyncExecutor, StateMachineExecutor):
+    """
+    协程状态机执行器。状态机在事件循环中以协程方式运行，节点的process可以实现为协程，
+    通过 ``raise coroutine.Return(next_state)`` 返回下一个状态。session的持久化、控制消息及
+    ``STATE_COMPLETE_MESSAGE`` 、 ``PERSIST_SESSION_MESSAGE`` 与 ``StateMachineExecutor`` 相同，
+    两者持久化的session可以互相加载
+    """
+
+    def __init__(self, nodes, concurrency=1000, backend=MultiProcessExecutor.BACKEND_THREAD):
+        """
+        初始化方法
+
+        :param list(Node) nodes: 节点列表
+        :param int concurrency: 同时运行的最大状态机数
+        :param str backend: 事件循环的运行方式，可选thread、process
+        """
+        self._init_async(concurrency, backend)
+        StateMachineExecutor.__init__(self, nodes, 1, backend)
+
+    def execute(self, operation):
+        """
+        以协程方式运行状态机
+
+        :param Operation operation: operation操作对象
+        :return: 协程
+        :rtype: generator
+        """
+        state_machine = self._create_state_machine(operation, self._nodes)
+        try:
+            yield state_machine.start_async()
+        finally:
+            self._graphs.pop(state_machine.session.id, None)
+        try:
+            del self._control_message[state_machine.session.id]
+        except KeyError:
+            pass
+        log.i("state machine run finished, operationId:%s" % format(state_machine.session.id))
+
+
+class RemoteExecutor(MultiProcessExecutor):
+    """
+    远程执行器。操作不在本机执行，准入后放入任务代理（见 ``ark.are.broker`` ），由 ``ark worker`` 启动的工作进程
+    （可以在其他机器上）拉取执行，执行能力可以通过增加工作进程水平扩展，不受主实例所在机器的限制。
+    工作进程交回的完成消息、状态机的 ``STATE_COMPLETE_MESSAGE`` 及 ``PERSIST_SESSION_MESSAGE`` 由后台线程从代理取回，
+    与本地执行的结果一样在空闲消息到来时发送至消息泵。控制消息经代理转发给执行该操作的工作进程
+
+    代理地址由参数或配置项 ``EXECUTOR_BROKER_ADDRESS`` 指定，默认为 ``127.0.0.1:8650`` 。
+    放入代理的操作数（执行中及代理中排队的）受 ``concurrency`` 限制，超出的操作在本地准入调度中按优先级排队。
+    代理不可用时，操作退回准入调度，间隔1秒后重试
+
+    .. Note:: 操作按id幂等放入代理，故障切换后新的主实例重新分发未完成的操作时，代理中未完成的任务不会重复执行，
+             只更新结果的接收方。已完成但结果未被取回的操作会再次执行
+    """
+    BROKER_ADDRESS_NAME = "EXECUTOR_BROKER_ADDRESS"
+    _RETRY_INTERVAL = 1
+    _FETCH_TIMEOUT = 1
+
+    def __init__(self, concurrency=100, address=None):
+        """
+        初始化方法
+
+        :param int concurrency: 放入代理的最大操作数
+        :param str address: 代理地址，格式为host:port或unix:/path
+        :raises ETypeMismatch: 参数类型不匹配
+        """
+        if not isinstance(concurrency, int) or concurrency < 1 or concurrency > 100000:
+            raise exception.ETypeMismatch("param concurrency must be 1-100000 integer")
+        self._concurrency = concurrency
+        self._address = address or config.GuardianConfig.get(self.BROKER_ADDRESS_NAME, broker.DEFAULT_ADDRESS)
+        super(RemoteExecutor, self).__init__(1, self.BACKEND_THREAD)
+        self._concerned_message_list.append("CONTROL_MESSAGE")
+        self._client = None
+        self._fetching = False
+        self._fetcher = None
+        self._reply_to = None
+        self._retry_at = 0
+
+    def _default_global_limit(self):
+        return self._concurrency
+
+    def active(self):
+        self._scheduler.clear()
+        # 分区模式下各实例分别取回自己的结果
+        guardian_id = config.GuardianConfig.get(config.GUARDIAN_ID_NAME)
+        member = context.GuardianContext.get_member()
+        self._reply_to = guardian_id if member is None else "{}/{}".format(guardian_id, member)
+        self._client = broker.BrokerClient(self._address)
+        self._fetching = True
+        self._fetcher = threading.Thread(target=self._fetch_run)
+        self._fetcher.setDaemon(True)
+        self._fetcher.start()
+        self._start_collector()
+
+    def inactive(self):
+        self._fetching = False
+        self._fetcher.join()
+        self._client.close()
+        self._stop_collector()
+
+    def _fetch_run(self):
+        """
+        取回线程，持续从代理取回结果并放入结果队列
+        """
+        client = broker.BrokerClient(self._address)
+        while self._fetching:
+            try:
+                messages = client.fetch(self._reply_to, self._result_batch, self._FETCH_TIMEOUT)
+            except Exception as e:
+                log.f("fetch results from broker fail")
+                time.sleep(self._RETRY_INTERVAL)
+                continue
+            for message in messages:
+                self._put_result(message)
+        client.close()
+
+    def _dispatch(self):
+        if time.time() < self._retry_at:
+            return
+        super(RemoteExecutor, self)._dispatch()
+
+    def _run_operation(self, operation):
+        """
+        将准入的操作放入代理，失败时退回准入调度
+        """
+        if time.time() >= self._retry_at:
+            try:
+                self._client.put(operation.operation_id, operation, self._reply_to)
+                return
+            except Exception as e:
+                log.f("put operation to broker fail, operation_id:{}".format(operation.operation_id))
+                self._retry_at = time.time() + self._RETRY_INTERVAL
+        self._scheduler.release(operation.operation_id)
+        self._submit(operation)
+
+    @context.GuardianContext.new_action
+    def send(self, message):
+        """
+        发送消息至消息泵，工作进程交回的状态机checkpoint同样更新为action
+
+        :param Message message: 消息对象
+        :return: 无返回
+        :rtype: None
+        """
+        return super(RemoteExecutor, self).send(message)
+
+    def on_extend_message(self, message):
+        """
+        将控制消息转发给执行该操作的工作进程
+
+        :param Message message: 消息对象
+        :return: 无返回
+        :rtype: None
+        """
+        try:
+            self._client.control(message.operation_id, message)
+        except Exception as e:
+            log.f("send control message to broker fail, operation_id:{}".format(message.operation_id))
+
+
+class RemoteWorker(object):
+    """
+    远程执行的工作进程，由 ``ark worker`` 启动。从任务代理拉取操作，使用本地的执行器（ ``MultiProcessExecutor`` 的任意子类，
+    包括 ``StateMachineExecutor`` ）的 ``message_handler`` 执行，执行器放入结果队列的消息改为交回代理。
+    同时执行的操作数为 ``concurrency`` ，每个操作占用一个线程。
+
+    工作进程每 ``BROKER_HEARTBEAT_INTERVAL`` 秒（默认3）向代理发送心跳，并取回发给执行中操作的控制消息。
+    重新分配的状态机操作从代理保存的最近一次session继续执行。
+    最终结果交回失败时持续重试直至代理接受或拒绝；工作进程停止后不再重试，停止心跳后由代理重新分配该操作
+    """
+    HEARTBEAT_INTERVAL_NAME = "BROKER_HEARTBEAT_INTERVAL"
+    _POLL_TIMEOUT = 5
+    _RETRY_INTERVAL = 1
+    _RESULT_RETRIES = 3
+
+    def __init__(self, executor, address=None, concurrency=1, worker_id=None):
+        """
+        初始化方法
+
+        :param MultiProcessExecutor executor: 执行器
+        :param str address: 代理地址，格式为host:port或unix:/path
+        :param int concurrency: 同时执行的操作数
+        :param str worker_id: 工作进程id，默认由主机名、进程号及随机串组成
+        """
+        self._executor = executor
+        self._address = address or config.GuardianConfig.get(
+            RemoteExecutor.BROKER_ADDRESS_NAME, broker.DEFAULT_ADDRESS)
+        self._concurrency = concurrency
+        self._worker_id = worker_id or "{}-{}-{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self._heartbeat_interval = string.atof(config.GuardianConfig.get(self.HEARTBEAT_INTERVAL_NAME, "3"))
+        self._local = threading.local()
+        self._running = False
+        executor.set_result_sink(self._send_result)
+
+    @property
+    def worker_id(self):
+        """
+        工作进程id
+        """
+        return self._worker_id
+
+    def run(self):
+        """
+        运行工作进程，直至stop或收到KeyboardInterrupt
+
+        :return: 无返回
+        :rtype: None
+        """
+        self._running = True
+        threads = [threading.Thread(target=self._heartbeat_run)]
+        threads += [threading.Thread(target=self._work_run) for _ in range(self._concurrency)]
+        for thread in threads:
+            thread.setDaemon(True)
+            thread.start()
+        log.i("worker {} started, broker:{}".format(self._worker_id, self._address))
+        try:
+            while self._running:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._running = False
+
+    def stop(self):
+        """
+        停止工作进程，执行中的操作执行完成后退出
+
+        :return: 无返回
+        :rtype: None
+        """
+        self._running = False
+
+    def _work_run(self):
+        """
+        执行线程，持续拉取并执行操作
+        """
+        client = broker.BrokerClient(self._address)
+        self._local.client = client
+        while self._running:
+            try:
+                task = client.get(self._worker_id, self._POLL_TIMEOUT)
+            except Exception as e:
+                log.f("get task from broker fail")
+                time.sleep(self._RETRY_INTERVAL)
+                continue
+            if task is None:
+                continue
+            _, operation, checkpoint = task
+            if checkpoint is not None:
+                operation.session = checkpoint
+            self._executor.message_handler(operation)
+        client.close()
+
+    def _send_result(self, message):
+        """
+        将执行器的结果消息交回代理，状态机的session作为checkpoint
+        """
+        checkpoint = None
+        if message.name in ("STATE_COMPLETE_MESSAGE", "PERSIST_SESSION_MESSAGE"):
+            checkpoint = message.params.get("session")
+        final = message.name in MultiProcessExecutor._FINAL_MESSAGES
+        attempt = 0
+        # checkpoint丢失只影响重新分配后的续跑位置，最终结果丢失则操作永远不会完成
+        while final and self._running or attempt < self._RESULT_RETRIES:
+            attempt += 1
+            try:
+                if not self._local.client.result(self._worker_id, message.operation_id, message, final, checkpoint):
+                    log.w("result of {} rejected by broker".format(message.operation_id))
+                return
+            except exception.EFailedRequest as e:
+                log.e("broker refuse result, operation_id:{}, err:{}".format(message.operation_id, e))
+                return
+            except Exception as e:
+                log.f("send result to broker fail, operation_id:{}".format(message.operation_id))
+                time.sleep(self._RETRY_INTERVAL)
+        log.e("give up {} of {} after {} attempts".format(message.name, message.operation_id, attempt))
+
+    def _heartbeat_run(self):
+        """
+        心跳线程，定期发送心跳并将取回的控制消息交给执行器
+        """
+        client = broker.BrokerClient(self._address)
+        while self._running:
+            try:
+                controls = client.heartbeat(self._worker_id)
+            except Exception as e:
+                log.f("send heartbeat to broker fail")
+                controls = {}
+            for messages in controls.itervalues():
+                for message in messages:
+                    self._executor.on_extend_message(message)
+            time.sleep(self._heartbeat_interval)
+        client.close()
@@ -12,8 +12,12 @@
 * ``Listener`` 消息监听器。一个消息监听器关注某些类型的消息，并在消息到达后执行对应的操作，感知、决策、执行器都为其派生类
 * ``MessagePump`` 消息泵，实现了框架核心运行机制，监听器绑定消息泵后，当各监听器关注的消息到达时，由消息泵进行消息分发。
 """
+import os
 import time
 import copy
+import heapq
+import signal
+import itertools
 import multiprocessing
 
 import ark.are.context as context
@@ -163,6 +167,17 @@ class Listener(object):
         """
         pass
 
+    def partition_key(self, message):
+        """
+        获取消息所属操作的分区键。分区模式下，新操作按分区键归属于某个实例，仅由该实例处理。
+        默认使用操作id，子类可重写，如使用消息参数中的机器名，使同一机器的操作由同一实例处理
+
+        :param OperationMessage message: 消息对象
+        :return: 分区键
+        :rtype: str
+        """
+        return message.operation_id
+
     def list(self):
         """
         返回所有关注消息的名字列表
@@ -233,9 +248,12 @@ class MessagePump(object):
     消息泵，控制消息的生成处理流转。
 
     消息泵会定期取出消息，并分发给关注此类型消息的处理器，以驱动消息的处理。
+    通过 ``put_later`` 发送的延迟消息在到期后进入消息队列，等待期间不占用任何处理器。
 
     """
     _message_queue = []
+    _delayed = []
+    _delayed_seq = itertools.count()
     _listener_list = []
     _listener_table = {}
     _stop_tag = True
@@ -341,6 +359,36 @@ class MessagePump(object):
         """
         self._message_queue.append(message)
 
+    def put_later(self, message, delay):
+        """
+        发送一个延迟消息至消息泵，消息在delay秒后进入消息队列。延迟消息不持久化，
+        故障切换后由使用者根据持久化的状态重新发送
+
+        :param Message message: 消息对象
+        :param float delay: 延迟时间，单位秒
+        :return: 无返回
+        :rtype: None
+        """
+        heapq.heappush(MessagePump._delayed, (time.time() + delay, next(self._delayed_seq), message))
+
+    def has_delayed(self, operation_id):
+        """
+        判断操作是否有等待中的延迟消息
+
+        :param str operation_id: 操作id
+        :return: 是否有延迟消息
+        :rtype: bool
+        """
+        return any(getattr(item[2], "operation_id", None) == operation_id for item in self._delayed)
+
+    def _fire_delayed(self):
+        """
+        将到期的延迟消息放入消息队列
+        """
+        now = time.time()
+        while self._delayed and self._delayed[0][0] <= now:
+            self.put(heapq.heappop(self._delayed)[2])
+
     def on_persistence(self):
         """
         数据持久化操作
@@ -351,6 +399,17 @@ class MessagePump(object):
         """
         pass
 
+    def on_rebalance(self):
+        """
+        分区调整操作，每次分发消息前在消息泵线程中调用
+
+        .. Note:: 默认不进行任何操作，分区模式下由 ``GuardianFramework`` 重写
+
+        :return: 无返回
+        :rtype: None
+        """
+        pass
+
     def run_loop(self, idle_sleep):
         """
         消息泵驱动逻辑。从消息泵中取消息并分发给关注此消息的处理器执行。
@@ -362,6 +421,8 @@ class MessagePump(object):
         :rtype: None
         """
         while not self._stop_tag:
+            self.on_rebalance()
+            self._fire_delayed()
             if not self._message_queue:
                 self.put(IDLEMessage())
                 is_idle = True
@@ -414,12 +475,15 @@ class GuardianFramework(MessagePump):
     _context = None
     _is_leader = False
     _run_tag = True
+    _leader_election = None
+    _pending_partition = None
     __TIME_INTERVAL = 3
     __IDLE_INTERVAL = 0.0001
 
     def start(self, pmode):
         """
         Guardian启动函数，当Guardian获得领导权后，消息泵开始工作。
+        收到SIGTERM或调用 ``stop`` 后退出，退出前放弃领导权
 
         :param str pmode: 所要使用的持久化类型，可选zookeeper或者local
         :return: 无返回
@@ -427,16 +491,44 @@ class GuardianFramework(MessagePump):
         """
         ArkServer().start()
         ha.HAMaster.init_environment()
-        leader_election = ha.HAMaster(self.obtain_leader, self.release_leader)
-        leader_election.create_instance()
-        leader_election.choose_master()
-        while self._run_tag:
-            if self._is_leader:
-                self.run_loop(self.__IDLE_INTERVAL)
-            else:
-                time.sleep(self.__TIME_INTERVAL)
-        else:
-            pass
+        self._leader_election = ha.HAMaster.create(self.obtain_leader, self.release_leader,
+                                                   rebalance_func=self.rebalance)
+        pid = os.getpid()
+
+        def on_sigterm(signum, frame):
+            # fork出的子进程会继承此处理函数，子进程中恢复默认处理并重新发送信号，使其可以被终止
+            if os.getpid() != pid:
+                signal.signal(signum, signal.SIG_DFL)
+                os.kill(os.getpid(), signum)
+                return
+            self.stop()
+
+        try:
+            signal.signal(signal.SIGTERM, on_sigterm)
+        except ValueError:
+            # 非主线程中启动时无法注册信号处理函数
+            log.w("guardian not started in main thread, SIGTERM is not handled")
+        self._leader_election.create_instance()
+        self._leader_election.choose_master()
+        try:
+            while self._run_tag:
+                if self._is_leader:
+                    self.run_loop(self.__IDLE_INTERVAL)
+                else:
+                    time.sleep(self.__TIME_INTERVAL)
+        finally:
+            log.i("guardian stopping")
+            self._leader_election.stop()
+
+    def stop(self):
+        """
+        停止Guardian。消息泵处理完当前消息后退出，主实例放弃领导权，使其他实例可以立即接管
+
+        :return: 无返回
+        :rtype: None
+        """
+        self._run_tag = False
+        self._stop_tag = True
 
     def obtain_leader(self):
         """
@@ -446,27 +538,88 @@ class GuardianFramework(MessagePump):
         :rtype: None
         """
         self._is_leader = True
+        partition = self._take_pending_partition()
+        if partition:
+            context.GuardianContext.set_partition(*partition)
         self._context = context.GuardianContext.load_context()
         MessagePump._message_queue = self._context.message_list
-        self._recover_executing_message()
+        MessagePump._delayed = []
         self._context.update_lock(True)
+        self._recover_executing_message()
         for listener in self._listener_list:
             listener.bind_pump(self)
             listener.active()
         self._stop_tag = False
     
-    def _recover_executing_message(self):
-        for operation in self._context.operations.itervalues():
+    def _recover_executing_message(self, operation_ids=None):
+        """
+        恢复未完成操作的执行消息。分区模式下恢复执行或已在其他实例开始执行的操作记录为由本实例执行
+
+        :param operation_ids: 需要恢复的操作id，默认恢复所有操作
+        :return: 无返回
+        :rtype: None
+        """
+        for operation in self._context.operations.values():
+            if operation_ids is not None and operation.operation_id not in operation_ids:
+                continue
             if operation.status != "FINISH":
                 operation_id = operation.operation_id
                 ret = self._context.is_operation_id_in_message_list(operation_id)
-                if not ret:
+                if ret or self.has_delayed(operation_id):
+                    if operation.get_holder() is not None:
+                        self._context.claim_operation(operation)
+                else:
+                    self._context.claim_operation(operation)
                     name = "DECIDED_MESSAGE"
                     params_cp = operation.operation_params
                     message = OperationMessage(name, operation_id, copy.deepcopy(params_cp))
                     log.i("recover_message operation_id:{}".format(
                         operation_id))
-                    self._context.message_list.append(message)
+                    # 等待重试的操作在原定的重试时间到达后恢复执行
+                    attempts = operation.get_attempts()
+                    remaining = attempts[-1]["retry_at"] - time.time() if attempts else 0
+                    if remaining > 0:
+                        self.put_later(message, remaining)
+                    else:
+                        self._context.message_list.append(message)
+
+    def rebalance(self, ring, member):
+        """
+        分区模式下成员变化的回调。新的分区划分在消息泵线程中生效，避免与消息处理并发修改context
+
+        :param HashRing ring: 一致性哈希环
+        :param str member: 本实例的成员名
+        :return: 无返回
+        :rtype: None
+        """
+        self._pending_partition = (ring, member)
+
+    def _take_pending_partition(self):
+        """
+        取出待生效的分区划分
+        """
+        partition, self._pending_partition = self._pending_partition, None
+        return partition
+
+    def on_rebalance(self):
+        """
+        使新的分区划分生效：释放不再归属本实例的操作，接管新归属的操作并恢复其执行消息。
+        无分区变化时接管其他实例已执行完成或已离开哈希环的暂缓接管操作
+
+        :return: 无返回
+        :rtype: None
+        """
+        partition = self._take_pending_partition()
+        if partition:
+            context.GuardianContext.set_partition(*partition)
+            acquired = self._context.rebalance()
+            log.i("partition rebalanced, acquired operations:{}".format(acquired))
+        else:
+            acquired = self._context.acquire_deferred()
+            if not acquired:
+                return
+        self._recover_executing_message(acquired)
+        self._context.save_context()
 
     def release_leader(self):
         """
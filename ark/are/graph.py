@@ -31,6 +31,7 @@ import copy
 import ark.are.exception as exception
 import ark.are.log as log
 import ark.are.context as context
+import ark.are.coroutine as coroutine
 
 
 class BaseGraph(object):
@@ -380,6 +381,17 @@ class StateMachine(BaseGraph):
         :raise ECheckFailed: 检查失败
         :raise EUnknownNode: 未知节点
         """
+        coroutine.run_sync(self.run_next_async())
+
+    def run_next_async(self):
+        """
+        以协程方式进行一次状态轮转。状态的process可以是协程，通过 ``raise coroutine.Return(next_state)`` 返回下一个状态
+
+        :return: 协程
+        :rtype: generator
+        :raise ECheckFailed: 检查失败
+        :raise EUnknownNode: 未知节点
+        """
         state = self.get_node(self._current_node)
         if not state.reentrance and self._nodes_process[state.name]:
             raise exception.ECheckFailed(
@@ -391,6 +403,8 @@ class StateMachine(BaseGraph):
             self._nodes_process[state.name] = True
             current_state = state.process(self._session, self._current_node,
                                           self._nodes_process)
+            if coroutine.is_coroutine(current_state):
+                current_state = yield current_state
             log.d("node process finished, next node:{}".format(
                 current_state))
             if current_state == self._ARK_NODE_END:
@@ -511,6 +525,16 @@ class PersistedStateMachine(StateMachine):
         :return: 无返回
         :rtype: None
         """
+        coroutine.run_sync(self.start_async())
+
+    def start_async(self):
+        """
+        以协程方式启动状态机，逻辑与start相同。节点的process为协程时，在事件循环中等待其完成，
+        不阻塞事件循环中的其他状态机
+
+        :return: 协程
+        :rtype: generator
+        """
         session = self.session
         while True:
             control_id, control_message = self._helper.get_control_message(session)
@@ -551,7 +575,7 @@ class PersistedStateMachine(StateMachine):
             if self.status == self.Status.RUNNING:
                 try:
                     finished_node_name = self.dump()["current_node"]
-                    self.run_next()
+                    yield self.run_next_async()
                     session.nodes_process[finished_node_name] = True
 
                     finished_state = self.dump()
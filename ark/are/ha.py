@@ -9,14 +9,27 @@
 
 * ``HAMaster`` 封装基于persistence模块的主从高可用操作，
 以保证Guardian在极端情况下的可用性，即主备切换功能支持
+* ``LeaseHAMaster`` 基于租约的主从切换，租约到期时间可配置，并为主实例分配单调递增的fencing token，
+失去领导权的实例的写入会被持久化层拒绝
+* ``PartitionHAMaster`` 分区多活，所有存活实例组成一致性哈希环，各自处理归属于自己的操作
+
+通过配置项 ``HA_MODE`` 选择主从切换方式：election（默认，临时节点选举）、lease（租约）、partition（分区多活）
 
 """
+import re
 import time
 import sys
+import json
+import string
+import uuid
+import threading
 
 import ark.are.config as config
+import ark.are.exception as exception
 import ark.are.log as log
 import ark.are.persistence as persistence
+from ark.are.common import HashRing
+from ark.are.metrics import Metrics
 
 
 class HAMaster(object):
@@ -24,21 +37,51 @@ class HAMaster(object):
     主从选举客户端类, 封装基于persistence的主从选举和相应状态变更
     """
     inst_id = sys.maxint
+    HA_MODE_NAME = "HA_MODE"
+    HA_MODE_ELECTION = "election"
+    HA_MODE_LEASE = "lease"
+    HA_MODE_PARTITION = "partition"
 
-    def __init__(self, start_scheduler_func, stop_scheduler_func):
+    def __init__(self, start_scheduler_func, stop_scheduler_func, persist_driver=None):
         """
         初始化方法
         
         :param func start_scheduler_func: 实例成为主时回调函数
         :param func stop_scheduler_func: 实例成为从时回调函数
+        :param BasePersistence persist_driver: 选举使用的持久化实例，默认为PersistenceDriver单例。
+               进程内模拟多实例选举时，可为每个实例传入独立的会话，如 ``MemoryPersistence.new_session()``
         """
         self.path = config.GuardianConfig.get_persistent_path("alive_clients")
         self._start_scheduler_func = start_scheduler_func
         self._stop_scheduler_func = stop_scheduler_func
-        self._pd = persistence.PersistenceDriver()
+        self._pd = persist_driver or persistence.PersistenceDriver()
         self._pd.add_listener(self.state_listener)
         self.is_leader = False
         self._inst_id = -1
+        self._node_path = None
+        self._stopped = False
+
+    @classmethod
+    def create(cls, start_scheduler_func, stop_scheduler_func, persist_driver=None, rebalance_func=None):
+        """
+        按配置项 ``HA_MODE`` 创建主从切换实例
+
+        :param func start_scheduler_func: 实例成为主时回调函数
+        :param func stop_scheduler_func: 实例成为从时回调函数
+        :param BasePersistence persist_driver: 选举使用的持久化实例，默认为PersistenceDriver单例
+        :param func rebalance_func: 分区模式下成员变化时的回调函数，参数为一致性哈希环及本实例的成员名
+        :return: 主从切换实例
+        :rtype: HAMaster
+        :raises ETypeMismatch: 不支持的主从切换方式
+        """
+        mode = config.GuardianConfig.get(cls.HA_MODE_NAME, cls.HA_MODE_ELECTION)
+        if mode == cls.HA_MODE_ELECTION:
+            return HAMaster(start_scheduler_func, stop_scheduler_func, persist_driver)
+        elif mode == cls.HA_MODE_LEASE:
+            return LeaseHAMaster(start_scheduler_func, stop_scheduler_func, persist_driver)
+        elif mode == cls.HA_MODE_PARTITION:
+            return PartitionHAMaster(start_scheduler_func, stop_scheduler_func, persist_driver, rebalance_func)
+        raise exception.ETypeMismatch("unsupported HA_MODE:{}".format(mode))
 
     @classmethod
     def init_environment(cls):
@@ -54,6 +97,7 @@ class HAMaster(object):
         guardian_client_path = config.GuardianConfig.get_persistent_path("alive_clients")
         context_path = config.GuardianConfig.get_persistent_path("context")
         operations_path = config.GuardianConfig.get_persistent_path("operations")
+        partitions_path = config.GuardianConfig.get_persistent_path("partitions")
         pd = persistence.PersistenceDriver()
 
         if not pd.exists(guardian_base):
@@ -68,6 +112,9 @@ class HAMaster(object):
         if not pd.exists(operations_path):
             pd.create_node(path=operations_path)
             log.d("persistent node %s created!" % operations_path)
+        if not pd.exists(partitions_path):
+            pd.create_node(path=partitions_path)
+            log.d("persistent node %s created!" % partitions_path)
 
     def create_instance(self):
         """
@@ -78,6 +125,7 @@ class HAMaster(object):
             format(config.GuardianConfig.get(config.INSTANCE_ID_NAME))
         seq_path = self._pd.create_node(path=node_path, value="",
                                         ephemeral=True, sequence=True, makepath=True)
+        self._node_path = seq_path
         try:
             self._inst_id = int(seq_path.split('#')[-1])
         except ValueError:
@@ -87,20 +135,39 @@ class HAMaster(object):
         """
         guardian选主: master节点下, 所有ephemeral+sequence类型的节点中, 编号最小的获得领导权.
 
+        为避免每次成员变化唤醒所有实例，非主实例只监听编号紧邻且小于自身的前驱节点，
+        前驱节点删除时才重新选主；主实例监听自身节点，节点因会话过期等原因被删除时重新选主并放弃领导权，
+        不依赖持久化驱动通知会话丢失；本实例节点不存在时退化为监听全部子节点
+
         :return: None
         """
-        instance_list = self._pd.get_children(
-            path=self.path, watcher=self.event_watcher)
-        id_list = []
-        for inst in instance_list:
-            # 与self._inst_id的默认值区分开，确保异常情况下都是slave
-            inst_id = sys.maxint
-            try:
-                inst_id = int(inst.split("#")[-1])
-            except ValueError:
-                pass
-            id_list.append(inst_id)
-        min_inst_id = sorted(id_list)[0]
+        while True:
+            instances = []
+            for inst in self._pd.get_children(path=self.path):
+                # 与self._inst_id的默认值区分开，确保异常情况下都是slave
+                inst_id = sys.maxint
+                try:
+                    inst_id = int(inst.split("#")[-1])
+                except ValueError:
+                    pass
+                instances.append((inst_id, inst))
+            instances.sort()
+            if self._inst_id not in [inst_id for inst_id, _ in instances]:
+                self._pd.get_children(path=self.path, watcher=self.event_watcher)
+                break
+            predecessors = [inst for inst_id, inst in instances if inst_id < self._inst_id]
+            if not predecessors:
+                own_path = self.path + "/" + [inst for inst_id, inst in instances if inst_id == self._inst_id][0]
+                if self._pd.exists(own_path, watcher=self.event_watcher):
+                    break
+                # 自身节点在列出子节点后已删除，重新查找
+                continue
+            pred_path = self.path + "/" + predecessors[-1]
+            if self._pd.exists(pred_path, watcher=self.event_watcher):
+                log.i("watching predecessor {}".format(pred_path))
+                break
+            # 前驱节点在列出子节点后已删除，重新查找
+        min_inst_id = instances[0][0] if instances else sys.maxint
         # 本实例获得领导权
         if min_inst_id == self._inst_id:
             if not self.is_leader:
@@ -122,6 +189,23 @@ class HAMaster(object):
                       "no longer stop scheduler")
         log.i("choose master finished")
 
+    def stop(self):
+        """
+        停止主从切换。当前为主时放弃领导权，并删除本实例的临时节点，使其他实例无需等待会话超时即可重新选主
+
+        :return: None
+        """
+        self._stopped = True
+        if self.is_leader:
+            self.is_leader = False
+            self._stop_scheduler_func()
+            log.i("I am stopped, stop scheduler")
+        if self._node_path:
+            try:
+                self._pd.delete_node(self._node_path)
+            except Exception as e:
+                log.f("delete instance node fail")
+
     def state_listener(self, state):
         """
         监听会话状态
@@ -129,13 +213,14 @@ class HAMaster(object):
         :param state: 本次触发的状态
         :return: None
         """
+        if self._stopped:
+            return
         if state == persistence.PersistenceEvent.PersistState.LOST:
             log.i("guardian instance state lost")
             while True:
                 try:
                     self.create_instance()
-                    self._pd.get_children(
-                        path=self.path, watcher=self.event_watcher)
+                    self.choose_master()
                     log.i("guardian instance state recreate finished")
                     break
                 except Exception as e:
@@ -156,6 +241,8 @@ class HAMaster(object):
         :return: None
 
         """
+        if self._stopped:
+            return
         if event.state == persistence.PersistenceEvent.PersistState.CONNECTED \
                 or event.type == persistence.PersistenceEvent.EventType.CREATED \
                 or event.type == persistence.PersistenceEvent.EventType.DELETED \
@@ -165,3 +252,263 @@ class HAMaster(object):
             self.choose_master()
         else:
             log.d("event unrecognized")
+
+
+class LeaseHAMaster(HAMaster):
+    """
+    基于租约的主从切换。主实例定期续约，备实例在租约到期后抢占：
+
+    * 租约记录存放在leader节点中，包括持有者、fencing token、本次续约的开始时间及到期时间，租约时长与续约间隔分别由
+      ``HA_LEASE_DURATION`` 、 ``HA_LEASE_RENEW_INTERVAL`` 配置
+    * 抢占与续约均以 ``compare_and_save`` 写入，仅当leader节点中的token仍为读到的token时成功，
+      多个实例同时抢占时只有一个能获得领导权
+    * fencing token通过在fence节点下创建顺序节点获得，单调递增。获得领导权后token设置到持久化实例上，
+      此后的context及operation写入均会校验leader节点中的token，失去领导权的实例的写入会被拒绝
+    * 主实例以最近一次成功续约的开始时间加租约时长作为本地截止时间，到期未能续约则主动放弃领导权，
+      不依赖持久化会话的超时
+    * ``stop`` 时主实例放弃领导权并使租约立即到期，备实例无需等待租约超时即可接管
+
+    每次切换的耗时（旧主最后一次续约到新主获得领导权）记录在 ``ha.failover_seconds`` 指标中
+    """
+    HA_LEASE_DURATION_NAME = "HA_LEASE_DURATION"
+    HA_LEASE_RENEW_INTERVAL_NAME = "HA_LEASE_RENEW_INTERVAL"
+
+    def __init__(self, start_scheduler_func, stop_scheduler_func, persist_driver=None):
+        """
+        初始化方法
+
+        :param func start_scheduler_func: 实例成为主时回调函数
+        :param func stop_scheduler_func: 实例成为从时回调函数
+        :param BasePersistence persist_driver: 选举使用的持久化实例，默认为PersistenceDriver单例
+        """
+        super(LeaseHAMaster, self).__init__(start_scheduler_func, stop_scheduler_func, persist_driver)
+        self.leader_path = config.GuardianConfig.get_persistent_path("leader")
+        self.fence_path = config.GuardianConfig.get_persistent_path("fence")
+        self._duration = string.atof(config.GuardianConfig.get(self.HA_LEASE_DURATION_NAME, "3"))
+        self._renew_interval = string.atof(config.GuardianConfig.get(
+            self.HA_LEASE_RENEW_INTERVAL_NAME, str(self._duration / 3)))
+        self._holder = "{}-{}".format(config.GuardianConfig.get(config.INSTANCE_ID_NAME, ""),
+                                      uuid.uuid4().hex[:8])
+        self._token = None
+        self._deadline = 0
+        self._running = False
+        self._lease_thread = None
+
+    def create_instance(self):
+        """
+        租约模式不需要临时节点，仅确保fence节点存在
+
+        :return: None
+        """
+        if not self._pd.exists(self.fence_path):
+            try:
+                self._pd.create_node(path=self.fence_path, makepath=True)
+            except exception.EPIOError:
+                # 其他实例已创建
+                pass
+
+    def choose_master(self):
+        """
+        启动租约线程，持续续约或抢占租约
+
+        :return: None
+        """
+        if self._running:
+            return
+        self._running = True
+        self._lease_thread = threading.Thread(target=self._lease_run)
+        self._lease_thread.setDaemon(True)
+        self._lease_thread.start()
+
+    def stop(self):
+        """
+        停止租约线程，当前为主时放弃领导权，并使租约立即到期
+
+        :return: None
+        """
+        self._running = False
+        if self._lease_thread and self._lease_thread is not threading.current_thread():
+            self._lease_thread.join(self._duration)
+        if not self.is_leader:
+            return
+        token = self._token
+        self._step_down("lease stopped")
+        try:
+            self._pd.compare_and_save(self.leader_path, self._lease_record(token, time.time(), 0), token)
+        except Exception as e:
+            log.f("expire lease fail")
+
+    def state_listener(self, state):
+        """
+        监听会话状态。租约模式下领导权仅取决于租约，会话状态变化只记录日志
+
+        :param state: 本次触发的状态
+        :return: None
+        """
+        log.i("guardian instance state:{}".format(state))
+
+    def _lease_run(self):
+        """
+        租约线程，主实例续约，备实例在租约到期后抢占
+        """
+        while self._running:
+            start = time.time()
+            try:
+                if self.is_leader:
+                    self._renew(start)
+                else:
+                    self._try_acquire(start)
+            except Exception as e:
+                Metrics().incr("ha.lease_errors")
+                log.f("lease request failed")
+            if self.is_leader and time.time() >= self._deadline:
+                self._step_down("lease expired before renewal")
+            time.sleep(max(self._renew_interval - (time.time() - start), 0))
+
+    def _read_lease(self):
+        """
+        读取租约记录
+
+        :return: 租约记录，不存在时为None
+        :rtype: dict
+        """
+        try:
+            data = self._pd.get_data(self.leader_path)
+        except exception.EPNoNodeError:
+            return None
+        try:
+            return json.loads(data) if data else None
+        except ValueError:
+            return None
+
+    def _lease_record(self, token, now, expire=None):
+        """
+        生成租约记录
+
+        :param int token: fencing token
+        :param float now: 本次续约的开始时间
+        :param float expire: 到期时间，默认为开始时间加租约时长
+        :return: 租约记录
+        :rtype: str
+        """
+        return json.dumps({"holder": self._holder, "token": token, "start": now,
+                           "expire": now + self._duration if expire is None else expire})
+
+    def _new_token(self):
+        """
+        分配新的fencing token
+
+        :return: token
+        :rtype: int
+        """
+        seq_path = self._pd.create_node(path=self.fence_path + "/token-", sequence=True)
+        self._pd.delete_node(seq_path)
+        return int(re.search("([0-9]+)$", seq_path).group(1))
+
+    def _try_acquire(self, now):
+        """
+        租约不存在或已到期时尝试抢占
+        """
+        lease = self._read_lease()
+        if lease and lease["expire"] > now:
+            return
+        token = self._new_token()
+        try:
+            if lease is None and not self._pd.exists(self.leader_path):
+                # 首次抢占，节点的创建是排他的
+                self._pd.create_node(self.leader_path, self._lease_record(token, now), makepath=True)
+            else:
+                # 仅当租约仍为读到的租约时写入，分配token期间租约已被其他实例抢占时写入失败
+                self._pd.compare_and_save(self.leader_path, self._lease_record(token, now),
+                                          lease["token"] if lease else None)
+        except (exception.EPStaleToken, exception.EPIOError) as e:
+            log.d("lease taken by other instance:{}".format(e))
+            return
+
+        self._token = token
+        self._deadline = now + self._duration
+        self._pd.set_fence(self.leader_path, token, config.GuardianConfig.get_persistent_path())
+        self.is_leader = True
+        Metrics().incr("ha.leader_changes")
+        if lease:
+            failover = time.time() - lease.get("start", lease["expire"] - self._duration)
+            Metrics().observe("ha.failover_seconds", failover)
+            log.i("I am new master, token:{}, failover cost {:.3f}s".format(token, failover))
+        else:
+            log.i("I am new master, token:{}".format(token))
+        self._start_scheduler_func()
+
+    def _renew(self, now):
+        """
+        续约，租约已被其他实例持有时放弃领导权
+        """
+        if now >= self._deadline:
+            return
+        try:
+            self._pd.compare_and_save(self.leader_path, self._lease_record(self._token, now), self._token)
+        except (exception.EPStaleToken, exception.EPNoNodeError):
+            self._step_down("lease taken over")
+            return
+        self._deadline = now + self._duration
+
+    def _step_down(self, reason):
+        """
+        放弃领导权。保留持久化实例上的token，使之后延迟到达的写入被拒绝
+        """
+        if not self.is_leader:
+            return
+        self.is_leader = False
+        Metrics().incr("ha.step_downs")
+        log.i("I am slave, stop scheduler: {}".format(reason))
+        self._stop_scheduler_func()
+
+
+class PartitionHAMaster(HAMaster):
+    """
+    分区多活。 ``alive_clients`` 下的所有存活实例以 ``INSTANCE_ID`` 为成员名组成一致性哈希环，
+    操作按分区键（默认为操作id）归属于环上的某个实例，每个实例都运行自己的消息泵，只处理归属于自己的操作：
+
+    * 各实例的 ``INSTANCE_ID`` 必须互不相同，成员名不随会话重建而变化，实例重连后仍负责原来的分区
+    * 成员变化时通过 ``rebalance_func`` 通知新的哈希环，由框架释放不再归属本实例的操作、接管新归属的操作
+    * 虚拟节点数由 ``PARTITION_VNODES`` 配置，默认100
+
+    由于每个实例都需要完整的成员列表，分区模式监听全部子节点
+    """
+    PARTITION_VNODES_NAME = "PARTITION_VNODES"
+
+    def __init__(self, start_scheduler_func, stop_scheduler_func, persist_driver=None, rebalance_func=None):
+        """
+        初始化方法
+
+        :param func start_scheduler_func: 实例开始工作时回调函数
+        :param func stop_scheduler_func: 实例停止工作时回调函数
+        :param BasePersistence persist_driver: 使用的持久化实例，默认为PersistenceDriver单例
+        :param func rebalance_func: 成员变化时的回调函数，参数为一致性哈希环及本实例的成员名
+        """
+        super(PartitionHAMaster, self).__init__(start_scheduler_func, stop_scheduler_func, persist_driver)
+        self._rebalance_func = rebalance_func
+        self._vnodes = string.atoi(config.GuardianConfig.get(self.PARTITION_VNODES_NAME, "100"))
+        self.member = config.GuardianConfig.get(config.INSTANCE_ID_NAME)
+        self.ring = None
+
+    def choose_master(self):
+        """
+        根据存活实例重建一致性哈希环，成员变化时通知框架重新划分分区，首次调用时开始工作
+
+        :return: None
+        """
+        instance_list = self._pd.get_children(path=self.path, watcher=self.event_watcher)
+        members = sorted(set([inst.split("#")[0] for inst in instance_list]))
+        if self.member not in members:
+            log.i("instance {} not in alive clients, own no partition".format(self.member))
+        if self.ring is None or self.ring.members != members:
+            self.ring = HashRing(members, self._vnodes)
+            Metrics().incr("ha.rebalances")
+            Metrics().set("ha.partition_members", len(members))
+            log.i("partition members changed:{}".format(members))
+            if self._rebalance_func:
+                self._rebalance_func(self.ring, self.member)
+        if not self.is_leader:
+            self.is_leader = True
+            self._start_scheduler_func()
+            log.i("partition instance {} start scheduler".format(self.member))
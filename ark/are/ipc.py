@@ -0,0 +1,266 @@
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2018 Baidu.com, Inc. All Rights Reserved
+#
+################################################################################
+"""
+**ipc** 执行器的进程间通信模块，不依赖 ``multiprocessing.Manager`` 服务进程：
+
+* ``ControlTable`` 基于共享内存的控制消息表，读操作无锁（seqlock），写操作由进程锁互斥
+
+共享对象需在创建进程池之前创建，通过fork继承给子进程。
+"""
+import mmap
+import struct
+import pickle
+import zlib
+import time
+import multiprocessing
+
+import ark.are.exception as exception
+
+
+class ControlTable(object):
+    """
+    控制消息表，提供与dict类似的 ``in`` 、取值、赋值及删除操作，键为字符串，值为可序列化对象。
+
+    数据保存在匿名共享内存中，按键的crc32值开放寻址。共享内存头部为表头，之后为各槽位，格式为::
+
+        表头：generation(4) | used(4) | deleted(4)
+        槽位：seq(4) | state(1) | key_len(2) | value_len(4) | key(KEY_SIZE) | value(slot_size)
+
+    写入槽位前后各将seq加1，读取时seq为奇数或前后两次读到的seq不同则重试，因此读操作无需加锁。
+    查找时只比较槽位头和键，键相同时才复制值。
+
+    删除键时若探测链在下一个槽位结束，则直接回收该槽位及其前面连续的删除标记，否则留下删除标记；
+    删除标记超过槽位数的1/4时在写锁内重建整个表。重建前后各将generation加1，
+    读取未找到键时generation为奇数或已变化则重新查找，避免重建过程中误判键不存在
+    """
+    KEY_SIZE = 128
+    _TABLE = struct.Struct("<III")
+    _HEADER = struct.Struct("<IBHI")
+    _EMPTY = 0
+    _USED = 1
+    _DELETED = 2
+
+    def __init__(self, slots=1024, slot_size=4096):
+        """
+        初始化方法
+
+        :param int slots: 槽位数，即最多同时保存的键数
+        :param int slot_size: 每个值序列化后的最大字节数
+        """
+        self._slots = slots
+        self._slot_size = slot_size
+        self._stride = self._HEADER.size + self.KEY_SIZE + slot_size
+        self._mm = mmap.mmap(-1, self._TABLE.size + self._stride * slots)
+        self._lock = multiprocessing.Lock()
+
+    def _offset(self, index):
+        """
+        槽位在共享内存中的偏移
+        """
+        return self._TABLE.size + index * self._stride
+
+    def _read_slot(self, index, key):
+        """
+        以seqlock方式读取槽位。只读取槽位头和键，键与key相同时才复制值
+
+        :param int index: 槽位号
+        :param str key: 查找的键
+        :return: 状态及值的序列化数据，键不同时值为None
+        :rtype: tuple
+        """
+        offset = self._offset(index)
+        key_start = offset + self._HEADER.size
+        value_start = key_start + self.KEY_SIZE
+        spins = 0
+        while True:
+            seq, state, key_len, value_len = self._HEADER.unpack_from(self._mm, offset)
+            if seq % 2 == 0:
+                value = None
+                if state == self._USED and key_len == len(key) and \
+                        self._mm[key_start:key_start + key_len] == key:
+                    value = self._mm[value_start:value_start + value_len]
+                if self._HEADER.unpack_from(self._mm, offset)[0] == seq:
+                    return state, value
+            spins += 1
+            if spins % 100 == 0:
+                time.sleep(0)
+
+    def _write_slot(self, index, state, key, value):
+        """
+        写入槽位，调用方需持有写锁
+        """
+        offset = self._offset(index)
+        seq = self._HEADER.unpack_from(self._mm, offset)[0]
+        struct.pack_into("<I", self._mm, offset, seq + 1)
+        key_start = offset + self._HEADER.size
+        value_start = key_start + self.KEY_SIZE
+        self._mm[key_start:key_start + len(key)] = key
+        self._mm[value_start:value_start + len(value)] = value
+        struct.pack_into("<BHI", self._mm, offset + 4, state, len(key), len(value))
+        struct.pack_into("<I", self._mm, offset, seq + 2)
+
+    def _state(self, index):
+        """
+        读取槽位状态，调用方需持有写锁
+        """
+        return self._HEADER.unpack_from(self._mm, self._offset(index))[1]
+
+    def _count(self, used_delta, deleted_delta):
+        """
+        更新表头中已使用及已删除的槽位数，调用方需持有写锁
+
+        :return: 更新后的已删除槽位数
+        :rtype: int
+        """
+        generation, used, deleted = self._TABLE.unpack_from(self._mm, 0)
+        self._TABLE.pack_into(self._mm, 0, generation, used + used_delta, deleted + deleted_delta)
+        return deleted + deleted_delta
+
+    def _probe(self, key):
+        """
+        按开放寻址顺序遍历键可能所在的槽位
+        """
+        start = zlib.crc32(key) % self._slots
+        for i in range(self._slots):
+            yield (start + i) % self._slots
+
+    def _find(self, key):
+        """
+        查找键所在的槽位
+
+        :return: 槽位号及值的序列化数据，不存在时为None, None
+        :rtype: tuple
+        """
+        while True:
+            generation = struct.unpack_from("<I", self._mm, 0)[0]
+            if generation % 2 == 0:
+                for index in self._probe(key):
+                    state, value = self._read_slot(index, key)
+                    if state == self._EMPTY:
+                        break
+                    if value is not None:
+                        return index, value
+                if struct.unpack_from("<I", self._mm, 0)[0] == generation:
+                    return None, None
+            time.sleep(0)
+
+    def _rehash(self):
+        """
+        在写锁内重建表，清除所有删除标记
+        """
+        entries = []
+        for index in range(self._slots):
+            offset = self._offset(index)
+            _, state, key_len, value_len = self._HEADER.unpack_from(self._mm, offset)
+            if state == self._USED:
+                key_start = offset + self._HEADER.size
+                value_start = key_start + self.KEY_SIZE
+                entries.append((self._mm[key_start:key_start + key_len],
+                                self._mm[value_start:value_start + value_len]))
+        generation = struct.unpack_from("<I", self._mm, 0)[0]
+        struct.pack_into("<I", self._mm, 0, generation + 1)
+        for index in range(self._slots):
+            if self._state(index) != self._EMPTY:
+                self._write_slot(index, self._EMPTY, "", "")
+        for key, value in entries:
+            for index in self._probe(key):
+                if self._state(index) == self._EMPTY:
+                    self._write_slot(index, self._USED, key, value)
+                    break
+        self._TABLE.pack_into(self._mm, 0, generation + 2, len(entries), 0)
+
+    def _encode_key(self, key):
+        """
+        检查并编码键
+        """
+        if isinstance(key, unicode):
+            key = key.encode("utf-8")
+        key = str(key)
+        if len(key) > self.KEY_SIZE:
+            raise exception.ETypeMismatch("control key too long:{}".format(key))
+        return key
+
+    def __contains__(self, key):
+        """
+        判断键是否存在
+        """
+        return self._find(self._encode_key(key))[0] is not None
+
+    def __getitem__(self, key):
+        """
+        获取键对应的值
+
+        :raises KeyError: 键不存在
+        """
+        index, value = self._find(self._encode_key(key))
+        if index is None:
+            raise KeyError(key)
+        return pickle.loads(value)
+
+    def get(self, key, default=None):
+        """
+        获取键对应的值，不存在时返回default
+        """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        """
+        设置键对应的值
+
+        :raises ETypeMismatch: 值序列化后超过槽位大小
+        :raises EInvalidOperation: 控制消息表已满
+        """
+        key = self._encode_key(key)
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self._slot_size:
+            raise exception.ETypeMismatch("control value too large:{} bytes".format(len(data)))
+        with self._lock:
+            free = None
+            free_state = None
+            for index in self._probe(key):
+                state, slot_value = self._read_slot(index, key)
+                if slot_value is not None:
+                    free, free_state = index, state
+                    break
+                if state != self._USED and free is None:
+                    free, free_state = index, state
+                if state == self._EMPTY:
+                    break
+            if free is None:
+                raise exception.EInvalidOperation("control table is full")
+            self._write_slot(free, self._USED, key, data)
+            if free_state != self._USED:
+                self._count(1, -1 if free_state == self._DELETED else 0)
+
+    def __delitem__(self, key):
+        """
+        删除键
+
+        :raises KeyError: 键不存在
+        """
+        key = self._encode_key(key)
+        with self._lock:
+            index, _ = self._find(key)
+            if index is None:
+                raise KeyError(key)
+            if self._state((index + 1) % self._slots) != self._EMPTY:
+                self._write_slot(index, self._DELETED, "", "")
+                if self._count(-1, 1) * 4 > self._slots:
+                    self._rehash()
+                return
+            # 探测链在此结束，回收该槽位及其前面连续的删除标记
+            self._write_slot(index, self._EMPTY, "", "")
+            reclaimed = 0
+            index = (index - 1) % self._slots
+            while self._state(index) == self._DELETED:
+                self._write_slot(index, self._EMPTY, "", "")
+                reclaimed += 1
+                index = (index - 1) % self._slots
+            self._count(-1, -reclaimed)
@@ -29,7 +29,7 @@ def load_usage():
     :return:
     """
     print 'ark load <guardian.py> [-p|--persist persist_mode] [-c|--config config_path]'
-    print '           -p persist_mode: zookeeper(default), local'
+    print '           -p persist_mode: zookeeper(default), local, sqlite, memory'
     print '           -c config_path : ../conf/ark.conf(default)'
 
 
@@ -42,6 +42,7 @@ def load():
     :return: 无返回
     :rtype: None
     """
+    import ark.are.config as config
     pmode = "zookeeper"
     if len(sys.argv) < 3:
         load_usage()
@@ -61,13 +62,16 @@ def load():
             if not os.path.exists(arg) or not os.path.isfile(arg):
                 print "config({path}) not exist or not file".format(path=arg)
                 sys.exit(2)
-            import ark.are.config as config
             config.GuardianConfig.CONF_DIR = os.path.dirname(arg)
             config.GuardianConfig.CONF_FILE = os.path.basename(arg)
 
     import ark.are.persistence as persistence
     if pmode == "zookeeper":
         persistence.PersistenceDriver = persistence.ZkPersistence
+    elif pmode == "sqlite":
+        persistence.PersistenceDriver = persistence.SqlitePersistence
+    elif pmode == "memory":
+        persistence.PersistenceDriver = persistence.MemoryPersistence
     else:
         persistence.PersistenceDriver = persistence.FilePersistence
     config.GuardianConfig.load_config()
@@ -76,6 +80,255 @@ def load():
     return guardian.start(pmode)
 
 
+def bench_usage():
+    """
+    打印基准测试的使用方法
+    :return:
+    """
+    print 'ark bench persistence [-b|--backend backend] [-H|--hosts hosts] [-n|--nodes n1,n2]'
+    print '                      [-s|--sizes s1,s2] [-w|--watch samples] [-e|--expiry samples]'
+    print '                      [-c|--config config_path] [-o|--output result.json]'
+    print '           -b backend  : memory(default), file, tmpfs, sqlite, redis, zookeeper'
+    print '           -H hosts    : STATE_SERVICE_HOSTS of backend, temporary path for file/tmpfs/sqlite(default)'
+    print '           -n nodes    : node counts, 100(default)'
+    print '           -s sizes    : value sizes in bytes, 64,4096(default)'
+    print '           -w samples  : watch latency samples, 20(default)'
+    print '           -e samples  : ephemeral expiry samples, 10(default), 0 to skip'
+    print '           -o output   : write JSON result to file, print table and JSON to stdout(default)'
+    print 'ark bench executor [-n|--tasks n] [-s|--size ballast] [-p|--processes n] [-o|--output result.json]'
+    print '           -n tasks    : tasks dispatched per mode, 1000(default)'
+    print '           -s ballast  : bytes of data carried by the executor, 100000(default)'
+    print '           -p processes: worker processes, 2(default)'
+    print '           -o output   : write JSON result to file, print table and JSON to stdout(default)'
+
+
+def bench():
+    """
+    执行基准测试
+    :return:
+    """
+    if len(sys.argv) >= 3 and sys.argv[2] == "executor":
+        return bench_executor()
+    if len(sys.argv) < 3 or sys.argv[2] != "persistence":
+        bench_usage()
+        sys.exit(2)
+    try:
+        opts, args = getopt.getopt(sys.argv[3:], "hb:H:n:s:w:e:c:o:",
+                                   ["backend=", "hosts=", "nodes=", "sizes=", "watch=",
+                                    "expiry=", "config=", "output="])
+    except getopt.GetoptError:
+        bench_usage()
+        sys.exit(2)
+    import ark.are.config as config
+    import ark.are.bench as ark_bench
+    backend = "memory"
+    hosts = None
+    node_counts = [100]
+    value_sizes = [64, 4096]
+    watch_samples = 20
+    expiry_samples = 10
+    output = None
+    config.GuardianConfig.load_sys_env()
+    for opt, arg in opts:
+        if opt == '-h':
+            bench_usage()
+            sys.exit()
+        elif opt in ("-b", "--backend"):
+            if arg not in ark_bench.BACKENDS:
+                bench_usage()
+                sys.exit(2)
+            backend = arg
+        elif opt in ("-H", "--hosts"):
+            hosts = arg
+        elif opt in ("-n", "--nodes"):
+            node_counts = [int(n) for n in arg.split(",")]
+        elif opt in ("-s", "--sizes"):
+            value_sizes = [int(n) for n in arg.split(",")]
+        elif opt in ("-w", "--watch"):
+            watch_samples = int(arg)
+        elif opt in ("-e", "--expiry"):
+            expiry_samples = int(arg)
+        elif opt in ("-c", "--config"):
+            if not os.path.exists(arg) or not os.path.isfile(arg):
+                print "config({path}) not exist or not file".format(path=arg)
+                sys.exit(2)
+            config.GuardianConfig.CONF_DIR = os.path.dirname(arg)
+            config.GuardianConfig.CONF_FILE = os.path.basename(arg)
+            config.GuardianConfig.load_local_env()
+        elif opt in ("-o", "--output"):
+            output = arg
+
+    driver = ark_bench.make_driver(backend, hosts)
+    try:
+        report = ark_bench.PersistenceBenchmark(driver, node_counts, value_sizes,
+                                                watch_samples, expiry_samples).run()
+    finally:
+        driver.disconnect()
+    report["backend"] = backend
+    print ark_bench.format_results(report)
+    ark_bench.dump_results(report, output)
+
+
+def bench_executor():
+    """
+    执行执行器任务分发的基准测试，结果中nodes为任务数，value_size为每个任务序列化后的字节数
+    :return:
+    """
+    try:
+        opts, args = getopt.getopt(sys.argv[3:], "hn:s:p:o:",
+                                   ["tasks=", "size=", "processes=", "output="])
+    except getopt.GetoptError:
+        bench_usage()
+        sys.exit(2)
+    import ark.are.config as config
+    import ark.are.bench as ark_bench
+    tasks = 1000
+    ballast_size = 100000
+    process_count = 2
+    output = None
+    config.GuardianConfig.load_sys_env()
+    for opt, arg in opts:
+        if opt == '-h':
+            bench_usage()
+            sys.exit()
+        elif opt in ("-n", "--tasks"):
+            tasks = int(arg)
+        elif opt in ("-s", "--size"):
+            ballast_size = int(arg)
+        elif opt in ("-p", "--processes"):
+            process_count = int(arg)
+        elif opt in ("-o", "--output"):
+            output = arg
+
+    report = ark_bench.ExecutorBenchmark(tasks, ballast_size, process_count).run()
+    print ark_bench.format_results(report)
+    ark_bench.dump_results(report, output)
+
+
+def worker_usage():
+    """
+    打印远程执行工作进程的使用方法
+    :return:
+    """
+    print 'ark worker <worker.py> [-b|--broker address] [-n|--concurrency n] [-c|--config config_path]'
+    print '           worker.py      : module providing worker_main(), which returns the executor to run'
+    print '           -b address     : broker address, host:port or unix:/path, EXECUTOR_BROKER_ADDRESS(default)'
+    print '           -n concurrency : operations executed at the same time, 1(default)'
+    print '           -c config_path : ../conf/ark.conf(default)'
+
+
+def broker_usage():
+    """
+    打印任务代理的使用方法
+    :return:
+    """
+    print 'ark broker [-b|--broker address] [-c|--config config_path]'
+    print '           -b address     : listen address, host:port or unix:/path, EXECUTOR_BROKER_ADDRESS(default)'
+    print '                            BROKER_TOKEN must be set to listen on a non-loopback address'
+    print '           -c config_path : ../conf/ark.conf(default)'
+
+
+def _load_config(path, usage_func):
+    """
+    按命令行指定的路径设置配置文件
+    """
+    import ark.are.config as config
+    if not os.path.exists(path) or not os.path.isfile(path):
+        print "config({path}) not exist or not file".format(path=path)
+        usage_func()
+        sys.exit(2)
+    config.GuardianConfig.CONF_DIR = os.path.dirname(path)
+    config.GuardianConfig.CONF_FILE = os.path.basename(path)
+
+
+def _load_process_config():
+    """
+    加载工作进程、任务代理的配置。二者不连接持久化系统，只加载系统环境变量及存在的本地配置文件
+    """
+    import ark.are.config as config
+    config.GuardianConfig.load_sys_env()
+    if os.path.isfile(os.path.join(config.GuardianConfig.CONF_DIR, config.GuardianConfig.CONF_FILE)):
+        config.GuardianConfig.load_local_env()
+
+
+def worker():
+    """
+    启动远程执行的工作进程，从任务代理拉取操作，使用worker.py中worker_main()返回的执行器执行
+
+    :return: 无返回
+    :rtype: None
+    """
+    if len(sys.argv) < 3:
+        worker_usage()
+        sys.exit(2)
+    try:
+        opts, args = getopt.getopt(sys.argv[3:], "hb:n:c:", ["broker=", "concurrency=", "config="])
+    except getopt.GetoptError:
+        worker_usage()
+        sys.exit(2)
+    address = None
+    concurrency = 1
+    for opt, arg in opts:
+        if opt == '-h':
+            worker_usage()
+            sys.exit()
+        elif opt in ("-b", "--broker"):
+            address = arg
+        elif opt in ("-n", "--concurrency"):
+            concurrency = int(arg)
+        elif opt in ("-c", "--config"):
+            _load_config(arg, worker_usage)
+
+    import imp
+    import ark.are.executor as executor
+    _load_process_config()
+    path = sys.argv[2]
+    module = imp.load_source(os.path.splitext(os.path.basename(path))[0], path)
+    executor.RemoteWorker(module.worker_main(), address, concurrency).run()
+
+
+def broker():
+    """
+    在前台运行任务代理
+
+    :return: 无返回
+    :rtype: None
+    """
+    try:
+        opts, args = getopt.getopt(sys.argv[2:], "hb:c:", ["broker=", "config="])
+    except getopt.GetoptError:
+        broker_usage()
+        sys.exit(2)
+    address = None
+    for opt, arg in opts:
+        if opt == '-h':
+            broker_usage()
+            sys.exit()
+        elif opt in ("-b", "--broker"):
+            address = arg
+        elif opt in ("-c", "--config"):
+            _load_config(arg, broker_usage)
+
+    import time
+    import ark.are.config as config
+    import ark.are.broker as ark_broker
+    import ark.are.exception as exception
+    import ark.are.executor as executor
+    _load_process_config()
+    address = address or config.GuardianConfig.get(executor.RemoteExecutor.BROKER_ADDRESS_NAME,
+                                                   ark_broker.DEFAULT_ADDRESS)
+    try:
+        server = ark_broker.Broker(address).start()
+    except exception.EInvalidOperation as e:
+        print str(e)
+        sys.exit(2)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
 def mkenv_usage():
     """
     打印环境准备的使用方法
@@ -97,7 +350,7 @@ def usage():
     打印使用方法
     :return:
     """
-    print 'ark <load|mkenv> ...'
+    print 'ark <load|mkenv|bench|worker|broker> ...'
 
 
 def main():
@@ -114,6 +367,12 @@ def main():
         load()
     elif sys.argv[1] == "mkenv":
         mkenv()
+    elif sys.argv[1] == "bench":
+        bench()
+    elif sys.argv[1] == "worker":
+        worker()
+    elif sys.argv[1] == "broker":
+        broker()
     else:
         usage()
         sys.exit(2)
@@ -0,0 +1,144 @@
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2018 Baidu.com, Inc. All Rights Reserved
+#
+################################################################################
+"""
+**metrics** 框架运行指标模块，提供进程内的指标登记与查询：
+
+* ``incr`` 计数器，记录累计次数
+* ``set`` 仪表，记录当前值
+* ``observe`` 观测值，记录次数、总和、最大值及最近的样本，用于计算分位数
+"""
+
+import threading
+import collections
+
+from ark.are.common import Singleton
+
+
+class Metrics(Singleton):
+    """
+    进程内指标登记表
+    """
+    SAMPLE_SIZE = 1024
+    _init = False
+
+    def __init__(self):
+        """
+        初始化方法
+        """
+        if Metrics._init:
+            return
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._observations = {}
+        Metrics._init = True
+
+    def incr(self, name, value=1):
+        """
+        计数器累加
+
+        :param str name: 指标名
+        :param int value: 累加值
+        :return: 无返回
+        :rtype: None
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name, value):
+        """
+        设置仪表的当前值
+
+        :param str name: 指标名
+        :param value: 当前值
+        :return: 无返回
+        :rtype: None
+        """
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        """
+        记录一次观测值
+
+        :param str name: 指标名
+        :param float value: 观测值
+        :return: 无返回
+        :rtype: None
+        """
+        with self._lock:
+            observation = self._observations.get(name)
+            if observation is None:
+                observation = {"count": 0, "sum": 0.0, "max": value,
+                               "samples": collections.deque(maxlen=self.SAMPLE_SIZE)}
+                self._observations[name] = observation
+            observation["count"] += 1
+            observation["sum"] += value
+            observation["max"] = max(observation["max"], value)
+            observation["samples"].append(value)
+
+    def get(self, name, default=None):
+        """
+        获取计数器或仪表的当前值
+
+        :param str name: 指标名
+        :param default: 指标不存在时的默认值
+        :return: 指标值
+        """
+        with self._lock:
+            if name in self._counters:
+                return self._counters[name]
+            return self._gauges.get(name, default)
+
+    @classmethod
+    def percentile(cls, samples, percent):
+        """
+        计算样本的分位数
+
+        :param list samples: 样本
+        :param float percent: 分位，取值0~100
+        :return: 分位数，样本为空时返回None
+        :rtype: float
+        """
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        index = int(round(percent / 100.0 * (len(ordered) - 1)))
+        return ordered[index]
+
+    def snapshot(self):
+        """
+        获取所有指标的快照
+
+        :return: 指标快照，包括counters、gauges、observations三部分
+        :rtype: dict
+        """
+        with self._lock:
+            observations = {}
+            for name, observation in self._observations.items():
+                samples = list(observation["samples"])
+                observations[name] = {
+                    "count": observation["count"],
+                    "sum": observation["sum"],
+                    "max": observation["max"],
+                    "p50": self.percentile(samples, 50),
+                    "p99": self.percentile(samples, 99)}
+            return {"counters": dict(self._counters),
+                    "gauges": dict(self._gauges),
+                    "observations": observations}
+
+    def reset(self):
+        """
+        清空所有指标
+
+        :return: 无返回
+        :rtype: None
+        """
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._observations.clear()
@@ -9,14 +9,22 @@
 """
 
 import os
+import errno
 import json
 import time
 import copy
+import zlib
+import uuid
+import random
+import hashlib
 import string
+import threading
+import contextlib
 import ark.are.common as common
 import ark.are.exception as exception
 import ark.are.log as log
 import ark.are.config as config
+import ark.are.metrics as metrics
 
 
 class PersistenceEvent(object):
@@ -42,6 +50,203 @@ class PersistenceEvent(object):
         self.path = path or ""
 
 
+class PersistenceFuture(object):
+    """
+    持久化异步请求的结果。异步接口（如 ``get_data_async`` ）立即返回该对象，调用方可以先发出一批请求，
+    再依次调用 ``get`` 获取结果，从而将多个请求的往返时间重叠起来。
+
+    .. Note:: ``get`` 抛出的异常与对应同步接口一致
+    """
+
+    def __init__(self):
+        """
+        初始化方法
+        """
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._value = None
+        self._exception = None
+        self._callbacks = []
+
+    @classmethod
+    def resolved(cls, func):
+        """
+        同步执行func，并将其结果或异常包装为已完成的future
+
+        :param func: 无参函数
+        :return: 已完成的future
+        :rtype: PersistenceFuture
+        """
+        future = cls()
+        try:
+            future.set_result(func())
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    @classmethod
+    def gather(cls, futures):
+        """
+        等待一组future全部完成，按顺序返回结果。所有future完成后，抛出第一个失败的future的异常
+
+        :param list(PersistenceFuture) futures: future列表
+        :return: 结果列表
+        :rtype: list
+        """
+        results = []
+        error = None
+        for future in futures:
+            try:
+                results.append(future.get())
+            except Exception as e:
+                results.append(None)
+                error = error or e
+        if error is not None:
+            raise error
+        return results
+
+    def set_result(self, value):
+        """
+        设置结果，并触发回调
+
+        :param value: 请求结果
+        :return: 无返回
+        :rtype: None
+        """
+        self._value = value
+        self._finish()
+
+    def set_exception(self, e):
+        """
+        设置异常，并触发回调
+
+        :param Exception e: 请求异常
+        :return: 无返回
+        :rtype: None
+        """
+        self._exception = e
+        self._finish()
+
+    def _finish(self):
+        """
+        标记完成并触发回调
+        """
+        with self._lock:
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def done(self):
+        """
+        请求是否已完成
+
+        :return: True表示已完成
+        :rtype: bool
+        """
+        return self._event.is_set()
+
+    def get(self, timeout=None):
+        """
+        等待并获取请求结果
+
+        :param float timeout: 最长等待时间，None表示一直等待
+        :return: 请求结果
+        :raises: exception.EPConnectTimeout 等待超时
+        """
+        if not self._event.wait(timeout):
+            raise exception.EPConnectTimeout("wait persistence result timeout")
+        if self._exception is not None:
+            raise self._exception
+        return self._value
+
+    def add_callback(self, callback):
+        """
+        添加完成回调，函数形参为(future)。若已完成则立即调用
+
+        .. Note:: 回调可能在驱动的事件线程中执行，不应在回调中进行阻塞的持久化调用
+
+        :param callback: 回调函数
+        :return: 无返回
+        :rtype: None
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def then(self, func):
+        """
+        返回一个派生future，其结果为func(本future)。func在调用方执行派生future的 ``get`` 时、
+        于调用方线程中执行，因此可以在其中进行阻塞调用
+
+        :param func: 函数形参为(future)
+        :return: 派生future
+        :rtype: PersistenceFuture
+        """
+        return ChainedFuture(self, func)
+
+
+class ChainedFuture(PersistenceFuture):
+    """
+    派生future，在 ``get`` 时对源future的结果做进一步处理
+    """
+
+    def __init__(self, source, func):
+        """
+        初始化方法
+
+        :param PersistenceFuture source: 源future
+        :param func: 处理函数，形参为(source)
+        """
+        super(ChainedFuture, self).__init__()
+        self._source = source
+        self._func = func
+
+    def done(self):
+        """
+        源future是否已完成
+
+        :return: True表示已完成
+        :rtype: bool
+        """
+        return self._source.done()
+
+    def get(self, timeout=None):
+        """
+        等待源future完成，并返回处理后的结果
+
+        :param float timeout: 最长等待时间，None表示一直等待
+        :return: 请求结果
+        """
+        with self._lock:
+            if not self._event.is_set():
+                try:
+                    self._source.get(timeout)
+                except exception.EPConnectTimeout:
+                    if not self._source.done():
+                        raise
+                except Exception:
+                    pass
+                try:
+                    self._value = self._func(self._source)
+                except Exception as e:
+                    self._exception = e
+                self._event.set()
+        return super(ChainedFuture, self).get()
+
+    def add_callback(self, callback):
+        """
+        添加完成回调，回调在源future完成时触发
+
+        :param callback: 回调函数
+        :return: 无返回
+        :rtype: None
+        """
+        self._source.add_callback(lambda source: callback(self))
+
+
 class BasePersistence(common.Singleton):
     """
     持久化基类，提供标准化的持久化接口，以及单例等基本功能。
@@ -54,10 +259,25 @@ class BasePersistence(common.Singleton):
     PERSIST_INTERVAL_NAME = "PERSIST_INTERVAL"
     PERSIST_TIMEOUT_NAME = "PERSIST_TIMEOUT"
     PERSIST_PARAMETERS_NAME = "PERSIST_PARAMETERS"
+    PERSIST_DURABILITY_NAME = "PERSIST_DURABILITY"
+    PERSIST_FSYNC_WINDOW_NAME = "PERSIST_FSYNC_WINDOW"
+    PERSIST_TOUCH_RATIO_NAME = "PERSIST_TOUCH_RATIO"
+
+    DURABILITY_NONE = "none"
+    DURABILITY_ATOMIC = "atomic"
+    DURABILITY_DURABLE = "durable"
+
+    PERSIST_COMPRESS_THRESHOLD_NAME = "PERSIST_COMPRESS_THRESHOLD"
+    PERSIST_CHUNK_SIZE_NAME = "PERSIST_CHUNK_SIZE"
+    COMPRESSED_MAGIC = "\x00ARKZ"
+    MANIFEST_MAGIC = "\x00ARKM"
+    CHUNK_PREFIX = ".chunk-"
+    CHUNK_READ_RETRY = 3
+    _fence = None
 
     def get_data(self, path):
         """
-        获得指定路径path的节点数据
+        获得指定路径path的节点数据。压缩或分块存储的数据会被透明地还原
 
         :param str path: 数据存储路径
         :return: 节点数据
@@ -65,11 +285,55 @@ class BasePersistence(common.Singleton):
         :raises: exception.EPNoNodeError 节点不存在
         :raises: exception.EPIOError IO异常
         """
-        raise exception.ENotImplement("function is not implement")
+        return self._decode(path, self._get_data(path))
 
     def save_data(self, path, data):
         """
-        存储数据data到特定的path路径节点
+        存储数据data到特定的path路径节点。数据的编码方式由配置决定：
+
+        * ``PERSIST_COMPRESS_THRESHOLD`` 大于0时，不小于该长度的数据以zlib压缩存储
+        * ``PERSIST_CHUNK_SIZE`` 大于0时，（压缩后）超过该长度的数据拆分为隐藏子节点存储，节点本身仅存放分块清单。
+          分块先于清单写入，清单写入后再删除旧分块，因此读取方总能读到完整的新值或旧值。
+          临时节点不能有子节点，超过分块大小时拒绝写入
+
+        :param str path: 数据存储路径
+        :param str data: 待存储的数据
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPNoNodeError 节点不存在
+        :raises: exception.EPIOError IO异常，或临时节点的数据超过分块大小
+        """
+        payload = self._compress(data)
+        chunk_size = string.atoi(config.GuardianConfig.get(self.PERSIST_CHUNK_SIZE_NAME, "0"))
+        if chunk_size <= 0:
+            self._write_payload(path, payload)
+            return
+        if len(payload) > chunk_size and self._is_ephemeral(path):
+            raise exception.EPIOError("data of ephemeral node {} exceeds {}={}, ephemeral node can not be "
+                                      "chunked".format(path, self.PERSIST_CHUNK_SIZE_NAME, chunk_size))
+        old_manifest = self._read_manifest(path)
+        if len(payload) > chunk_size:
+            payload = self._write_chunks(path, payload, chunk_size)
+        self._write_payload(path, payload)
+        if old_manifest:
+            self.delete_nodes([self._chunk_path(path, old_manifest["gen"], i)
+                               for i in range(old_manifest["count"])])
+
+    def _get_data(self, path):
+        """
+        读取节点中实际存储的数据，由各持久化驱动实现
+
+        :param str path: 数据存储路径
+        :return: 节点数据
+        :rtype: str
+        :raises: exception.EPNoNodeError 节点不存在
+        :raises: exception.EPIOError IO异常
+        """
+        raise exception.ENotImplement("function is not implement")
+
+    def _save_data(self, path, data):
+        """
+        将数据原样写入节点，由各持久化驱动实现
 
         :param str path: 数据存储路径
         :param str data: 待存储的数据
@@ -80,6 +344,227 @@ class BasePersistence(common.Singleton):
         """
         raise exception.ENotImplement("function is not implement")
 
+    def _is_ephemeral(self, path):
+        """
+        判断节点是否为临时节点，由各持久化驱动实现
+
+        :param str path: 节点路径
+        :return: True表示临时节点
+        :rtype: bool
+        :raises: exception.EPNoNodeError 节点不存在
+        :raises: exception.EPIOError IO异常
+        """
+        raise exception.ENotImplement("function is not implement")
+
+    def _write_payload(self, path, payload):
+        """
+        写入编码后的数据，设置了fencing token且路径在其保护范围内时，写入前校验token
+
+        :param str path: 数据存储路径
+        :param str payload: 编码后的数据
+        :return: 无返回
+        :rtype: None
+        """
+        if self._fenced(path):
+            self._save_fenced(path, payload)
+        else:
+            self._save_data(path, payload)
+
+    def set_fence(self, fence_path, token, scope=None):
+        """
+        设置当前实例的fencing token。设置后，scope下（fence_path除外）的数据写入均会校验fence_path中记录的token，
+        与本实例的token不一致时拒绝写入，以防止失去领导权的实例覆盖新主的数据。
+
+        .. Note:: 失去领导权后不应清除token，以使延迟到达的写入被拒绝
+
+        :param str fence_path: 记录当前有效token的节点路径，节点数据为包含token字段的json
+        :param int token: 本实例的token，None表示取消校验
+        :param str scope: 需要校验的路径前缀，None表示所有路径
+        :return: 无返回
+        :rtype: None
+        """
+        self._fence = (fence_path, token, scope) if token is not None else None
+
+    @property
+    def fence_token(self):
+        """
+        当前实例的fencing token
+
+        :return: token，未设置时为None
+        :rtype: int
+        """
+        return self._fence[1] if self._fence else None
+
+    def _fenced(self, path):
+        """
+        判断路径的写入是否需要校验token
+        """
+        if self._fence is None:
+            return False
+        fence_path, token, scope = self._fence
+        if path == fence_path:
+            return False
+        return scope is None or path == scope or path.startswith(scope + "/")
+
+    def _verify_fence(self, raw, fence=None):
+        """
+        校验fence节点中记录的token与本实例的token是否一致
+
+        :param str raw: fence节点的数据
+        :param tuple fence: (fence节点路径, token, 保护范围)，默认为本实例的fencing token
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPStaleToken token已过期
+        """
+        fence_path, token, _ = fence or self._fence
+        try:
+            current = json.loads(raw)["token"] if raw else None
+        except (ValueError, KeyError, TypeError):
+            current = None
+        if current != token:
+            raise exception.EPStaleToken("fencing token {} is stale, current:{}".format(token, current))
+
+    def check_fence(self, path=None):
+        """
+        校验本实例的fencing token是否仍然有效，用于删除等不经过 ``save_data`` 的写操作
+
+        :param str path: 待写入的路径，不在保护范围内时不校验；None表示总是校验
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPStaleToken token已过期
+        """
+        if self._fence is None or (path is not None and not self._fenced(path)):
+            return
+        try:
+            raw = self.get_data(self._fence[0])
+        except exception.EPNoNodeError:
+            raw = None
+        self._verify_fence(raw)
+
+    def _save_fenced(self, path, data, fence=None):
+        """
+        校验token后写入数据。默认实现先读后写，不是原子的，支持条件写入的驱动应重写
+
+        :param str path: 数据存储路径
+        :param str data: 编码后的数据
+        :param tuple fence: (fence节点路径, token, 保护范围)，默认为本实例的fencing token
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPStaleToken token已过期
+        """
+        fence = fence or self._fence
+        try:
+            raw = self.get_data(fence[0])
+        except exception.EPNoNodeError:
+            raw = None
+        self._verify_fence(raw, fence)
+        self._save_data(path, data)
+
+    def compare_and_save(self, path, data, token):
+        """
+        仅当path节点中记录的token（节点数据为包含token字段的json）与token一致时写入data，
+        用于租约等需要原子抢占的记录。校验与写入的原子性与 ``_save_fenced`` 相同
+
+        :param str path: 数据存储路径，节点需已存在
+        :param str data: 待写入的数据，应为包含token字段的json
+        :param int token: 期望的当前token
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPStaleToken 节点中的token与期望不一致
+        :raises: exception.EPNoNodeError 节点不存在
+        """
+        self._save_fenced(path, self._compress(data), (path, token, None))
+
+    def _compress(self, data):
+        """
+        按配置压缩数据，压缩无收益时返回原数据
+
+        :param str data: 原始数据
+        :return: 编码后的数据
+        :rtype: str
+        """
+        threshold = string.atoi(config.GuardianConfig.get(self.PERSIST_COMPRESS_THRESHOLD_NAME, "0"))
+        if threshold <= 0 or len(data) < threshold:
+            return data
+        compressed = self.COMPRESSED_MAGIC + zlib.compress(data)
+        return compressed if len(compressed) < len(data) else data
+
+    def _chunk_path(self, path, gen, index):
+        """
+        生成分块节点路径
+
+        :param str path: 数据节点路径
+        :param str gen: 分块的版本
+        :param int index: 分块序号
+        :return: 分块节点路径
+        :rtype: str
+        """
+        return "%s/%s%s-%d" % (path, self.CHUNK_PREFIX, gen, index)
+
+    def _write_chunks(self, path, payload, chunk_size):
+        """
+        将数据拆分写入分块节点
+
+        :param str path: 数据节点路径
+        :param str payload: 待拆分的数据
+        :param int chunk_size: 分块大小
+        :return: 分块清单
+        :rtype: str
+        """
+        gen = uuid.uuid4().hex[:12]
+        count = (len(payload) + chunk_size - 1) // chunk_size
+        for i in range(count):
+            self.create_node(self._chunk_path(path, gen, i), payload[i * chunk_size:(i + 1) * chunk_size])
+        manifest = {"gen": gen, "count": count, "size": len(payload),
+                    "md5": hashlib.md5(payload).hexdigest()}
+        return self.MANIFEST_MAGIC + json.dumps(manifest)
+
+    def _read_manifest(self, path):
+        """
+        读取节点当前的分块清单
+
+        :param str path: 数据节点路径
+        :return: 分块清单，节点不存在或未分块时返回None
+        :rtype: dict
+        """
+        try:
+            raw = self._get_data(path)
+        except exception.EPNoNodeError:
+            return None
+        if not raw or not raw.startswith(self.MANIFEST_MAGIC):
+            return None
+        return json.loads(raw[len(self.MANIFEST_MAGIC):])
+
+    def _decode(self, path, raw):
+        """
+        还原节点数据：合并分块并解压
+
+        :param str path: 数据节点路径
+        :param str raw: 节点中实际存储的数据
+        :return: 原始数据
+        :rtype: str
+        :raises: exception.EPIOError 分块损坏或持续被改写
+        """
+        retry = 0
+        while raw and raw.startswith(self.MANIFEST_MAGIC):
+            manifest = json.loads(raw[len(self.MANIFEST_MAGIC):])
+            try:
+                chunks = [self._get_data(self._chunk_path(path, manifest["gen"], i))
+                          for i in range(manifest["count"])]
+            except exception.EPNoNodeError:
+                # 读取过程中分块被新的写入替换，重新读取清单
+                retry += 1
+                if retry > self.CHUNK_READ_RETRY:
+                    raise exception.EPIOError("chunks of %s changed during read" % path)
+                raw = self._get_data(path)
+                continue
+            raw = "".join(chunks)
+            if len(raw) != manifest["size"] or hashlib.md5(raw).hexdigest() != manifest["md5"]:
+                raise exception.EPIOError("chunks of %s are corrupted" % path)
+        if raw and raw.startswith(self.COMPRESSED_MAGIC):
+            raw = zlib.decompress(raw[len(self.COMPRESSED_MAGIC):])
+        return raw
+
     def delete_node(self, path, force=False):
         """
         删除node节点
@@ -122,17 +607,38 @@ class BasePersistence(common.Singleton):
         """
         raise exception.ENotImplement("function is not implement")
 
-    def exists(self, path):
+    def exists(self, path, watcher=None):
         """
         查询制定path路径的节点是否存在
 
         :param str path: 待检查的节点路径
+        :param watcher: 状态监听函数，节点创建、删除或数据变化时触发一次。函数形参为(event)，event同 ``get_children``
         :return: True表示节点存在，False表示节点不存在
         :rtype: bool
         :raises: exception.EPIOError IO异常
         """
         raise exception.ENotImplement("function is not implement")
 
+    def iter_buckets(self, path, depth=0):
+        """
+        按桶遍历分桶布局下的叶子节点。每次只列出一个桶的子节点，调用方可以逐桶处理，
+        避免一次性列出全部节点带来的内存及请求包大小问题
+
+        :param str path: 分桶布局的根路径
+        :param int depth: 分桶层数，0表示不分桶
+        :return: 生成器，每次返回(桶路径, 桶内子节点名列表)
+        :rtype: generator
+        :raises: exception.EPNoNodeError 节点不存在
+        :raises: exception.EPIOError IO异常
+        """
+        children = self.get_children(path)
+        if depth <= 0:
+            yield path, children
+            return
+        for name in sorted(children):
+            for bucket in self.iter_buckets("/".join([path, name]), depth - 1):
+                yield bucket
+
     def add_listener(self, watcher):
         """
         监听会话状态
@@ -153,55 +659,166 @@ class BasePersistence(common.Singleton):
         """
         raise exception.ENotImplement("function is not implement")
 
+    def get_data_async(self, path):
+        """
+        ``get_data`` 的异步版本。默认同步执行并返回已完成的future，支持异步请求的驱动应重写
 
-class PlainPersistence(BasePersistence):
-    """
-    通过通用存储（文件、redis等）实现的持久化类基类。主要用来完成基础的轮询刷新时间、比对节点状态触发事件的功能。
-    实体节点的数据存放在.data子节点中。临时节点序号存放在.sequence中。临时节点会被定期touch以保持其最新，超时的会被自动删除。
-    """
-    _init = False
-
-    def __init__(self):
+        :param str path: 数据存储路径
+        :return: 结果为节点数据的future
+        :rtype: PersistenceFuture
         """
-        初始化方法
+        return PersistenceFuture.resolved(lambda: self.get_data(path))
+
+    def save_data_async(self, path, data):
         """
-        import threading
-        if self._init:
-            return
+        ``save_data`` 的异步版本
 
-        self._initf()
-        self._lock = threading.Lock()
-        self._inspect_results = {}
-        self._ob_paths = {}  # 需要观察路径下节点变化的路径列表
-        self._touch_paths = {}  # 针对临时节点，需要不断touch的路径列表
-        self._interval = string.atof(config.GuardianConfig.get(self.PERSIST_INTERVAL_NAME, "0.4"))
-        self._timeout = string.atof(config.GuardianConfig.get(self.PERSIST_TIMEOUT_NAME, "3"))
-        self._session_thread = threading.Thread(target=self._thread_run)
-        self._init = True
-        self._session_thread.setDaemon(True)
-        self._session_thread.start()
+        :param str path: 数据存储路径
+        :param str data: 待存储的数据
+        :return: 结果为None的future
+        :rtype: PersistenceFuture
+        """
+        return PersistenceFuture.resolved(lambda: self.save_data(path, data))
 
-    def __del__(self):
+    def create_node_async(self, path, value="", ephemeral=False, sequence=False, makepath=False):
         """
-        析构方法，完成线程回收
+        ``create_node`` 的异步版本
+
+        :param str path: 待创建的节点路径
+        :param str value: 待存数据
+        :param bool ephemeral: 是否是临时节点
+        :param bool sequence: 是否是自动分配节点序号
+        :param bool makepath: 是否创建父节点
+        :return: 结果为新创建节点路径的future
+        :rtype: PersistenceFuture
         """
-        self.disconnect()
+        return PersistenceFuture.resolved(
+            lambda: self.create_node(path, value, ephemeral, sequence, makepath))
 
-    def delete_node(self, path, force=False):
+    def delete_node_async(self, path, force=False):
         """
-        删除node节点
+        ``delete_node`` 的异步版本
+
         :param str path: 数据存储路径
         :param bool force: 是否强行删除而不判断节点有效性
-        :return: 无返回
-        :rtype: None
-        :raises: exception.EPNoNodeError 节点不存在
-        :raises: exception.EPIOError IO异常
+        :return: 结果为None的future
+        :rtype: PersistenceFuture
         """
-        self._del_record_when_delnode(path)
-        self._del_node(path, force)
-        log.d("delete node success, path:{path}".format(path=path))
+        return PersistenceFuture.resolved(lambda: self.delete_node(path, force))
 
-    def get_children(self, path, watcher=None, include_data=False):
+    def exists_async(self, path):
+        """
+        ``exists`` 的异步版本
+
+        :param str path: 待检查的节点路径
+        :return: 结果为bool的future
+        :rtype: PersistenceFuture
+        """
+        return PersistenceFuture.resolved(lambda: self.exists(path))
+
+    def get_children_async(self, path, include_data=False):
+        """
+        ``get_children`` 的异步版本，不支持watcher
+
+        :param str path: 待获取子节点的路径
+        :param bool include_data: 是否同时返回数据
+        :return: 结果为子节点名字列表的future
+        :rtype: PersistenceFuture
+        """
+        return PersistenceFuture.resolved(lambda: self.get_children(path, None, include_data))
+
+    def delete_nodes(self, paths):
+        """
+        批量删除节点，所有删除请求一次性发出后再等待结果。已不存在的节点会被忽略
+
+        :param list(str) paths: 待删除的节点路径列表
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPIOError IO异常
+        """
+        futures = [self.delete_node_async(path) for path in paths]
+        error = None
+        for future in futures:
+            try:
+                future.get()
+            except exception.EPNoNodeError:
+                pass
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    def save_or_create(self, path, data, makepath=False):
+        """
+        存储数据data到path节点，节点不存在时先创建节点
+
+        :param str path: 数据存储路径
+        :param str data: 待存储的数据
+        :param bool makepath: 是否创建父节点
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPNoNodeError 父节点不存在
+        :raises: exception.EPIOError IO异常
+        """
+        if not self.exists(path):
+            self.create_node(path=path, makepath=makepath)
+        self.save_data(path, data)
+
+
+class PlainPersistence(BasePersistence):
+    """
+    通过通用存储（文件、redis等）实现的持久化类基类。主要用来完成基础的轮询刷新时间、比对节点状态触发事件的功能。
+    实体节点的数据存放在.data子节点中。临时节点序号存放在.sequence中。临时节点会被定期touch以保持其最新，超时的会被自动删除。
+    """
+    _init = False
+
+    def __init__(self):
+        """
+        初始化方法
+        """
+        import threading
+        if self._init:
+            return
+
+        self._initf()
+        self._lock = threading.Lock()
+        self._inspect_results = {}
+        self._ob_paths = {}  # 需要观察路径下节点变化的路径列表
+        self._touch_paths = {}  # 针对临时节点，需要不断touch的路径列表
+        self._interval = string.atof(config.GuardianConfig.get(self.PERSIST_INTERVAL_NAME, "0.4"))
+        self._timeout = string.atof(config.GuardianConfig.get(self.PERSIST_TIMEOUT_NAME, "3"))
+        # 临时节点的续约间隔不超过超时时间的一定比例，与路径检查分开调度，避免检查耗时过长导致临时节点超时
+        touch_ratio = string.atof(config.GuardianConfig.get(self.PERSIST_TOUCH_RATIO_NAME, "0.3"))
+        self._touch_interval = self._timeout * touch_ratio
+        self._session_thread = threading.Thread(target=self._thread_run)
+        self._keepalive_thread = threading.Thread(target=self._keepalive_run)
+        self._init = True
+        self._session_thread.setDaemon(True)
+        self._session_thread.start()
+        self._keepalive_thread.setDaemon(True)
+        self._keepalive_thread.start()
+
+    def __del__(self):
+        """
+        析构方法，完成线程回收
+        """
+        self.disconnect()
+
+    def delete_node(self, path, force=False):
+        """
+        删除node节点
+        :param str path: 数据存储路径
+        :param bool force: 是否强行删除而不判断节点有效性
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPNoNodeError 节点不存在
+        :raises: exception.EPIOError IO异常
+        """
+        self._del_record_when_delnode(path)
+        self._del_node(path, force)
+        log.d("delete node success, path:{path}".format(path=path))
+
+    def get_children(self, path, watcher=None, include_data=False):
         """
         获取所有子节点
         :param str path: 待获取子节点的路径
@@ -220,9 +837,33 @@ class PlainPersistence(BasePersistence):
         if watcher:
             if not callable(watcher):
                 raise exception.ETypeMismatch("watcher must callable")
-            self._new_ob(path, watcher)
+            self._new_ob(path, watcher, self._refresh(path))
         return node_list
 
+    def exists(self, path, watcher=None):
+        """
+        查询制定path路径的节点是否存在
+
+        :param str path: 节点路径
+        :param watcher: 状态监听函数，节点创建、删除或数据、子节点变化时触发一次。函数形参为(event)，event同 ``get_children``
+        :return: True或False
+        :rtype: bool
+        :raises: exception.EPIOError IO异常
+        """
+        if not watcher:
+            return self._exists(path)
+        if not callable(watcher):
+            raise exception.ETypeMismatch("watcher must callable")
+        result = self._refresh(path)
+        self._new_ob(path, watcher, result)
+        return result["exist"]
+
+    def _exists(self, path):
+        """
+        查询制定path路径的节点是否存在，由各持久化驱动实现
+        """
+        raise exception.ENotImplement("function is not implement")
+
     def disconnect(self):
         """
         主动断开持久化请求
@@ -277,16 +918,29 @@ class PlainPersistence(BasePersistence):
         """
         raise exception.ENotImplement("function is not implement")
 
+    def _touch_batch(self, paths, now):
+        """
+        批量更新临时节点的时间。默认逐个调用 ``_touch`` ，支持批量请求的驱动应重写
+
+        :param list(str) paths: 临时节点路径列表
+        :param long now: 当前时间
+        :return: 已经不存在的临时节点路径列表
+        :rtype: list(str)
+        """
+        for tp in paths:
+            self._touch(tp, now)
+        return []
+
     def _inspect(self, obpath, watcher):
         """
         检查节点是否有变化，如果有则触发wather函数
         """
         result = self._refresh(obpath)
-        if obpath not in self._inspect_results:
+        last_result = self._inspect_results.get(obpath)
+        if last_result is None:
+            # 注册时未记录节点状态，以本次检查的结果为基准
             self._inspect_results[obpath] = result
-            last_result = {"exist": False, "md5": None, "children": {}}
-        else:
-            last_result = self._inspect_results[obpath]
+            return
 
         # 判断目录状态是否有变化。
         if last_result["exist"] != result["exist"]:
@@ -309,10 +963,9 @@ class PlainPersistence(BasePersistence):
                                      path=obpath))
             self._ignore(obpath)
             return
-        last_result.keys()
         # 判断子节点是否有变化
         if len(last_result["children"]) != len(result["children"]) or\
-           len(set(last_result["children"].keys()) - set(result["children"].keys())) != 0:
+           len(set(last_result["children"]) - set(result["children"])) != 0:
             watcher(PersistenceEvent(type=PersistenceEvent.EventType.CHILD,
                                      state=PersistenceEvent.PersistState.CONNECTED,
                                      path=obpath))
@@ -328,20 +981,42 @@ class PlainPersistence(BasePersistence):
 
     def _thread_run(self):
         """
-        获取路径变化的事件，并保持临时节点的时间为最新
+        获取路径变化的事件
         """
         while self._init:
             with self._lock:
                 ob_paths = copy.copy(self._ob_paths)
-                touch_paths = copy.copy(self._touch_paths)
-            now = long(time.time())
-            for tp in touch_paths:
-                self._touch(tp, now)
             for obp, watcher in ob_paths.iteritems():
-                self._inspect(obp, watcher)
+                # 单个路径检查失败不影响其他路径，下一轮继续检查
+                try:
+                    self._inspect(obp, watcher)
+                except Exception as e:
+                    log.f("inspect path {} failed".format(obp))
 
             time.sleep(self._interval)
 
+    def _keepalive_run(self):
+        """
+        保持临时节点的时间为最新
+        """
+        while self._init:
+            start = time.time()
+            with self._lock:
+                touch_paths = list(self._touch_paths)
+            if touch_paths:
+                try:
+                    vanished = self._touch_batch(touch_paths, long(start))
+                except Exception as e:
+                    # 请求失败时保留记录，下一轮继续续约
+                    log.w("touch ephemeral nodes failed:%s" % e)
+                    vanished = []
+                for tp in vanished:
+                    self._del_record_when_delnode(tp)
+            cost = time.time() - start
+            if cost > self._touch_interval:
+                log.w("touch %d ephemeral nodes cost %.3fs" % (len(touch_paths), cost))
+            time.sleep(max(self._touch_interval - cost, 0))
+
     def _new_touch(self, path):
         """
         增加一个touch的路径
@@ -351,14 +1026,18 @@ class PlainPersistence(BasePersistence):
                 return
             self._touch_paths[path] = ""
 
-    def _new_ob(self, path, watcher):
+    def _new_ob(self, path, watcher, last_result=None):
         """
-        增加一个检测的路径
+        增加一个检测的路径。last_result为注册时的节点状态，之后的检查与之比较，避免遗漏注册后立即发生的变化
         """
         with self._lock:
             if not self._init:
                 return
             self._ob_paths[path] = watcher
+            if last_result is not None:
+                self._inspect_results[path] = last_result
+            else:
+                self._inspect_results.pop(path, None)
 
     def _del_touch(self, path):
         """
@@ -378,21 +1057,248 @@ class PlainPersistence(BasePersistence):
 
     def _del_record_when_delnode(self, path):
         """
-        当路径不存在时清理与该路径相关的记录
+        当路径不存在时清理与该路径相关的记录。该路径上的watcher保留，由下一次检查触发DELETED事件后清理
         """
         with self._lock:
             for k in list(self._touch_paths):
-                if k.startswith(path):
+                if k == path or k.startswith(path + "/"):
                     self._touch_paths.pop(k)
-            for k in list(self._ob_paths):
-                if k.startswith(path):
-                    self._ob_paths.pop(k)
-                    self._inspect_results.pop(path)
 
 
 PersistenceDriver = BasePersistence
 
 
+class ConnectionGuard(object):
+    """
+    持久化连接保护，为驱动的请求提供带随机抖动的指数退避重试和熔断：
+
+    * 连接类异常按指数退避重试，重试间隔为[0, min(上限, 基数 * 2^n)]之间的随机值，避免大量实例同时重连
+    * 连续失败次数达到阈值后熔断（OPEN），熔断期间的请求直接失败，不再访问后端
+    * 熔断超过恢复时间后进入半开状态（HALF_OPEN），仅放行一个探测请求，成功则恢复（CLOSED），失败则重新熔断
+
+    熔断与恢复时分别以"SUSPENDED"、"CONNECTED"状态通知监听者，状态变化同时记录在 ``metrics`` 中
+    """
+    PERSIST_RETRY_TIMES_NAME = "PERSIST_RETRY_TIMES"
+    PERSIST_RETRY_BASE_NAME = "PERSIST_RETRY_BASE"
+    PERSIST_RETRY_MAX_NAME = "PERSIST_RETRY_MAX"
+    PERSIST_BREAKER_THRESHOLD_NAME = "PERSIST_BREAKER_THRESHOLD"
+    PERSIST_BREAKER_RESET_NAME = "PERSIST_BREAKER_RESET"
+
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name):
+        """
+        初始化方法
+
+        :param str name: 保护对象名，用作指标名前缀
+        """
+        self._name = name
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0
+        self._probing = False
+        self._retry_times = string.atoi(config.GuardianConfig.get(self.PERSIST_RETRY_TIMES_NAME, "3"))
+        self._retry_base = string.atof(config.GuardianConfig.get(self.PERSIST_RETRY_BASE_NAME, "0.1"))
+        self._retry_max = string.atof(config.GuardianConfig.get(self.PERSIST_RETRY_MAX_NAME, "2"))
+        self._threshold = string.atoi(config.GuardianConfig.get(self.PERSIST_BREAKER_THRESHOLD_NAME, "5"))
+        self._reset_timeout = string.atof(config.GuardianConfig.get(self.PERSIST_BREAKER_RESET_NAME, "10"))
+        metrics.Metrics().set(self._metric("breaker_state"), self._STATE_VALUES[self._state])
+
+    @property
+    def state(self):
+        """
+        当前熔断状态
+
+        :return: "CLOSED"、"OPEN"或"HALF_OPEN"
+        :rtype: str
+        """
+        return self._state
+
+    def _metric(self, name):
+        """
+        生成指标名
+        """
+        return "persistence.%s.%s" % (self._name, name)
+
+    def add_listener(self, watcher):
+        """
+        监听熔断状态变化
+
+        :param watcher: 状态监听函数。函数形参为(state)，熔断时为"SUSPENDED"，恢复时为"CONNECTED"
+        :return: 无返回
+        :rtype: None
+        """
+        self._listeners.append(watcher)
+
+    def _transit(self, state):
+        """
+        切换熔断状态并通知监听者，调用时需持有锁
+        """
+        if state == self._state:
+            return None
+        log.i("persistence[%s] circuit breaker %s -> %s" % (self._name, self._state, state))
+        old_state, self._state = self._state, state
+        metrics.Metrics().set(self._metric("breaker_state"), self._STATE_VALUES[state])
+        metrics.Metrics().incr(self._metric("breaker_%s" % state.lower()))
+        if state == self.OPEN and old_state == self.CLOSED:
+            return PersistenceEvent.PersistState.SUSPENDED
+        elif state == self.CLOSED:
+            return PersistenceEvent.PersistState.CONNECTED
+        return None
+
+    def _notify(self, persist_state):
+        """
+        通知监听者，调用时不能持有锁
+        """
+        if persist_state is None:
+            return
+        for watcher in self._listeners:
+            try:
+                watcher(persist_state)
+            except Exception as e:
+                log.f("persistence listener error")
+
+    def _acquire(self):
+        """
+        请求前检查熔断状态
+
+        :return: 本次请求是否为半开状态的探测请求
+        :rtype: bool
+        :raises: exception.EPConnectTimeout 熔断中
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return False
+            if self._state == self.OPEN and time.time() - self._opened_at >= self._reset_timeout:
+                self._transit(self.HALF_OPEN)
+            if self._state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+        metrics.Metrics().incr(self._metric("rejected"))
+        raise exception.EPConnectTimeout("persistence[%s] circuit breaker is open" % self._name)
+
+    def _on_success(self, probe):
+        """
+        请求成功，恢复熔断状态
+        """
+        with self._lock:
+            if probe:
+                self._probing = False
+            self._failures = 0
+            event = self._transit(self.CLOSED)
+        self._notify(event)
+
+    def _on_failure(self, probe):
+        """
+        请求失败，累计失败次数，达到阈值时熔断
+        """
+        metrics.Metrics().incr(self._metric("failures"))
+        event = None
+        with self._lock:
+            if probe:
+                self._probing = False
+            self._failures += 1
+            if probe or (self._state == self.CLOSED and self._failures >= self._threshold):
+                event = self._transit(self.OPEN)
+                self._opened_at = time.time()
+        self._notify(event)
+
+    def backoff(self, attempt):
+        """
+        计算第attempt次重试前的等待时间
+
+        :param int attempt: 重试序号，从0开始
+        :return: 等待秒数
+        :rtype: float
+        """
+        return random.uniform(0, min(self._retry_max, self._retry_base * (2 ** attempt)))
+
+    def call(self, func, retriable, retry=True):
+        """
+        在连接保护下执行func
+
+        :param func: 无参函数
+        :param retriable: 判断异常是否为可重试的连接类异常，形参为(exception)
+        :param bool retry: 是否允许重试。非幂等请求应设为False
+        :return: func的返回值
+        :raises: exception.EPConnectTimeout 熔断中或重试耗尽
+        :raises: Exception func抛出的非连接类异常
+        """
+        return self._call(func, retriable, retry, 0)
+
+    def _call(self, func, retriable, retry, attempt):
+        """
+        从第attempt次重试开始，在连接保护下执行func
+        """
+        while True:
+            probe = self._acquire()
+            try:
+                result = func()
+            except Exception as e:
+                if not retriable(e):
+                    # 非连接类异常说明后端可用
+                    self._on_success(probe)
+                    raise
+                self._on_failure(probe)
+                if not retry or probe or attempt >= self._retry_times or self._state != self.CLOSED:
+                    raise exception.EPConnectTimeout(str(e))
+                metrics.Metrics().incr(self._metric("retries"))
+                time.sleep(self.backoff(attempt))
+                attempt += 1
+            else:
+                self._on_success(probe)
+                return result
+
+    def call_async(self, start, retriable, retry=True):
+        """
+        在连接保护下发出异步请求。请求的结果在调用方获取时计入熔断状态，连接类异常按与 ``call`` 相同的规则
+        退避重试，重试在调用方线程中同步执行
+
+        .. Note:: 半开状态下的探测请求在调用方获取结果后才会结束，因此发出的请求都应获取结果
+
+        :param start: 无参函数，发出请求并返回future
+        :param retriable: 判断异常是否为可重试的连接类异常，形参为(exception)
+        :param bool retry: 是否允许重试。非幂等请求应设为False
+        :return: future，其异常与 ``call`` 一致
+        :rtype: PersistenceFuture
+        """
+        try:
+            probe = self._acquire()
+        except exception.EPConnectTimeout as e:
+            future = PersistenceFuture()
+            future.set_exception(e)
+            return future
+        try:
+            source = start()
+        except Exception as e:
+            source = PersistenceFuture()
+            source.set_exception(e)
+
+        def _result(done):
+            try:
+                value = done.get()
+            except Exception as e:
+                if not retriable(e):
+                    self._on_success(probe)
+                    raise
+                self._on_failure(probe)
+                if not retry or probe or self._retry_times <= 0 or self._state != self.CLOSED:
+                    raise exception.EPConnectTimeout(str(e))
+            else:
+                self._on_success(probe)
+                return value
+            metrics.Metrics().incr(self._metric("retries"))
+            time.sleep(self.backoff(0))
+            return self._call(lambda: start().get(), retriable, retry, 1)
+
+        return source.then(_result)
+
+
 class ZkPersistence(BasePersistence):
     """
     Zookeeper持久化实现，封装对zookeeper的操作，包括对zookeeper节点的增删改查
@@ -410,14 +1316,30 @@ class ZkPersistence(BasePersistence):
         self._client.start()
         ZkPersistence._init = True
 
+    _guard = None
+
+    @classmethod
+    def _connection_guard(cls):
+        """
+        获取连接保护对象
+
+        :return: 连接保护对象
+        :rtype: ConnectionGuard
+        """
+        if cls._guard is None:
+            cls._guard = ConnectionGuard("zookeeper")
+        return cls._guard
+
     @classmethod
-    def _run_catch(cls, func):
+    def _run_catch(cls, func, retry=True):
         """
-        执行func并捕获异常，将kazoo异常转换为对应的异常对象
+        执行func并捕获异常，将kazoo异常转换为对应的异常对象。连接类异常会在连接保护下退避重试
         """
         import kazoo
         try:
-            return func()
+            return cls._connection_guard().call(func, cls._retriable, retry)
+        except (exception.EPConnectTimeout, exception.EPStaleToken):
+            raise
         except kazoo.exceptions.NoNodeError:
             raise exception.EPNoNodeError()
         except kazoo.exceptions.ZookeeperError:
@@ -427,62 +1349,301 @@ class ZkPersistence(BasePersistence):
             log.r(exception.EPIOError(), "Requesst I/O Error")
 
     @classmethod
-    def _new_session(cls):
+    def _retriable(cls, e):
         """
-        创建kazoo.client.KazooClient实例
+        判断kazoo异常是否为可重试的连接类异常
+        """
+        import kazoo
+        return isinstance(e, (kazoo.exceptions.ConnectionLoss,
+                              kazoo.exceptions.OperationTimeoutError))
 
-        :return: kazoo.client.KazooClient实例
-        :rtype: kazoo.client.KazooClient
-        :raises: exception.EPConnectTimeout 连接超时异常
+    @classmethod
+    def _convert_error(cls, e):
         """
-        # 仅在必要的情况下才引入kazoo
-        from kazoo import client
-        hosts = config.GuardianConfig.get(config.STATE_SERVICE_HOSTS_NAME)
-        params = json.loads(config.GuardianConfig.get(cls.PERSIST_PARAMETERS_NAME, '{}'))
-        return ZkPersistence._run_catch(lambda: (client.KazooClient(hosts=hosts, **params)))
+        将kazoo异常转换为对应的异常对象
 
-    def get_data(self, path):
+        :param Exception e: kazoo异常
+        :return: 转换后的异常
+        :rtype: Exception
         """
-        获得指定路径path的节点数据
+        import kazoo
+        if isinstance(e, kazoo.exceptions.NoNodeError):
+            return exception.EPNoNodeError()
+        elif isinstance(e, kazoo.exceptions.ZookeeperError):
+            return exception.EPServerError(str(e))
+        return exception.EPIOError(str(e))
+
+    def _raw_async(self, async_result, convert=None):
+        """
+        将kazoo的IAsyncResult包装为PersistenceFuture，异常保持为kazoo的原始异常
+
+        :param async_result: kazoo异步请求结果
+        :param convert: 对请求结果的转换函数
+        :return: future
+        :rtype: PersistenceFuture
+        """
+        future = PersistenceFuture()
+
+        def _done(result):
+            try:
+                value = result.get(block=False)
+            except Exception as e:
+                future.set_exception(e)
+            else:
+                future.set_result(convert(value) if convert else value)
+
+        async_result.rawlink(_done)
+        return future
+
+    def _wrap_async(self, start, retry=True):
+        """
+        在连接保护下发出kazoo异步请求，连接类异常计入熔断状态并退避重试，其他异常转换为对应的异常对象
+
+        :param start: 无参函数，发出请求并返回 ``_raw_async`` 包装的future
+        :param bool retry: 是否允许重试。非幂等请求应设为False
+        :return: future
+        :rtype: PersistenceFuture
+        """
+        def _convert(source):
+            try:
+                return source.get()
+            except (exception.EPConnectTimeout, exception.EPStaleToken):
+                raise
+            except Exception as e:
+                raise self._convert_error(e)
+
+        return self._connection_guard().call_async(start, self._retriable, retry).then(_convert)
+
+    def get_data_async(self, path):
+        """
+        ``get_data`` 的异步版本
 
         :param str path: 数据存储路径
-        :return: 节点数据
-        :rtype: str
-        :raises: exception.EPNoNodeError 节点不存在
-        :raises: exception.EPIOError 连接异常
+        :return: 结果为节点数据的future
+        :rtype: PersistenceFuture
         """
-        return ZkPersistence._run_catch(lambda: (self._client.get(path)[0]))
+        future = self._wrap_async(lambda: self._raw_async(self._client.get_async(path), lambda value: value[0]))
+        # 分块数据的合并需要阻塞请求，在调用方线程中进行
+        return future.then(lambda source: self._decode(path, source.get()))
 
-    def save_data(self, path, data):
+    def save_data_async(self, path, data):
         """
-        存储数据data到特定的path路径节点
+        ``save_data`` 的异步版本
 
         :param str path: 数据存储路径
         :param str data: 待存储的数据
-        :return: None
-        :raises: exception.EPNoNodeError 节点不存在
-        :raises: exception.EPIOError 连接异常
+        :return: 结果为None的future
+        :rtype: PersistenceFuture
         """
-        ZkPersistence._run_catch(lambda: (self._client.set(path, data)))
-        log.d("save data success, path:{path}, data:{data}".format(path=path, data=data))
+        if string.atoi(config.GuardianConfig.get(self.PERSIST_CHUNK_SIZE_NAME, "0")) > 0 or self._fenced(path):
+            # 分块写入及token校验需要多次请求，退化为同步执行
+            return PersistenceFuture.resolved(lambda: self.save_data(path, data))
+        payload = self._compress(data)
+        return self._wrap_async(lambda: self._raw_async(self._client.set_async(path, payload), lambda value: None))
 
-    def delete_node(self, path, force=False):
+    def create_node_async(self, path, value="", ephemeral=False, sequence=False, makepath=False):
         """
-        删除node节点
+        ``create_node`` 的异步版本
+
+        :param str path: 节点路径
+        :param str value: 待存数据
+        :param bool ephemeral: 是否是临时节点
+        :param bool sequence: 是否是顺序节点
+        :param bool makepath: 是否创建父节点
+        :return: 结果为新创建节点路径的future
+        :rtype: PersistenceFuture
+        """
+        # 顺序节点的创建不是幂等的，不能重试
+        return self._wrap_async(lambda: self._raw_async(self._client.create_async(
+            path, value, None, ephemeral, sequence, makepath)), not sequence)
+
+    def delete_node_async(self, path, force=False):
+        """
+        ``delete_node`` 的异步版本。节点有子节点时，在调用方获取结果时退化为同步的递归删除
+
         :param str path: 数据存储路径
         :param bool force: 是否强行删除而不判断节点有效性
-        :return None
+        :return: 结果为None的future
+        :rtype: PersistenceFuture
         """
-        if force:
-            self._client.delete(path=path, recursive=True)
-        else:
-            self._run_catch(lambda: (self._client.delete(path=path, recursive=True)))
-        log.d("delete node success, path:{path}".format(path=path))
+        import kazoo
 
-    def get_children(self, path, watcher=None, include_data=False):
-        """
-        获取所有子节点
-        :param str path: 待获取子节点的路径
+        def _start():
+            future = PersistenceFuture()
+
+            def _done(result):
+                try:
+                    result.get(block=False)
+                except kazoo.exceptions.NotEmptyError:
+                    future.set_result(True)
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(False)
+
+            self._client.delete_async(path).rawlink(_done)
+            return future
+
+        def _recursive(source):
+            if source.get():
+                self.delete_node(path, force)
+
+        return self._wrap_async(_start).then(_recursive)
+
+    def exists_async(self, path):
+        """
+        ``exists`` 的异步版本
+
+        :param str path: 节点路径
+        :return: 结果为bool的future
+        :rtype: PersistenceFuture
+        """
+        return self._wrap_async(lambda: self._raw_async(self._client.exists_async(path),
+                                                        lambda stat: stat is not None))
+
+    def get_children_async(self, path, include_data=False):
+        """
+        ``get_children`` 的异步版本，不支持watcher
+
+        :param str path: 待获取子节点的路径
+        :param bool include_data: 是否同时返回数据
+        :return: 结果为子节点名字列表的future
+        :rtype: PersistenceFuture
+        """
+        return self._wrap_async(lambda: self._raw_async(self._client.get_children_async(path, None, include_data),
+                                                        lambda result: self._hide_children(result, include_data)))
+
+    def save_or_create(self, path, data, makepath=False):
+        """
+        存储数据data到path节点，节点不存在时先创建节点。节点已存在时只需一次请求
+
+        :param str path: 数据存储路径
+        :param str data: 待存储的数据
+        :param bool makepath: 是否创建父节点
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPNoNodeError 父节点不存在
+        :raises: exception.EPIOError IO异常
+        """
+        try:
+            self.save_data_async(path, data).get()
+        except exception.EPNoNodeError:
+            self.create_node(path, makepath=makepath)
+            self.save_data(path, data)
+        log.d("save data success, path:{path}".format(path=path))
+
+    @classmethod
+    def _hide_children(cls, result, include_data):
+        """
+        去除子节点列表中的隐藏节点（如数据分块）
+
+        :param result: kazoo返回的子节点列表，include_data为True时为(子节点列表, 节点状态)
+        :param bool include_data: 是否同时返回数据
+        :return: 去除隐藏节点后的结果
+        """
+        if include_data:
+            children, stat = result
+            return [child for child in children if child[0:1] != "."], stat
+        return [child for child in result if child[0:1] != "."]
+
+    @classmethod
+    def _new_session(cls):
+        """
+        创建kazoo.client.KazooClient实例
+
+        :return: kazoo.client.KazooClient实例
+        :rtype: kazoo.client.KazooClient
+        :raises: exception.EPConnectTimeout 连接超时异常
+        """
+        # 仅在必要的情况下才引入kazoo
+        from kazoo import client
+        hosts = config.GuardianConfig.get(config.STATE_SERVICE_HOSTS_NAME)
+        params = json.loads(config.GuardianConfig.get(cls.PERSIST_PARAMETERS_NAME, '{}'))
+        return ZkPersistence._run_catch(lambda: (client.KazooClient(hosts=hosts, **params)))
+
+    def _is_ephemeral(self, path):
+        """
+        判断节点是否为临时节点
+
+        :param str path: 节点路径
+        :return: True表示临时节点
+        :rtype: bool
+        """
+        stat = self._run_catch(lambda: self._client.exists(path))
+        if stat is None:
+            raise exception.EPNoNodeError("Node not exist:{}".format(path))
+        return stat.ephemeralOwner != 0
+
+    def _get_data(self, path):
+        """
+        获得指定路径path的节点数据
+
+        :param str path: 数据存储路径
+        :return: 节点数据
+        :rtype: str
+        :raises: exception.EPNoNodeError 节点不存在
+        :raises: exception.EPIOError 连接异常
+        """
+        return ZkPersistence._run_catch(lambda: (self._client.get(path)[0]))
+
+    def _save_data(self, path, data):
+        """
+        存储数据data到特定的path路径节点
+
+        :param str path: 数据存储路径
+        :param str data: 待存储的数据
+        :return: None
+        :raises: exception.EPNoNodeError 节点不存在
+        :raises: exception.EPIOError 连接异常
+        """
+        ZkPersistence._run_catch(lambda: (self._client.set(path, data)))
+        log.d("save data success, path:{path}, data:{data}".format(path=path, data=data))
+
+    def _save_fenced(self, path, data, fence=None):
+        """
+        校验token后写入数据。通过事务检查fence节点的版本，保证校验与写入的原子性
+        """
+        import kazoo
+        fence = fence or self._fence
+        fence_path = fence[0]
+
+        def _save():
+            for _ in range(self.CHUNK_READ_RETRY):
+                raw, stat = self._client.get(fence_path)
+                self._verify_fence(self._decode(fence_path, raw), fence)
+                transaction = self._client.transaction()
+                transaction.check(fence_path, stat.version)
+                transaction.set_data(path, data)
+                results = transaction.commit()
+                if isinstance(results[0], kazoo.exceptions.BadVersionError):
+                    # fence节点在校验后被改写（如租约续约），重新校验
+                    continue
+                for result in results:
+                    if isinstance(result, Exception) and \
+                            not isinstance(result, kazoo.exceptions.RolledBackError):
+                        raise result
+                return
+            raise exception.EPStaleToken("fence node {} changed during write".format(fence_path))
+
+        ZkPersistence._run_catch(_save)
+
+    def delete_node(self, path, force=False):
+        """
+        删除node节点
+        :param str path: 数据存储路径
+        :param bool force: 是否强行删除而不判断节点有效性
+        :return None
+        """
+        if force:
+            self._client.delete(path=path, recursive=True)
+        else:
+            self._run_catch(lambda: (self._client.delete(path=path, recursive=True)))
+        log.d("delete node success, path:{path}".format(path=path))
+
+    def get_children(self, path, watcher=None, include_data=False):
+        """
+        获取所有子节点
+        :param str path: 待获取子节点的路径
         :param watcher: 状态监听函数。函数形参为(event)，event是一个对象，包括三个成员属性：path（发生状态变化的路径）、state（server链接状态）、type（事件类型，包括CREATED|DELETED|CHANGED|CHILD|NONE）
         :param bool include_data: 是否同时返回数据
         :return: 子节点名字列表
@@ -501,8 +1662,8 @@ class ZkPersistence(BasePersistence):
             event = PersistenceEvent(zkevent.type, state, zkevent.path)
             return watcher(event)
 
-        return ZkPersistence._run_catch(
-                        lambda: (self._client.get_children(path, watcher and dec, include_data)))
+        return self._hide_children(ZkPersistence._run_catch(
+                        lambda: (self._client.get_children(path, watcher and dec, include_data))), include_data)
 
     def create_node(self, path, value="", ephemeral=False, sequence=False, makepath=False):
         """
@@ -518,9 +1679,10 @@ class ZkPersistence(BasePersistence):
         :raises: exception.EPNoNodeError 节点不存在
         :raises: exception.EPIOError IO异常
         """
+        # 顺序节点的创建不是幂等的，不能重试
         node_path = ZkPersistence._run_catch(lambda: (self._client.create(path, value, None,
                                                               ephemeral, sequence,
-                                                              makepath)))
+                                                              makepath)), not sequence)
 
         log.d("create node success, path:{path}, value:{value}, ephemeral:"
               "{ephemeral}, sequence:{sequence}, makepath:{makepath}".format(
@@ -529,16 +1691,28 @@ class ZkPersistence(BasePersistence):
                                                         makepath=makepath))
         return node_path
 
-    def exists(self, path):
+    def exists(self, path, watcher=None):
         """
         查询制定path路径的节点是否存在
 
         :param str path: 节点路径
+        :param func watcher: 节点创建、删除或数据变化时的回调函数，为None时不注册
         :return: True或False
         :rtype: bool
         :raises: exception.EPIOError IO异常
         """
-        return ZkPersistence._run_catch(lambda: (self._client.exists(path)))
+        # 装饰watcher，将state、type转换为ARK内定义
+        def dec(zkevent):
+            if zkevent.state == "CONNECTED" or zkevent.state == "CONNECTED_RO":
+                state = PersistenceEvent.PersistState.CONNECTED
+            elif zkevent.state == "CONNECTING":
+                state = PersistenceEvent.PersistState.SUSPENDED
+            else:
+                state = PersistenceEvent.PersistState.LOST
+            event = PersistenceEvent(zkevent.type, state, zkevent.path)
+            return watcher(event)
+
+        return ZkPersistence._run_catch(lambda: (self._client.exists(path, watcher and dec)))
 
     def add_listener(self, watcher):
         """
@@ -555,6 +1729,8 @@ class ZkPersistence(BasePersistence):
             return watcher(state)
 
         ZkPersistence._run_catch(lambda: (self._client.add_listener(watcher and dec)))
+        if watcher:
+            self._connection_guard().add_listener(watcher)
         log.d("add listener success")
 
     def disconnect(self):
@@ -569,12 +1745,101 @@ class ZkPersistence(BasePersistence):
         log.d("disconnect success")
 
 
+class GroupSync(object):
+    """
+    目录组提交（group fsync）。并发写入在短时间窗口内提交的目录同步请求会被合并，
+    由其中一个写入者（leader）统一执行fsync，其余写入者等待该批次完成后返回。
+
+    .. Note:: 同一批次内相同的目录只会fsync一次；窗口为0时不主动等待，
+             仅合并leader执行fsync期间到达的请求。
+    """
+
+    def __init__(self, window=0):
+        """
+        初始化方法
+
+        :param float window: 合并窗口（秒）
+        """
+        self._window = window
+        self._cond = threading.Condition()
+        self._pending = set()
+        self._generation = 0
+        self._synced = -1
+        self._leader = False
+        self._failed = {}
+
+    def sync(self, dirname):
+        """
+        同步目录dirname，直到包含该目录的批次fsync完成后返回
+
+        :param str dirname: 待同步的目录
+        :return: 无返回
+        :rtype: None
+        :raises: OSError fsync失败
+        """
+        with self._cond:
+            self._pending.add(dirname)
+            generation = self._generation
+            while self._synced < generation:
+                if not self._leader:
+                    self._leader = True
+                    break
+                self._cond.wait()
+            else:
+                return self._check(dirname, generation)
+
+        if self._window > 0:
+            time.sleep(self._window)
+        with self._cond:
+            batch, self._pending = self._pending, set()
+            batch_generation = self._generation
+            self._generation += 1
+
+        failed = {}
+        for path in batch:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                failed[path] = e
+
+        with self._cond:
+            for path in batch:
+                if path in failed:
+                    self._failed[path] = (batch_generation, failed[path])
+                else:
+                    self._failed.pop(path, None)
+            self._synced = batch_generation
+            self._leader = False
+            self._cond.notify_all()
+            return self._check(dirname, generation)
+
+    def _check(self, dirname, generation):
+        """
+        检查目录所在批次是否同步失败，失败则抛出对应的异常
+        """
+        if dirname in self._failed:
+            failed_generation, e = self._failed[dirname]
+            if failed_generation >= generation:
+                raise e
+
+
 class FilePersistence(PlainPersistence):
     """
     通过文件系统实现的持久化类。
     实体节点用文件系统中的目录表示，实体节点的数据存放在目录下的.data文件中。
     临时节点用文件系统中的文件来表示，临时节点的数据存放在对应文件中，临时节点（文件）会被定期touch以保持其最新，超时的节点会在列出或获取数据时校验并删除。
 
+    数据文件的写入方式由 ``PERSIST_DURABILITY`` 配置决定：
+
+    * ``none`` 直接覆盖写入，数据仅保证进入page cache（默认）
+    * ``atomic`` 先写入同目录下的临时文件再rename，保证崩溃后不会读到截断的数据
+    * ``durable`` 在atomic基础上fsync数据文件及所在目录，目录的fsync在 ``PERSIST_FSYNC_WINDOW`` 窗口内组提交
+
+    .. Note:: 以"."开头的文件（如.data、.sequence及写入中的临时文件）为内部文件，不作为子节点列出
     """
     _file_mode = "0755"
 
@@ -585,9 +1850,57 @@ class FilePersistence(PlainPersistence):
         """
         self._base = config.GuardianConfig.get(config.STATE_SERVICE_HOSTS_NAME)
         self._mode = string.atoi(config.GuardianConfig.get(self.PERSIST_MODE_NAME, self._file_mode), 8)
+        self._durability = config.GuardianConfig.get(self.PERSIST_DURABILITY_NAME, self.DURABILITY_NONE)
+        if self._durability not in (self.DURABILITY_NONE, self.DURABILITY_ATOMIC, self.DURABILITY_DURABLE):
+            raise exception.ETypeMismatch("unknown durability mode:{}".format(self._durability))
+        self._group_sync = GroupSync(
+            string.atof(config.GuardianConfig.get(self.PERSIST_FSYNC_WINDOW_NAME, "0")))
         if not os.path.exists(self._base):
             os.makedirs(self._base, self._mode)
 
+    def _write_file(self, file_path, data):
+        """
+        按照持久化模式写入数据文件
+
+        :param str file_path: 文件系统中的文件路径
+        :param str data: 待写入的数据
+        :return: 无返回
+        :rtype: None
+        """
+        if self._durability == self.DURABILITY_NONE:
+            with open(file_path, 'w') as f:
+                f.write(data)
+            return
+
+        dirname, basename = os.path.split(file_path)
+        tmp_path = "/".join((dirname, ".%s.%d.%d.tmp" % (
+            basename, os.getpid(), threading.current_thread().ident)))
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+                if self._durability == self.DURABILITY_DURABLE:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.rename(tmp_path, file_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self._durability == self.DURABILITY_DURABLE:
+            self._group_sync.sync(dirname)
+
+    def _make_dirs(self, ospath):
+        """
+        创建实体节点对应的目录，durable模式下同步其父目录以保证目录项落盘
+
+        :param str ospath: 文件系统中的目录路径
+        :return: 无返回
+        :rtype: None
+        """
+        os.makedirs(ospath, self._mode)
+        if self._durability == self.DURABILITY_DURABLE:
+            self._group_sync.sync(os.path.dirname(ospath))
+
     def _del_node(self, path, force):
         """
         删除node节点
@@ -622,6 +1935,25 @@ class FilePersistence(PlainPersistence):
         # 更新临时节点时间
         os.utime(ospath, None)
 
+    def _touch_batch(self, paths, now):
+        """
+        批量更新临时节点的时间，不再逐个检查节点是否存在
+
+        :param list(str) paths: 临时节点路径列表
+        :param long now: 当前时间
+        :return: 已经不存在的临时节点路径列表
+        :rtype: list(str)
+        """
+        vanished = []
+        for tp in paths:
+            try:
+                os.utime(self._base + tp, None)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+                vanished.append(tp)
+        return vanished
+
     def _valid_chd(self, path, include_data=False):
         """
         获取所有子节点，并校验子节点是否有效。默认不获取子节点数据
@@ -631,20 +1963,20 @@ class FilePersistence(PlainPersistence):
             ospath = self._base + path
             result = {}
             for node_name in os.listdir(ospath):
-                if node_name == ".data" or node_name == ".sequence":
+                if node_name[0:1] == ".":
                     continue
                 file_name = "/".join([ospath, node_name])
-                node_name = "/".join([path, node_name])
+                chd_path = "/".join([path, node_name])
                 if os.path.isfile(file_name):
                     mtime = os.stat(file_name).st_mtime
                     if mtime < valid_time:
-                        self.delete_node(node_name, True)
+                        self.delete_node(chd_path, True)
                         continue
 
                 if not include_data:
                     result[node_name] = ""
                 else:
-                    data = self.get_data(node_name)
+                    data = self.get_data(chd_path)
                     result[node_name] = data
             return result
         return self._run_catch(_valid, path, True)
@@ -656,21 +1988,24 @@ class FilePersistence(PlainPersistence):
         obpath = self._base + path
         result = {}
         # 获取该路径所有状态
-        if self.exists(path):
+        try:
+            # 临时节点在检查过程中可能超时被删除，此时按节点不存在处理
+            data = self._get_data(path) if self._exists(path) else None
+        except exception.EPNoNodeError:
+            data = None
+        if data is not None:
             result["exist"] = True
             # 获取该路径数据
             import hashlib
-            data = self.get_data(path)
             md5 = hashlib.md5()
             md5.update(data)
             result["md5"] = md5.hexdigest()
 
-            # 获取所有子节点，去除两个内置文件
-            result["children"] = set([name for name in os.listdir(obpath)])
-            if ".data" in result["children"]:
-                result["children"].remove(".data")
-            if ".sequence" in result["children"]:
-                result["children"].remove(".sequence")
+            # 获取所有子节点，去除内置文件；临时节点以文件保存，没有子节点
+            if os.path.isdir(obpath):
+                result["children"] = set([name for name in os.listdir(obpath) if name[0:1] != "."])
+            else:
+                result["children"] = set()
         else:
             result["exist"] = False
             result["md5"] = None
@@ -703,7 +2038,18 @@ class FilePersistence(PlainPersistence):
         except Exception as e:
             log.r(exception.EPIOError(), "Request I/O Error")
 
-    def get_data(self, path):
+    def _is_ephemeral(self, path):
+        """
+        判断节点是否为临时节点，临时节点以文件表示
+
+        :param str path: 节点路径
+        :return: True表示临时节点
+        :rtype: bool
+        """
+        ospath = self._base + path
+        return self._run_catch(lambda: os.path.isfile(ospath), path)
+
+    def _get_data(self, path):
         """
         获得指定路径path的节点数据
 
@@ -727,7 +2073,7 @@ class FilePersistence(PlainPersistence):
 
         return self._run_catch(_readdata, path)
 
-    def save_data(self, path, data):
+    def _save_data(self, path, data):
         """
         存储数据data到特定的path路径节点
 
@@ -745,55 +2091,176 @@ class FilePersistence(PlainPersistence):
                 file_path = "/".join((ospath, ".data"))
             else:
                 file_path = ospath
-            with open(file_path, 'w') as f:
-                return f.write(data)
+            self._write_file(file_path, data)
 
         self._run_catch(_writedata, path)
         log.d("save data success, path:{path}".format(path=path))
 
+    def _create_file_exclusive(self, file_path, data):
+        """
+        按照持久化模式创建数据文件，文件已存在时不覆盖
+
+        :param str file_path: 文件系统中的文件路径
+        :param str data: 待写入的数据
+        :return: 是否创建成功，False表示文件已存在
+        :rtype: bool
+        """
+        if self._durability == self.DURABILITY_NONE:
+            try:
+                fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0644)
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    return False
+                raise
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+            return True
+
+        # 先写临时文件，再以硬链接的方式原子地、排他地发布
+        dirname, basename = os.path.split(file_path)
+        tmp_path = "/".join((dirname, ".%s.%d.%d.tmp" % (
+            basename, os.getpid(), threading.current_thread().ident)))
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(data)
+                if self._durability == self.DURABILITY_DURABLE:
+                    f.flush()
+                    os.fsync(f.fileno())
+            try:
+                os.link(tmp_path, file_path)
+            except OSError as e:
+                if e.errno == errno.EEXIST:
+                    return False
+                raise
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if self._durability == self.DURABILITY_DURABLE:
+            self._group_sync.sync(dirname)
+        return True
+
+    def _lock_fd(self, fd, name):
+        """
+        对文件加排他锁，等待时间不超过PERSIST_TIMEOUT
+
+        :param int fd: 文件描述符
+        :param str name: 锁的名称，用于错误信息
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPIOError 等待超时
+        """
+        import fcntl
+        deadline = time.time() + self._timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except IOError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            if time.time() >= deadline:
+                raise exception.EPIOError("wait {} lock timeout".format(name))
+            time.sleep(0.001)
+
+    @contextlib.contextmanager
+    def _fence_lock(self, path):
+        """
+        对fence节点所在的目录加排他锁。数据文件以替换的方式写入，因此锁加在目录上而不是数据文件上
+
+        :param str path: fence节点路径
+        :raises: exception.EPNoNodeError 父节点不存在
+        :raises: exception.EPIOError 等待超时
+        """
+        import fcntl
+        try:
+            fd = os.open(os.path.dirname(self._base + path), os.O_RDONLY)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                raise exception.EPNoNodeError("parent of {} not exist".format(path))
+            raise exception.EPIOError("open fence lock of {} fail".format(path))
+        try:
+            self._lock_fd(fd, "fence")
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def _save_fenced(self, path, data, fence=None):
+        """
+        校验token后写入数据。校验与写入在fence节点所在目录的文件锁内完成，
+        多个进程（实例）对同一fence节点的条件写入（如租约抢占）互斥
+
+        :param str path: 数据存储路径
+        :param str data: 编码后的数据
+        :param tuple fence: (fence节点路径, token, 保护范围)，默认为本实例的fencing token
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPStaleToken token已过期
+        """
+        fence = fence or self._fence
+        with self._fence_lock(fence[0]):
+            super(FilePersistence, self)._save_fenced(path, data, fence)
+
     @classmethod
-    def _seq_file_name(cls, ospath, value):
+    def _scan_sequence(cls, dirname, basename):
         """
-        生成临时节点的序列号并写入数据。最大序列号会被记录在.sequence文件中。以避免前后多次运行使用同一序列号。序列号生成的过程通过文件锁保证事务
+        扫描目录，获取与basename前缀匹配的节点的最大序号。仅在序列号文件丢失或损坏时用于恢复
+
+        :param str dirname: 父节点目录
+        :param str basename: 节点名前缀
+        :return: 最大序号，不存在时为-1
+        :rtype: int
         """
         import re
+        max_sn = -1
+        for name in os.listdir(dirname):
+            if name[0:1] == ".":
+                continue
+            if len(name) < len(basename) or name[0:len(basename)] != basename:
+                continue
+            sn = name[len(basename):]
+            if not re.match("[0-9]+$", sn):
+                continue
+            max_sn = max(max_sn, string.atoi(sn))
+        return max_sn
+
+    def _seq_file_name(self, ospath, value):
+        """
+        生成临时节点的序列号并写入数据。最大序列号会被记录在.sequence文件中。以避免前后多次运行使用同一序列号。
+        序列号的读取与自增在文件锁内完成，仅当.sequence文件为空（目录中首次创建顺序节点）或损坏时才扫描目录恢复
+        """
         import fcntl
         dirname = os.path.dirname(ospath)
         basename = os.path.basename(ospath)
-        max_sn = -1
 
-        with open("/".join((dirname, ".sequence")), 'a+') as f:
-            f.seek(0)
-            try:
-                max_sn = string.atoi("0" + f.read(11))
-            except ValueError:
-                pass
+        fd = os.open("/".join((dirname, ".sequence")), os.O_RDWR | os.O_CREAT, 0644)
+        try:
             # 加文件锁，保证序列id自增的唯一性
-            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            self._lock_fd(fd, "sequence")
             try:
-                # 检测目录中的文件，如果文件名（或目录名）前缀匹配，则检查后缀是否全为数字序号。记录下最大的数字序号
-                for name in os.listdir(dirname):
-                    if name == ".data" or name == ".sequence":
-                        continue
-                    if len(name) < len(basename) or name[0:len(basename)] != basename:
-                        continue
-                    sn = name[len(basename):]
-                    if not re.match("[0-9]+$", sn):
-                        continue
-                    sn = string.atoi(sn)
-                    if sn > max_sn:
-                        max_sn = sn
-                # 生成新的临时节点名（比最大的数字序号还大1）
-                f.seek(0)
-                f.truncate()
-                f.write("%d" % (max_sn + 1))
-                file_path = ospath + ("%09d" % (max_sn + 1))
-                with open(file_path, 'w') as node:
-                    node.write(value)
+                content = os.read(fd, 32).strip()
+                try:
+                    last_sn = string.atoi(content) if content else self._scan_sequence(dirname, basename)
+                except ValueError:
+                    log.w("sequence file in {} is corrupt, recover by scanning".format(dirname))
+                    last_sn = self._scan_sequence(dirname, basename)
+                # 序列号文件落后于实际节点时（如被外部改写），跳过已存在的序号
+                sn = last_sn + 1
+                while not self._create_file_exclusive(ospath + ("%09d" % sn), value):
+                    sn += 1
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                os.write(fd, "%d" % sn)
+                if self._durability == self.DURABILITY_DURABLE:
+                    os.fsync(fd)
             finally:
-                fcntl.flock(f, fcntl.LOCK_UN)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
 
-        return ospath + ("%09d" % (max_sn + 1))
+        return ospath + ("%09d" % sn)
 
     def create_node(self, path, value="", ephemeral=False, sequence=False, makepath=False):
         """
@@ -817,27 +2284,24 @@ class FilePersistence(PlainPersistence):
                 dirname = os.path.dirname(ospath)
                 if not os.path.exists(dirname):
                     if makepath:
-                        os.makedirs(dirname, self._mode)
+                        self._make_dirs(dirname)
                     else:
                         raise exception.EPNoNodeError
                 file_path = ospath
                 if sequence:
                     file_path = self._seq_file_name(ospath, value)
                 else:
-                    with open(file_path, 'w') as f:
-                        f.write(value)
+                    self._write_file(file_path, value)
                 self._new_touch(file_path[len(self._base):])
             else:
                 # 实体节点，用目录来表示，数据存放在目录下的.data文件中
                 if not os.path.exists(ospath):
                     if not os.path.exists(os.path.dirname(ospath)) and not makepath:
                         raise exception.EPNoNodeError
-                    os.makedirs(ospath, self._mode)
+                    self._make_dirs(ospath)
 
                 file_path = "/".join((ospath, ".data"))
-
-                with open(file_path, 'w') as f:
-                    f.write(value)
+                self._write_file(file_path, value)
             node_path = file_path[len(self._base):]
         except exception.EPNoNodeError as e:
             log.r(e, "Node not exist:{}".format(os.path.dirname(path)))
@@ -850,7 +2314,7 @@ class FilePersistence(PlainPersistence):
                                                         makepath=makepath))
         return node_path
 
-    def exists(self, path):
+    def _exists(self, path):
         """
         查询制定path路径的节点是否存在
 
@@ -888,6 +2352,11 @@ class RedisPersistence(PlainPersistence):
     5. 创建节点需要同时修改父节点的Hash并创建新的key，所以通过lua脚本保证操作原子化
     """
 
+    PERSIST_POOL_SIZE_NAME = "PERSIST_POOL_SIZE"
+    PERSIST_POOL_TIMEOUT_NAME = "PERSIST_POOL_TIMEOUT"
+    TOUCH_BATCH_SIZE = 500
+    _guard = None
+
     def _initf(self):
         """
         初始化方法
@@ -922,7 +2391,12 @@ class RedisPersistence(PlainPersistence):
 
         redis_url = config.GuardianConfig.get(config.STATE_SERVICE_HOSTS_NAME)
         params = json.loads(config.GuardianConfig.get(cls.PERSIST_PARAMETERS_NAME, "{}"))
-        return RedisPersistence._run_catch(lambda: (redis.StrictRedis.from_url(redis_url, **params)))
+        # 有界连接池，连接耗尽时等待而不是无限新建连接
+        pool_size = string.atoi(config.GuardianConfig.get(cls.PERSIST_POOL_SIZE_NAME, "10"))
+        pool_timeout = string.atof(config.GuardianConfig.get(cls.PERSIST_POOL_TIMEOUT_NAME, "5"))
+        pool = redis.BlockingConnectionPool.from_url(redis_url, max_connections=pool_size,
+                                                     timeout=pool_timeout, **params)
+        return RedisPersistence._run_catch(lambda: (redis.StrictRedis(connection_pool=pool)))
 
     def _load_scripts(self):
         """
@@ -987,7 +2461,7 @@ class RedisPersistence(PlainPersistence):
         # 传入参数，KEYS[1]=父节点全路径，KEYS[2]=子节点名，ARGV[3]=到期时间。返回-1表示错误
         refresh_node_script = """
         local node_path = string.format('%s/%s', KEYS[1], KEYS[2])
-        if redis.call('hexist', KEYS[1], KEYS[2]) == 0 then
+        if redis.call('hexists', KEYS[1], KEYS[2]) == 0 then
             return -1
         end
         if redis.call('ttl', node_path) <0 then
@@ -1002,9 +2476,52 @@ class RedisPersistence(PlainPersistence):
             return -1
         end
         """
+
+        # 传入参数，KEYS=临时节点全路径列表，ARGV[1]=到期时间。返回已经不存在的节点路径列表
+        refresh_batch_script = """
+        local vanished = {}
+        for i, path in ipairs(KEYS) do
+            local parent, name = string.match(path, '^(.*)/([^/]+)$')
+            if parent == '' then
+                parent = '/'
+            end
+            local node_path = string.format('%s/%s', parent, name)
+            if redis.call('hexists', parent, name) == 0 or redis.call('ttl', node_path) < 0 then
+                table.insert(vanished, path)
+            elseif redis.call('expireat', node_path, ARGV[1]) == 1 then
+                redis.call('hset', parent, name, ARGV[1])
+            else
+                table.insert(vanished, path)
+            end
+        end
+        return vanished
+        """
         self._new_lua_sha = self._handle.script_load(new_node_script)
         self._delete_lua_sha = self._handle.script_load(delete_node_script)
         self._refresh_lua_sha = self._handle.script_load(refresh_node_script)
+        self._refresh_batch_lua_sha = self._handle.script_load(refresh_batch_script)
+
+        # 传入参数，KEYS[1]=fence节点路径，KEYS[2]=写入节点路径，ARGV[1]=token，ARGV[2]=数据。
+        # 返回1表示成功，-1表示token过期，-2表示fence节点数据无法解析
+        fenced_set_script = """
+        local record = redis.call('hget', KEYS[1], '.data')
+        if not record then
+            return -1
+        end
+        if string.byte(record, 1) == 0 then
+            return -2
+        end
+        local ok, fence = pcall(cjson.decode, record)
+        if not ok or type(fence) ~= 'table' then
+            return -1
+        end
+        if tostring(fence['token']) ~= ARGV[1] then
+            return -1
+        end
+        redis.call('hset', KEYS[2], '.data', ARGV[2])
+        return 1
+        """
+        self._fenced_set_lua_sha = self._handle.script_load(fenced_set_script)
 
     def _valid_chd(self, path, include_data=False):
         """
@@ -1061,12 +2578,8 @@ class RedisPersistence(PlainPersistence):
             md5.update(data)
             result["md5"] = md5.hexdigest()
 
-            # 获取所有子节点，去除两个内置文件
-            result["children"] = set(nodes.keys())
-            if ".data" in result["children"]:
-                result["children"].remove(".data")
-            if ".sequence" in result["children"]:
-                result["children"].remove(".sequence")
+            # 获取所有子节点，去除内置元素和隐藏节点
+            result["children"] = set([k for k in nodes.keys() if k[0:1] != "."])
         else:
             result["exist"] = False
             result["md5"] = None
@@ -1081,29 +2594,72 @@ class RedisPersistence(PlainPersistence):
 
         # 更新临时节点时间
         try:
-            ret = self._handle.evalsha(self._refresh_lua_sha, 2, path, node_name, now)
+            ret = self._handle.evalsha(self._refresh_lua_sha, 2, path, node_name, now + self._timeout)
             if ret == -1:
                 self._del_record_when_delnode(tp)
         except Exception as e:
             self._del_record_when_delnode(tp)
 
+    def _touch_batch(self, paths, now):
+        """
+        批量更新临时节点的时间，每批节点只需一次请求
+
+        :param list(str) paths: 临时节点路径列表
+        :param long now: 当前时间
+        :return: 已经不存在的临时节点路径列表
+        :rtype: list(str)
+        """
+        vanished = []
+        expire = now + long(self._timeout)
+        for i in range(0, len(paths), self.TOUCH_BATCH_SIZE):
+            batch = paths[i:i + self.TOUCH_BATCH_SIZE]
+            vanished.extend(self._run_catch(lambda: (self._handle.evalsha(
+                self._refresh_batch_lua_sha, len(batch), *(batch + [expire])))))
+        return vanished
+
+    @classmethod
+    def _connection_guard(cls):
+        """
+        获取连接保护对象
+
+        :return: 连接保护对象
+        :rtype: ConnectionGuard
+        """
+        if cls._guard is None:
+            cls._guard = ConnectionGuard("redis")
+        return cls._guard
+
     @classmethod
-    def _run_catch(cls, func, path="", path_is_dir=False):
+    def _run_catch(cls, func, path="", path_is_dir=False, retry=True):
         """
-        执行func并捕获异常，将kazoo异常转换为对应的异常对象
+        执行func并捕获异常，将redis异常转换为对应的异常对象。连接类异常会在连接保护下退避重试
         """
         import redis
+
+        def _retriable(e):
+            return isinstance(e, (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError))
+
         # noinspection PyBroadException
         try:
-            return func()
-        except redis.exceptions.ConnectionError:
-            raise exception.EPConnectTimeout()
+            return cls._connection_guard().call(func, _retriable, retry)
+        except (exception.EPConnectTimeout, exception.EPStaleToken):
+            raise
         except exception.EPNoNodeError as e:
             raise e
         except Exception as e:
             log.r(exception.EPIOError(), "Request I/O Error")
 
-    def get_data(self, path):
+    def _is_ephemeral(self, path):
+        """
+        判断节点是否为临时节点，临时节点的key设置了过期时间
+
+        :param str path: 节点路径
+        :return: True表示临时节点
+        :rtype: bool
+        """
+        return self._run_catch(lambda: self._handle.ttl(path)) >= 0
+
+    def _get_data(self, path):
         """
         获得指定路径path的节点数据
 
@@ -1124,7 +2680,7 @@ class RedisPersistence(PlainPersistence):
 
         return self._run_catch(_readdata)
 
-    def save_data(self, path, data):
+    def _save_data(self, path, data):
         """
         存储数据data到特定的path路径节点
 
@@ -1144,6 +2700,20 @@ class RedisPersistence(PlainPersistence):
         self._run_catch(_writedata)
         log.d("save data success, path:{path}".format(path=path))
 
+    def _save_fenced(self, path, data, fence=None):
+        """
+        校验token后写入数据。通过lua脚本保证校验与写入的原子性
+        """
+        fence = fence or self._fence
+        fence_path, token, _ = fence
+        ret = self._run_catch(lambda: (self._handle.evalsha(
+            self._fenced_set_lua_sha, 2, fence_path, path, str(token), data)))
+        if ret == -2:
+            # fence节点数据经过编码，lua脚本无法解析，退化为先读后写
+            super(RedisPersistence, self)._save_fenced(path, data, fence)
+        elif ret != 1:
+            raise exception.EPStaleToken("fencing token {} is stale".format(token))
+
     def _del_node(self, np, force):
         """
         删除node节点即所有子节点
@@ -1152,7 +2722,8 @@ class RedisPersistence(PlainPersistence):
         """
         def _deletenode(path=np):
             # 由于redis不支持事务，所以此处并不会区分节点是否存在，均直接set数据
-            children = self.get_children(path)
+            # 隐藏的子节点（如数据分块）也需要删除
+            children = [k for k in self._handle.hkeys(path) if k not in (".data", ".sequence")]
             for child_node in children:
                 _deletenode("/".join([path, child_node]))
 
@@ -1198,7 +2769,8 @@ class RedisPersistence(PlainPersistence):
                 self._new_touch(ret)
             return ret
 
-        ret = self._run_catch(_createnode)
+        # 顺序节点的创建不是幂等的，不能重试
+        ret = self._run_catch(_createnode, retry=not sequence)
         log.d("create node success, path:{path}, value:{value}, ephemeral:"
               "{ephemeral}, sequence:{sequence}, makepath:{makepath}".format(
                                                         path=ret, value=value,
@@ -1206,7 +2778,7 @@ class RedisPersistence(PlainPersistence):
                                                         makepath=makepath))
         return ret
 
-    def exists(self, path):
+    def _exists(self, path):
         """
         查询制定path路径的节点是否存在
 
@@ -1235,7 +2807,7 @@ class RedisPersistence(PlainPersistence):
         :return: 无返回
         :rtype: None
         """
-        log.i("nothing to do in RedisPersistence.add_listener()")
+        self._connection_guard().add_listener(watcher)
 
     def disconnect(self):
         """
@@ -1246,3 +2818,926 @@ class RedisPersistence(PlainPersistence):
         """
         super(RedisPersistence, self).disconnect()
         self._handle.close()
+
+
+class MemoryNode(object):
+    """
+    内存持久化中的节点
+    """
+
+    def __init__(self, data="", owner=None):
+        """
+        初始化方法
+
+        :param str data: 节点数据
+        :param int owner: 临时节点所属的会话id，实体节点为None
+        """
+        self.data = data
+        self.owner = owner
+        self.children = set()
+        self.sequence = 0
+        self.version = 0
+
+
+class MemoryStore(object):
+    """
+    内存持久化的共享存储。同一进程内的多个 ``MemoryPersistence`` 会话共享一个存储，
+    以便在进程内模拟多实例（如主从选举）的场景。
+
+    .. Note:: watcher及会话状态回调在独立的分发线程中执行，回调中可以再次访问存储
+    """
+
+    def __init__(self):
+        """
+        初始化方法
+        """
+        import Queue
+        self.lock = threading.RLock()
+        self.nodes = {"/": MemoryNode()}
+        self.data_watches = {}
+        self.child_watches = {}
+        self.sessions = {}
+        self._session_id = 0
+        self._events = Queue.Queue()
+        self._dispatch_thread = threading.Thread(target=self._dispatch_run)
+        self._dispatch_thread.setDaemon(True)
+        self._dispatch_thread.start()
+        self._session_thread = threading.Thread(target=self._session_run)
+        self._session_thread.setDaemon(True)
+        self._session_thread.start()
+
+    def new_session_id(self):
+        """
+        分配新的会话id
+
+        :return: 会话id
+        :rtype: int
+        """
+        with self.lock:
+            self._session_id += 1
+            return self._session_id
+
+    def notify(self, callback, arg):
+        """
+        将回调放入分发线程执行
+
+        :param callback: 回调函数
+        :param arg: 回调参数
+        :return: 无返回
+        :rtype: None
+        """
+        self._events.put((callback, arg))
+
+    def trigger(self, watches, path, event_type):
+        """
+        触发path上注册的一次性watcher
+
+        :param dict watches: data_watches或child_watches
+        :param str path: 发生变化的路径
+        :param str event_type: 事件类型
+        :return: 无返回
+        :rtype: None
+        """
+        for watcher in watches.pop(path, []):
+            self.notify(watcher, PersistenceEvent(type=event_type,
+                                                  state=PersistenceEvent.PersistState.CONNECTED,
+                                                  path=path))
+
+    def _dispatch_run(self):
+        """
+        执行watcher及会话状态回调
+        """
+        while True:
+            callback, arg = self._events.get()
+            try:
+                callback(arg)
+            except Exception as e:
+                log.f("memory persistence callback fail")
+
+    def _session_run(self):
+        """
+        维持会话心跳，并清理超时会话
+        """
+        while True:
+            now = time.time()
+            with self.lock:
+                sessions = self.sessions.values()
+            for session in sessions:
+                session.check_session(now)
+            time.sleep(0.05)
+
+
+class MemoryPersistence(BasePersistence):
+    """
+    通过进程内存实现的持久化类，不依赖任何外部服务，主要用于测试、压测及故障注入：
+
+    * 节点语义与Zookeeper一致：临时节点随会话超时或断开被删除，顺序节点在父节点内单调递增编号
+    * watcher为一次性触发，支持子节点变化（CHILD）及节点本身的变化（CREATED|DELETED|CHANGED）
+    * 可通过 ``PERSIST_PARAMETERS`` 注入每次请求的延迟及抖动，如{"latency": 0.001, "jitter": 0.0005}
+    * 可通过 ``suspend_session`` 、 ``resume_session`` 、 ``expire_session`` 模拟会话挂起和超时
+
+    .. Note:: 以"."开头的子节点为内部节点，不作为子节点列出
+    """
+    _init = False
+    _store = None
+    _store_lock = threading.Lock()
+
+    def __init__(self):
+        """
+        初始化方法
+        """
+        if self._init:
+            return
+        self._connect()
+
+    @classmethod
+    def new_session(cls):
+        """
+        创建一个与单例共享存储、但会话独立的实例，用于在进程内模拟多个Guardian实例
+
+        :return: 持久化实例
+        :rtype: MemoryPersistence
+        """
+        session = object.__new__(cls)
+        session._connect()
+        return session
+
+    @classmethod
+    def reset_store(cls):
+        """
+        清空共享存储，已有会话的临时节点及watcher一并失效
+
+        :return: 无返回
+        :rtype: None
+        """
+        store = cls._store
+        if store is None:
+            return
+        with store.lock:
+            store.nodes = {"/": MemoryNode()}
+            store.data_watches = {}
+            store.child_watches = {}
+
+    def _connect(self):
+        """
+        建立会话
+        """
+        with MemoryPersistence._store_lock:
+            if MemoryPersistence._store is None:
+                MemoryPersistence._store = MemoryStore()
+        params = json.loads(config.GuardianConfig.get(self.PERSIST_PARAMETERS_NAME, "{}"))
+        self._latency = float(params.get("latency", 0))
+        self._jitter = float(params.get("jitter", 0))
+        self._timeout = string.atof(config.GuardianConfig.get(self.PERSIST_TIMEOUT_NAME, "3"))
+        self._listeners = []
+        self._suspended = False
+        self._deadline = time.time() + self._timeout
+        self._session_id = self._store.new_session_id()
+        with self._store.lock:
+            self._store.sessions[self._session_id] = self
+        self._init = True
+
+    def _delay(self):
+        """
+        注入请求延迟
+        """
+        if self._latency <= 0 and self._jitter <= 0:
+            return
+        import random
+        delay = self._latency + random.uniform(-self._jitter, self._jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _node(self, path):
+        """
+        获取节点，节点不存在时抛出异常。调用方需持有存储锁
+        """
+        node = self._store.nodes.get(path)
+        if node is None:
+            raise exception.EPNoNodeError("Node not exist:{}".format(path))
+        return node
+
+    @classmethod
+    def _split_node_name(cls, node_path):
+        """
+        将节点路径分解为父路径和节点名
+
+        :return: 节点的父路径和节点名
+        :rtype: (path, name)
+        """
+        result = node_path.rsplit("/", 1)
+        if result[0] == "":
+            result[0] = "/"
+        return result[0], result[1]
+
+    def _is_ephemeral(self, path):
+        """
+        判断节点是否为临时节点
+
+        :param str path: 节点路径
+        :return: True表示临时节点
+        :rtype: bool
+        """
+        with self._store.lock:
+            if path not in self._store.nodes:
+                raise exception.EPNoNodeError("Node not exist:{}".format(path))
+            return self._store.nodes[path].owner is not None
+
+    def _get_data(self, path):
+        """
+        获得指定路径path的节点数据
+
+        :param str path: 数据存储路径
+        :return: 节点数据
+        :rtype: str
+        :raises: exception.EPNoNodeError 节点不存在
+        """
+        self._delay()
+        with self._store.lock:
+            return self._node(path).data
+
+    def _save_data(self, path, data):
+        """
+        存储数据data到特定的path路径节点
+
+        :param str path: 数据存储路径
+        :param str data: 待存储的数据
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPNoNodeError 节点不存在
+        """
+        self._delay()
+        store = self._store
+        with store.lock:
+            node = self._node(path)
+            node.data = data
+            node.version += 1
+            store.trigger(store.data_watches, path, PersistenceEvent.EventType.CHANGED)
+        log.d("save data success, path:{path}".format(path=path))
+
+    def _save_fenced(self, path, data, fence=None):
+        """
+        校验token后写入数据，校验与写入在存储锁内完成
+        """
+        with self._store.lock:
+            super(MemoryPersistence, self)._save_fenced(path, data, fence)
+
+    def delete_node(self, path, force=False):
+        """
+        删除node节点及其所有子节点
+
+        :param str path: 数据存储路径
+        :param bool force: 是否强行删除而不判断节点有效性
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPNoNodeError 节点不存在
+        """
+        self._delay()
+        store = self._store
+        with store.lock:
+            if path not in store.nodes:
+                if force:
+                    return
+                raise exception.EPNoNodeError("Node not exist:{}".format(path))
+            self._remove(path)
+        log.d("delete node success, path:{path}".format(path=path))
+
+    def _remove(self, path):
+        """
+        递归删除节点并触发watcher。调用方需持有存储锁
+        """
+        store = self._store
+        node = store.nodes.pop(path)
+        for name in list(node.children):
+            self._remove("/".join([path.rstrip("/"), name]))
+        parent_path, name = self._split_node_name(path)
+        parent = store.nodes.get(parent_path)
+        if parent is not None:
+            parent.children.discard(name)
+            store.trigger(store.child_watches, parent_path, PersistenceEvent.EventType.CHILD)
+        store.trigger(store.data_watches, path, PersistenceEvent.EventType.DELETED)
+        store.trigger(store.child_watches, path, PersistenceEvent.EventType.DELETED)
+
+    def get_children(self, path, watcher=None, include_data=False):
+        """
+        获取所有子节点
+        :param str path: 待获取子节点的路径
+        :param watcher: 状态监听函数。函数形参为(event)，event是一个对象，包括三个成员属性：path（发生状态变化的路径）、state（server链接状态）、type（事件类型，包括CREATED|DELETED|CHANGED|CHILD|NONE）
+        :param bool include_data: 是否同时返回数据
+        :return: 子节点名字列表
+        :rtype: str
+        :raises: exception.EPNoNodeError 节点不存在
+        """
+        self._delay()
+        store = self._store
+        with store.lock:
+            node = self._node(path)
+            names = [name for name in node.children if name[0:1] != "."]
+            if watcher:
+                if not callable(watcher):
+                    raise exception.ETypeMismatch("watcher must callable")
+                store.child_watches.setdefault(path, []).append(watcher)
+            if not include_data:
+                return names
+            prefix = path.rstrip("/")
+            return [(name, store.nodes["/".join([prefix, name])].data) for name in names]
+
+    def create_node(self, path, value="", ephemeral=False, sequence=False, makepath=False):
+        """
+        根据节点各属性创建节点
+
+        :param str path: 节点路径
+        :param str value: 待存数据
+        :param bool ephemeral: 是否是临时节点
+        :param bool sequence: 是否是顺序节点
+        :param bool makepath: 是否创建父节点
+        :return: 新创建的节点路径
+        :rtype: str
+        :raises: exception.EPNoNodeError 父节点不存在
+        :raises: exception.EPIOError 节点已存在或父节点为临时节点
+        """
+        self._delay()
+        store = self._store
+        with store.lock:
+            parent_path, name = self._split_node_name(path)
+            if parent_path not in store.nodes:
+                if not makepath:
+                    raise exception.EPNoNodeError("Node not exist:{}".format(parent_path))
+                self._make_parents(parent_path)
+            parent = store.nodes[parent_path]
+            if parent.owner is not None:
+                raise exception.EPIOError("ephemeral node can not have children:{}".format(parent_path))
+            if sequence:
+                name = "%s%010d" % (name, parent.sequence)
+                parent.sequence += 1
+            node_path = "/".join([parent_path.rstrip("/"), name])
+            if node_path in store.nodes:
+                raise exception.EPIOError("Node exists:{}".format(node_path))
+            store.nodes[node_path] = MemoryNode(value, self._session_id if ephemeral else None)
+            parent.children.add(name)
+            store.trigger(store.data_watches, node_path, PersistenceEvent.EventType.CREATED)
+            store.trigger(store.child_watches, parent_path, PersistenceEvent.EventType.CHILD)
+        log.d("create node success, path:{path}, value:{value}, ephemeral:"
+              "{ephemeral}, sequence:{sequence}, makepath:{makepath}".format(
+                                                        path=node_path, value=value,
+                                                        ephemeral=ephemeral, sequence=sequence,
+                                                        makepath=makepath))
+        return node_path
+
+    def _make_parents(self, path):
+        """
+        逐级创建实体父节点。调用方需持有存储锁
+        """
+        store = self._store
+        if path in store.nodes:
+            return
+        parent_path, name = self._split_node_name(path)
+        self._make_parents(parent_path)
+        store.nodes[path] = MemoryNode()
+        store.nodes[parent_path].children.add(name)
+        store.trigger(store.child_watches, parent_path, PersistenceEvent.EventType.CHILD)
+
+    def exists(self, path, watcher=None):
+        """
+        查询制定path路径的节点是否存在
+
+        :param str path: 节点路径
+        :param func watcher: 节点创建、删除或数据变化时的回调函数，为None时不注册
+        :return: True或False
+        :rtype: bool
+        """
+        self._delay()
+        with self._store.lock:
+            if watcher:
+                if not callable(watcher):
+                    raise exception.ETypeMismatch("watcher must callable")
+                self._store.data_watches.setdefault(path, []).append(watcher)
+            return path in self._store.nodes
+
+    def add_listener(self, watcher):
+        """
+        监听会话状态
+
+        :param watcher: 状态监听函数。函数形参为(state)，可能的取值包括"SUSPENDED"、"CONNECTED"、"LOST"
+        :return: 无返回
+        :rtype: None
+        """
+        self._listeners.append(watcher)
+        log.d("add listener success")
+
+    def disconnect(self):
+        """
+        主动断开持久化请求，当前会话的临时节点会被立即删除
+
+        :return: 无返回
+        :rtype: None
+        """
+        store = self._store
+        with store.lock:
+            store.sessions.pop(self._session_id, None)
+            self._clear_ephemeral()
+        self._init = False
+        log.d("disconnect success")
+
+    def suspend_session(self):
+        """
+        模拟会话挂起：停止心跳，超过 ``PERSIST_TIMEOUT`` 仍未恢复则会话超时
+
+        :return: 无返回
+        :rtype: None
+        """
+        self._suspended = True
+        self._notify_state(PersistenceEvent.PersistState.SUSPENDED)
+
+    def resume_session(self):
+        """
+        模拟会话在超时前恢复
+
+        :return: 无返回
+        :rtype: None
+        """
+        self._suspended = False
+        self._deadline = time.time() + self._timeout
+        self._notify_state(PersistenceEvent.PersistState.CONNECTED)
+
+    def expire_session(self):
+        """
+        模拟会话超时：删除当前会话的所有临时节点，并以新的会话重新连接
+
+        :return: 无返回
+        :rtype: None
+        """
+        store = self._store
+        with store.lock:
+            store.sessions.pop(self._session_id, None)
+            self._clear_ephemeral()
+            self._session_id = store.new_session_id()
+            self._suspended = False
+            self._deadline = time.time() + self._timeout
+            store.sessions[self._session_id] = self
+        log.i("memory persistence session expired")
+        self._notify_state(PersistenceEvent.PersistState.LOST)
+        self._notify_state(PersistenceEvent.PersistState.CONNECTED)
+
+    def check_session(self, now):
+        """
+        由存储的会话线程定期调用，维持心跳或使超时的会话失效
+
+        :param float now: 当前时间
+        :return: 无返回
+        :rtype: None
+        """
+        if not self._suspended:
+            self._deadline = now + self._timeout
+        elif now > self._deadline:
+            self.expire_session()
+
+    def _clear_ephemeral(self):
+        """
+        删除当前会话的所有临时节点。调用方需持有存储锁
+        """
+        store = self._store
+        paths = [path for path, node in store.nodes.iteritems() if node.owner == self._session_id]
+        for path in paths:
+            if path in store.nodes:
+                self._remove(path)
+
+    def _notify_state(self, state):
+        """
+        通知会话状态变化
+        """
+        for listener in self._listeners:
+            self._store.notify(listener, state)
+
+
+class SqlitePersistence(PlainPersistence):
+    """
+    通过SQLite（WAL模式）实现的持久化类，适用于同一主机上的单实例及备实例部署，
+    ``STATE_SERVICE_HOSTS`` 为数据库文件路径：
+
+    * 所有节点存放在nodes表中，以节点路径为主键，并对父路径建立索引用于列出子节点
+    * 临时节点关联到leases表中当前实例的租约，实例定期续约，租约超时后其临时节点随之失效并被清理
+    * meta表中维护全局版本号，任何写操作都会递增版本号，并记录到节点的数据版本（mver）或子节点版本（cver）中。
+      watcher轮询时先比对全局版本号，未变化时直接复用上次的结果
+    * 可通过 ``transaction`` 将多个操作合并为一个事务批量提交
+
+    .. Note:: ``PERSIST_DURABILITY`` 对应SQLite的synchronous配置：none为OFF，atomic为NORMAL，durable为FULL
+    """
+    _synchronous = {BasePersistence.DURABILITY_NONE: "OFF",
+                    BasePersistence.DURABILITY_ATOMIC: "NORMAL",
+                    BasePersistence.DURABILITY_DURABLE: "FULL"}
+
+    def _initf(self):
+        """
+        用于子类初始化
+        """
+        import uuid
+        self._db = config.GuardianConfig.get(config.STATE_SERVICE_HOSTS_NAME)
+        durability = config.GuardianConfig.get(self.PERSIST_DURABILITY_NAME, self.DURABILITY_ATOMIC)
+        if durability not in self._synchronous:
+            raise exception.ETypeMismatch("unknown durability mode:{}".format(durability))
+        self._sync_mode = self._synchronous[durability]
+        self._local = threading.local()
+        self._lease_id = uuid.uuid4().hex
+        self._lease_renewed = 0
+        self._versions = {}
+        self._run_catch(self._init_db)
+
+    def _init_db(self):
+        """
+        创建数据表
+        """
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        with self.transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS nodes ("
+                         "path TEXT PRIMARY KEY, parent TEXT NOT NULL, name TEXT NOT NULL, "
+                         "data BLOB, lease TEXT, seq INTEGER NOT NULL DEFAULT 0, "
+                         "mver INTEGER NOT NULL DEFAULT 0, cver INTEGER NOT NULL DEFAULT 0)")
+            conn.execute("CREATE INDEX IF NOT EXISTS nodes_parent ON nodes(parent)")
+            conn.execute("CREATE INDEX IF NOT EXISTS nodes_lease ON nodes(lease)")
+            conn.execute("CREATE TABLE IF NOT EXISTS leases (id TEXT PRIMARY KEY, expire REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO meta VALUES ('version', 0)")
+            conn.execute("INSERT OR IGNORE INTO nodes(path, parent, name, data) VALUES ('/', '', '', '')")
+
+    def _conn(self):
+        """
+        获取当前线程的数据库连接（sqlite连接不能跨线程使用）
+
+        :return: 数据库连接
+        :rtype: sqlite3.Connection
+        """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self._db, timeout=self._busy_timeout(), isolation_level=None)
+            conn.text_factory = str
+            conn.execute("PRAGMA synchronous=%s" % self._sync_mode)
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    def _busy_timeout(self):
+        """
+        数据库被其他实例锁定时的最长等待时间
+        """
+        return string.atof(config.GuardianConfig.get(self.PERSIST_TIMEOUT_NAME, "3"))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        事务上下文，上下文内的所有操作在一个事务中提交，异常时整体回滚。支持嵌套，嵌套时以最外层事务为准::
+
+            with driver.transaction():
+                driver.save_data(path1, data1)
+                driver.save_data(path2, data2)
+
+        :return: 数据库连接
+        :rtype: sqlite3.Connection
+        """
+        conn = self._conn()
+        if self._local.depth > 0:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth = 0
+            conn.execute("ROLLBACK")
+            raise
+        self._local.depth = 0
+        conn.execute("COMMIT")
+
+    @classmethod
+    def _split_node_name(cls, node_path):
+        """
+        将节点路径分解为父路径和节点名
+
+        :return: 节点的父路径和节点名
+        :rtype: (path, name)
+        """
+        result = node_path.rsplit("/", 1)
+        if result[0] == "":
+            result[0] = "/"
+        return result[0], result[1]
+
+    @classmethod
+    def _bump(cls, conn):
+        """
+        递增并返回全局版本号，需在事务内调用
+        """
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        return conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def _valid_row(self, conn, path, columns="path"):
+        """
+        获取有效的节点记录（实体节点，或租约未过期的临时节点）
+        """
+        return conn.execute(
+            "SELECT %s FROM nodes WHERE path = ? AND (lease IS NULL OR lease IN "
+            "(SELECT id FROM leases WHERE expire >= ?))" % columns, (path, time.time())).fetchone()
+
+    def _purge(self):
+        """
+        清理租约已过期的临时节点
+        """
+        conn = self._conn()
+        now = time.time()
+        if conn.execute("SELECT 1 FROM leases WHERE expire < ? LIMIT 1", (now,)).fetchone() is None:
+            return
+        with self.transaction() as conn:
+            expired = [row[0] for row in conn.execute("SELECT id FROM leases WHERE expire < ?", (now,))]
+            version = self._bump(conn)
+            for lease in expired:
+                conn.execute("UPDATE nodes SET cver = ? WHERE path IN "
+                             "(SELECT parent FROM nodes WHERE lease = ?)", (version, lease))
+                conn.execute("DELETE FROM nodes WHERE lease = ?", (lease,))
+                conn.execute("DELETE FROM leases WHERE id = ?", (lease,))
+        log.d("purge expired leases:{}".format(expired))
+
+    def _run_catch(self, func, path="", path_is_dir=False):
+        """
+        执行func并捕获异常，将sqlite异常转换为对应的异常对象
+        """
+        try:
+            return func()
+        except exception.EPNoNodeError as e:
+            raise e
+        except exception.EPIOError as e:
+            raise e
+        except Exception as e:
+            log.r(exception.EPIOError(), "Request I/O Error")
+
+    def _is_ephemeral(self, path):
+        """
+        判断节点是否为临时节点，临时节点带有租约
+
+        :param str path: 节点路径
+        :return: True表示临时节点
+        :rtype: bool
+        """
+        row = self._run_catch(lambda: self._valid_row(self._conn(), path, "lease"))
+        if row is None:
+            raise exception.EPNoNodeError("Node not exist:{}".format(path))
+        return row[0] is not None
+
+    def _get_data(self, path):
+        """
+        获得指定路径path的节点数据
+
+        :param str path: 数据存储路径
+        :return: 节点数据
+        :rtype: str
+        :raises: exception.EPNoNodeError 节点不存在
+        :raises: exception.EPIOError IO异常
+        """
+        def _readdata():
+            row = self._valid_row(self._conn(), path, "data")
+            if row is None:
+                raise exception.EPNoNodeError("Node not exist:{}".format(path))
+            return str(row[0]) if row[0] is not None else ""
+
+        return self._run_catch(_readdata)
+
+    def _save_data(self, path, data):
+        """
+        存储数据data到特定的path路径节点
+
+        :param str path: 数据存储路径
+        :param str data: 待存储的数据
+        :return: 无返回
+        :rtype: None
+        :raises: exception.EPNoNodeError 节点不存在
+        :raises: exception.EPIOError IO异常
+        """
+        import sqlite3
+
+        def _writedata():
+            with self.transaction() as conn:
+                if self._valid_row(conn, path) is None:
+                    raise exception.EPNoNodeError("Node not exist:{}".format(path))
+                conn.execute("UPDATE nodes SET data = ?, mver = ? WHERE path = ?",
+                             (sqlite3.Binary(data), self._bump(conn), path))
+
+        self._run_catch(_writedata)
+        log.d("save data success, path:{path}".format(path=path))
+
+    def _save_fenced(self, path, data, fence=None):
+        """
+        校验token后写入数据，校验与写入在同一个事务中完成
+        """
+        with self.transaction():
+            super(SqlitePersistence, self)._save_fenced(path, data, fence)
+
+    def _del_node(self, path, force):
+        """
+        删除node节点及所有子节点
+        """
+        def _deletenode():
+            with self.transaction() as conn:
+                if not force and self._valid_row(conn, path) is None:
+                    raise exception.EPNoNodeError("Node not exist:{}".format(path))
+                version = self._bump(conn)
+                parent, _ = self._split_node_name(path)
+                conn.execute("UPDATE nodes SET cver = ? WHERE path = ?", (version, parent))
+                # 子孙节点的路径均以"path/"为前缀，"0"是"/"之后的下一个字符
+                conn.execute("DELETE FROM nodes WHERE path = ? OR (path >= ? AND path < ?)",
+                             (path, path + "/", path + "0"))
+
+        if force:
+            _deletenode()
+        else:
+            self._run_catch(_deletenode)
+
+    def _valid_chd(self, path, include_data=False):
+        """
+        获取所有有效的子节点。默认不获取子节点数据
+        """
+        def _valid():
+            conn = self._conn()
+            if self._valid_row(conn, path) is None:
+                raise exception.EPNoNodeError("Node not exist:{}".format(path))
+            rows = conn.execute(
+                "SELECT name, data FROM nodes WHERE parent = ? AND (lease IS NULL OR lease IN "
+                "(SELECT id FROM leases WHERE expire >= ?))", (path, time.time()))
+            result = {}
+            for name, data in rows:
+                if name[0:1] == ".":
+                    continue
+                if include_data:
+                    result[name] = str(data) if data is not None else ""
+                else:
+                    result[name] = ""
+            return result
+
+        return self._run_catch(_valid)
+
+    def _refresh(self, obpath):
+        """
+        刷新节点属性。全局版本号未变化时直接返回上次的结果
+        """
+        self._purge()
+        conn = self._conn()
+        version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        cached = self._versions.get(obpath)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        row = self._valid_row(conn, obpath, "mver, cver")
+        if row is None:
+            result = {"exist": False, "md5": None, "children": {}}
+        else:
+            result = {"exist": True, "md5": row[0], "children": self._valid_chd(obpath)}
+        self._versions[obpath] = (version, result)
+        return result
+
+    def _ignore(self, obpath):
+        """
+        清理需要监视的路径
+        """
+        self._versions.pop(obpath, None)
+        super(SqlitePersistence, self)._ignore(obpath)
+
+    def _touch(self, tp, now):
+        """
+        续约当前实例的租约。同一轮中的多个临时节点共享一个租约，只需续约一次
+        """
+        if self._touch_batch([tp], now):
+            self._del_record_when_delnode(tp)
+
+    def _touch_batch(self, paths, now):
+        """
+        续约当前实例的租约，所有临时节点共享一个租约，一次更新即可
+
+        :param list(str) paths: 临时节点路径列表
+        :param long now: 当前时间
+        :return: 已经不存在的临时节点路径列表
+        :rtype: list(str)
+        """
+        if self._lease_renewed == now:
+            return []
+        with self.transaction() as conn:
+            ret = conn.execute("UPDATE leases SET expire = ? WHERE id = ?",
+                               (now + self._timeout, self._lease_id)).rowcount
+        if ret == 0:
+            # 租约已超时并被清理，相应的临时节点也已不存在
+            return list(paths)
+        self._lease_renewed = now
+        return []
+
+    def create_node(self, path, value="", ephemeral=False, sequence=False, makepath=False):
+        """
+        根据节点各属性创建节点
+
+        :param str path: 节点路径
+        :param str value: 待存数据
+        :param bool ephemeral: 是否是临时节点
+        :param bool sequence: 是否是顺序节点
+        :param bool makepath: 是否创建父节点
+        :return: 新创建的节点路径
+        :rtype: str
+        :raises: exception.EPNoNodeError 节点不存在
+        :raises: exception.EPIOError IO异常
+        """
+        import sqlite3
+
+        def _createnode():
+            node_path, node_name = self._split_node_name(path)
+            with self.transaction() as conn:
+                version = self._bump(conn)
+                parent_row = self._valid_row(conn, node_path, "lease")
+                if parent_row is None:
+                    if not makepath:
+                        raise exception.EPNoNodeError(node_path + " not exists")
+                    self._make_parents(conn, node_path, version)
+                elif parent_row[0] is not None:
+                    raise exception.EPIOError("ephemeral node can not have children:{}".format(node_path))
+                if sequence:
+                    conn.execute("UPDATE nodes SET seq = seq + 1 WHERE path = ?", (node_path,))
+                    seq = conn.execute("SELECT seq FROM nodes WHERE path = ?", (node_path,)).fetchone()[0]
+                    node_name = "%s%010d" % (node_name, seq - 1)
+                new_path = "/".join([node_path.rstrip("/"), node_name])
+                lease = None
+                if ephemeral:
+                    lease = self._lease_id
+                    conn.execute("INSERT OR REPLACE INTO leases VALUES (?, ?)",
+                                 (lease, time.time() + self._timeout))
+                # 清理同路径下已失效的临时节点
+                conn.execute("DELETE FROM nodes WHERE path = ? AND lease IS NOT NULL AND lease NOT IN "
+                             "(SELECT id FROM leases WHERE expire >= ?)", (new_path, time.time()))
+                try:
+                    conn.execute("INSERT INTO nodes(path, parent, name, data, lease, mver) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)",
+                                 (new_path, node_path, node_name, sqlite3.Binary(value), lease, version))
+                except sqlite3.IntegrityError:
+                    raise exception.EPIOError("Node exists:{}".format(new_path))
+                conn.execute("UPDATE nodes SET cver = ? WHERE path = ?", (version, node_path))
+            if ephemeral:
+                self._new_touch(new_path)
+            return new_path
+
+        ret = self._run_catch(_createnode)
+        log.d("create node success, path:{path}, value:{value}, ephemeral:"
+              "{ephemeral}, sequence:{sequence}, makepath:{makepath}".format(
+                                                        path=ret, value=value,
+                                                        ephemeral=ephemeral, sequence=sequence,
+                                                        makepath=makepath))
+        return ret
+
+    def _make_parents(self, conn, path, version):
+        """
+        逐级创建实体父节点，需在事务内调用
+        """
+        if path == "/" or conn.execute("SELECT 1 FROM nodes WHERE path = ?", (path,)).fetchone():
+            return
+        parent, name = self._split_node_name(path)
+        self._make_parents(conn, parent, version)
+        conn.execute("INSERT INTO nodes(path, parent, name, data, mver) VALUES (?, ?, ?, '', ?)",
+                     (path, parent, name, version))
+        conn.execute("UPDATE nodes SET cver = ? WHERE path = ?", (version, parent))
+
+    def _exists(self, path):
+        """
+        查询制定path路径的节点是否存在
+
+        :param str path: 节点路径
+        :return: True或False
+        :rtype: bool
+        """
+        return self._run_catch(lambda: (self._valid_row(self._conn(), path) is not None))
+
+    def add_listener(self, watcher):
+        """
+        监听会话状态
+
+        :param watcher: 状态监听函数。函数形参为(state)，可能的取值包括"SUSPENDED"、"CONNECTED"、"LOST"
+        :return: 无返回
+        :rtype: None
+        """
+        log.i("nothing to do in SqlitePersistence.add_listener()")
+
+    def disconnect(self):
+        """
+        主动断开持久化请求，并立即删除当前实例的临时节点
+
+        :return: 无返回
+        :rtype: None
+        """
+        super(SqlitePersistence, self).disconnect()
+        try:
+            with self.transaction() as conn:
+                version = self._bump(conn)
+                conn.execute("UPDATE nodes SET cver = ? WHERE path IN "
+                             "(SELECT parent FROM nodes WHERE lease = ?)", (version, self._lease_id))
+                conn.execute("DELETE FROM nodes WHERE lease = ?", (self._lease_id,))
+                conn.execute("DELETE FROM leases WHERE id = ?", (self._lease_id,))
+        except Exception as e:
+            log.f("release lease fail")
+        self._conn().close()
+        self._local.conn = None
@@ -0,0 +1,471 @@
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2018 Baidu.com, Inc. All Rights Reserved
+#
+################################################################################
+"""
+**pool** 执行器使用的弹性进程池：
+
+* ``ElasticPool`` 进程数在最小、最大进程数之间按积压任务数及排队时间自动伸缩
+
+伸缩策略通过以下配置项调整：
+
+* ``POOL_SCALE_INTERVAL`` 检查间隔，默认1秒
+* ``POOL_SCALE_UP_WAIT`` 最早提交的待执行任务排队超过该时间时扩容，默认1秒
+* ``POOL_SCALE_DOWN_IDLE`` 进程空闲超过该时间时缩容，默认30秒
+* ``POOL_SCALE_COOLDOWN`` 两次伸缩之间的最小间隔，默认5秒
+
+工作进程的回收策略通过以下配置项调整：
+
+* ``POOL_MAX_TASKS`` 每个工作进程最多执行的任务数，默认0，即不限制
+* ``POOL_MAX_RSS`` 每个工作进程的最大常驻内存，单位MB，每个任务执行完成后检查，默认0，即不限制
+"""
+import Queue
+import itertools
+import multiprocessing
+import os
+import resource
+import signal
+import string
+import sys
+import threading
+import time
+
+import ark.are.config as config
+import ark.are.log as log
+from ark.are.metrics import Metrics
+
+
+# 工作进程达到回收条件后退出的返回码
+RECYCLE_EXIT_CODE = 3
+
+
+def _current_rss():
+    """
+    获取当前进程的常驻内存
+
+    :return: 常驻内存，单位字节
+    :rtype: int
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        # 无法获取当前值时使用峰值，Linux下单位为KB
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _worker_run(worker_id, task_queue, status_queue, initializer, initargs, max_tasks, max_rss, current):
+    """
+    工作进程主循环，依次执行任务队列中的任务，收到None时正常退出。
+    执行的任务数达到max_tasks或任务完成后常驻内存超过max_rss时，以 ``RECYCLE_EXIT_CODE`` 退出，
+    回收条件仅在两个任务之间检查，不会中断执行中的任务
+
+    :param int worker_id: 工作进程编号
+    :param multiprocessing.Queue task_queue: 任务队列
+    :param multiprocessing.Queue status_queue: 状态队列，上报任务开始、结束及回收
+    :param func initializer: 初始化函数
+    :param tuple initargs: 初始化函数参数
+    :param int max_tasks: 最多执行的任务数，0为不限制
+    :param int max_rss: 最大常驻内存，单位字节，0为不限制
+    :param multiprocessing.Value current: 共享内存中当前执行的任务编号，空闲时为-1
+    """
+    # 不继承父进程（如Guardian）的SIGTERM处理函数，保证terminate可以终止工作进程
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    if initializer:
+        initializer(*initargs)
+    tasks = 0
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        task_id, func, args = task
+        current.value = task_id
+        status_queue.put(("start", worker_id, task_id, time.time()))
+        try:
+            func(*args)
+        except Exception as e:
+            log.f("pool task {} fail".format(task_id))
+        current.value = -1
+        status_queue.put(("done", worker_id, task_id, time.time()))
+        tasks += 1
+        if max_tasks and tasks >= max_tasks:
+            sys.exit(RECYCLE_EXIT_CODE)
+        if max_rss:
+            rss = _current_rss()
+            if rss > max_rss:
+                status_queue.put(("recycle", worker_id, rss, time.time()))
+                sys.exit(RECYCLE_EXIT_CODE)
+
+
+class ElasticPool(object):
+    """
+    弹性进程池，提供与 ``multiprocessing.Pool`` 相同的 ``apply_async`` 、 ``terminate`` 接口。
+
+    管理线程定期汇总各工作进程上报的状态：
+
+    * 有待执行任务且没有空闲进程，或最早提交的待执行任务排队超过 ``POOL_SCALE_UP_WAIT`` 时扩容
+    * 有进程空闲超过 ``POOL_SCALE_DOWN_IDLE`` 时每次缩容一个进程，空闲进程收到退出标记后自行退出
+    * 异常退出的进程会被补齐至最小进程数
+
+    工作进程达到 ``POOL_MAX_TASKS`` 或 ``POOL_MAX_RSS`` 时在两个任务之间退出并由新进程替换。
+    按任务数回收时，工作进程开始执行最后一个任务时即预先启动替换进程，使回收不影响任务的排队时间
+
+    执行超时的任务可通过 ``cancel`` 取消，执行该任务的工作进程被终止并由新进程替换，不影响其他任务。
+    工作进程异常退出（如被OOM终止）时，其执行中的任务记为丢失，由 ``pop_lost`` 取出
+
+    当前进程数、待执行任务数、执行中的任务数、伸缩、回收及取消次数记录在 ``pool.{name}.*`` 指标中
+    """
+    POOL_SCALE_INTERVAL_NAME = "POOL_SCALE_INTERVAL"
+    POOL_SCALE_UP_WAIT_NAME = "POOL_SCALE_UP_WAIT"
+    POOL_SCALE_DOWN_IDLE_NAME = "POOL_SCALE_DOWN_IDLE"
+    POOL_SCALE_COOLDOWN_NAME = "POOL_SCALE_COOLDOWN"
+    POOL_MAX_TASKS_NAME = "POOL_MAX_TASKS"
+    POOL_MAX_RSS_NAME = "POOL_MAX_RSS"
+    _JOIN_TIMEOUT = 5
+
+    def __init__(self, min_workers, max_workers, initializer=None, initargs=(), name="pool"):
+        """
+        初始化方法
+
+        :param int min_workers: 最小进程数
+        :param int max_workers: 最大进程数
+        :param func initializer: 工作进程启动时调用的初始化函数
+        :param tuple initargs: 初始化函数参数
+        :param str name: 进程池名，用于指标命名
+        """
+        self._min_workers = min_workers
+        self._max_workers = max(min_workers, max_workers)
+        self._initializer = initializer
+        self._initargs = initargs
+        self._name = name
+        self._interval = string.atof(config.GuardianConfig.get(self.POOL_SCALE_INTERVAL_NAME, "1"))
+        self._up_wait = string.atof(config.GuardianConfig.get(self.POOL_SCALE_UP_WAIT_NAME, "1"))
+        self._down_idle = string.atof(config.GuardianConfig.get(self.POOL_SCALE_DOWN_IDLE_NAME, "30"))
+        self._cooldown = string.atof(config.GuardianConfig.get(self.POOL_SCALE_COOLDOWN_NAME, "5"))
+        self._max_tasks = string.atoi(config.GuardianConfig.get(self.POOL_MAX_TASKS_NAME, "0"))
+        self._max_rss = int(string.atof(config.GuardianConfig.get(self.POOL_MAX_RSS_NAME, "0")) * 1024 * 1024)
+        self._task_queue = multiprocessing.Queue()
+        self._status_queue = multiprocessing.Queue()
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count()
+        self._worker_ids = itertools.count()
+        # 工作进程编号 -> 进程对象
+        self._workers = {}
+        # 工作进程编号 -> 开始空闲的时间，执行任务中的进程不在其中
+        self._idle_since = {}
+        # 待执行任务编号 -> 提交时间
+        self._pending = {}
+        # 执行中的任务编号 -> (工作进程编号, 开始时间)
+        self._running = {}
+        # 工作进程编号 -> 共享内存中当前执行的任务编号
+        self._current = {}
+        # 工作进程编号 -> 已开始执行的任务数
+        self._task_counts = {}
+        # 已启动替换进程、等待回收的工作进程编号
+        self._recycling = set()
+        # 已发送退出标记、尚未退出的进程数
+        self._retiring = 0
+        # 工作进程异常退出而丢失的任务编号
+        self._lost = []
+        self._last_scale = 0
+        self._running_tag = False
+        self._manager = None
+
+    @property
+    def size(self):
+        """
+        当前进程数，不包括正在退出及等待回收的进程
+
+        :return: 进程数
+        :rtype: int
+        """
+        return len(self._workers) - self._retiring - len(self._recycling)
+
+    @property
+    def pending(self):
+        """
+        待执行任务数
+
+        :return: 任务数
+        :rtype: int
+        """
+        return len(self._pending)
+
+    def start(self):
+        """
+        启动最小数量的工作进程及管理线程
+
+        :return: 无返回
+        :rtype: None
+        """
+        self._running_tag = True
+        with self._lock:
+            self._spawn(self._min_workers)
+        self._manager = threading.Thread(target=self._manage_run)
+        self._manager.setDaemon(True)
+        self._manager.start()
+        return self
+
+    def apply_async(self, func, args=()):
+        """
+        提交一个任务
+
+        :param func func: 任务函数，需可序列化
+        :param tuple args: 任务参数，需可序列化
+        :return: 任务编号
+        :rtype: int
+        """
+        task_id = self._task_ids.next()
+        with self._lock:
+            self._pending[task_id] = time.time()
+        self._task_queue.put((task_id, func, args))
+        return task_id
+
+    def running_tasks(self):
+        """
+        获取执行中的任务
+
+        :return: 任务编号到(工作进程编号, 开始时间)的映射
+        :rtype: dict
+        """
+        with self._lock:
+            return dict(self._running)
+
+    def pop_lost(self):
+        """
+        取出因工作进程异常退出而丢失的任务
+
+        :return: 任务编号列表
+        :rtype: list(int)
+        """
+        with self._lock:
+            lost, self._lost = self._lost, []
+        return lost
+
+    def cancel(self, task_id):
+        """
+        取消执行中的任务：以SIGKILL终止执行该任务的工作进程并启动替换进程。未开始或已结束的任务不做处理。
+        进程在释放锁之后回收，不阻塞管理线程
+
+        :param int task_id: 任务编号
+        :return: 是否已取消
+        :rtype: bool
+        """
+        with self._lock:
+            running = self._running.get(task_id)
+            if running is None:
+                return False
+            worker_id = running[0]
+            worker = self._workers.get(worker_id)
+            # 以工作进程自身记录的任务编号为准，避免状态上报延迟时误终止执行其他任务的进程
+            if worker is None or self._current[worker_id].value != task_id:
+                return False
+            self._kill(worker)
+            self._workers.pop(worker_id)
+            self._idle_since.pop(worker_id, None)
+            self._task_counts.pop(worker_id, None)
+            self._current.pop(worker_id, None)
+            self._running.pop(task_id)
+            if worker_id in self._recycling:
+                self._recycling.discard(worker_id)
+            else:
+                self._spawn(1)
+            Metrics().incr("pool.{}.cancelled".format(self._name))
+        worker.join(self._JOIN_TIMEOUT)
+        log.i("pool {} cancel task {}, worker {} replaced".format(self._name, task_id, worker_id))
+        return True
+
+    @staticmethod
+    def _kill(worker):
+        """
+        以SIGKILL终止工作进程，不受工作进程中信号处理函数的影响
+        """
+        try:
+            os.kill(worker.pid, signal.SIGKILL)
+        except OSError:
+            # 进程已退出
+            pass
+
+    def terminate(self):
+        """
+        停止管理线程并立即终止所有工作进程，超过5秒未退出的进程以SIGKILL终止
+
+        :return: 无返回
+        :rtype: None
+        """
+        self._running_tag = False
+        if self._manager:
+            self._manager.join()
+        with self._lock:
+            workers = self._workers.values()
+            self._workers.clear()
+            self._idle_since.clear()
+            self._task_counts.clear()
+            self._current.clear()
+            self._recycling.clear()
+            self._retiring = 0
+        for worker in workers:
+            worker.terminate()
+        deadline = time.time() + self._JOIN_TIMEOUT
+        for worker in workers:
+            worker.join(max(deadline - time.time(), 0))
+            if worker.is_alive():
+                log.w("pool {} worker {} not exit on SIGTERM, kill it".format(self._name, worker.name))
+                self._kill(worker)
+                worker.join()
+
+    def _spawn(self, count):
+        """
+        启动工作进程，调用方需持有锁
+        """
+        for _ in range(count):
+            worker_id = self._worker_ids.next()
+            current = multiprocessing.Value("l", -1, lock=False)
+            worker = multiprocessing.Process(
+                target=_worker_run, name="{}-worker-{}".format(self._name, worker_id),
+                args=(worker_id, self._task_queue, self._status_queue, self._initializer, self._initargs,
+                      self._max_tasks, self._max_rss, current))
+            worker.daemon = True
+            worker.start()
+            self._workers[worker_id] = worker
+            self._idle_since[worker_id] = time.time()
+            self._task_counts[worker_id] = 0
+            self._current[worker_id] = current
+
+    def _recycle(self, worker_id, reason):
+        """
+        标记工作进程等待回收并启动替换进程，调用方需持有锁
+        """
+        if worker_id not in self._workers or worker_id in self._recycling:
+            return
+        self._recycling.add(worker_id)
+        self._idle_since.pop(worker_id, None)
+        self._spawn(1)
+        Metrics().incr("pool.{}.recycled".format(self._name))
+        log.i("pool {} recycle worker {}: {}".format(self._name, worker_id, reason))
+
+    def _manage_run(self):
+        """
+        管理线程，处理工作进程上报的状态并进行伸缩
+        """
+        while self._running_tag:
+            try:
+                self._drain_status(self._interval)
+                with self._lock:
+                    self._reap()
+                    self._scale(time.time())
+                    self._export()
+            except Exception as e:
+                log.f("pool {} manage fail".format(self._name))
+
+    def _drain_status(self, timeout):
+        """
+        取出工作进程上报的所有状态，没有状态时最多等待timeout秒
+        """
+        deadline = time.time() + timeout
+        while True:
+            try:
+                status = self._status_queue.get(timeout=max(deadline - time.time(), 0.01))
+            except Queue.Empty:
+                return
+            with self._lock:
+                self._on_status(*status)
+            if time.time() >= deadline:
+                return
+
+    def _on_status(self, kind, worker_id, task_id, timestamp):
+        """
+        处理一条工作进程状态，调用方需持有锁
+        """
+        if kind == "start":
+            submit_time = self._pending.pop(task_id, timestamp)
+            Metrics().observe("pool.{}.queue_wait".format(self._name), timestamp - submit_time)
+            if worker_id not in self._workers:
+                # 已取消的任务
+                return
+            self._running[task_id] = (worker_id, timestamp)
+            self._idle_since.pop(worker_id, None)
+            if worker_id in self._task_counts:
+                self._task_counts[worker_id] += 1
+                if self._max_tasks and self._task_counts[worker_id] >= self._max_tasks:
+                    # 最后一个任务开始执行时预先启动替换进程
+                    self._recycle(worker_id, "max tasks {} reached".format(self._max_tasks))
+        elif kind == "done":
+            self._running.pop(task_id, None)
+            if worker_id in self._workers and worker_id not in self._recycling:
+                self._idle_since[worker_id] = timestamp
+        elif kind == "recycle":
+            # task_id位置为工作进程上报的常驻内存
+            self._recycle(worker_id, "rss {} exceeds {}".format(task_id, self._max_rss))
+
+    def _reap(self):
+        """
+        清理已退出的工作进程，并补齐至最小进程数，调用方需持有锁
+        """
+        for worker_id, worker in self._workers.items():
+            if worker.is_alive():
+                continue
+            self._workers.pop(worker_id)
+            self._idle_since.pop(worker_id, None)
+            self._task_counts.pop(worker_id, None)
+            current = self._current.pop(worker_id, None)
+            replaced = worker_id in self._recycling
+            self._recycling.discard(worker_id)
+            if worker.exitcode == 0:
+                # 收到退出标记后正常退出
+                self._retiring = max(self._retiring - 1, 0)
+                continue
+            if worker.exitcode == RECYCLE_EXIT_CODE:
+                if not replaced:
+                    # 回收状态尚未处理，补充启动替换进程
+                    self._spawn(1)
+                    Metrics().incr("pool.{}.recycled".format(self._name))
+                continue
+            lost = set([task_id for task_id, (running_worker, _) in self._running.items()
+                        if running_worker == worker_id])
+            # 开始执行的状态可能尚未上报，以工作进程自身记录的任务编号补充
+            if current is not None and current.value >= 0:
+                lost.add(current.value)
+            for task_id in lost:
+                self._running.pop(task_id, None)
+                self._lost.append(task_id)
+                log.e("pool {} worker {} exited unexpectedly with task {}, exitcode:{}".format(
+                    self._name, worker_id, task_id, worker.exitcode))
+            if lost:
+                Metrics().incr("pool.{}.lost".format(self._name), len(lost))
+        if self.size < self._min_workers:
+            self._spawn(self._min_workers - self.size)
+
+    def _scale(self, now):
+        """
+        按积压任务数、排队时间及空闲时间伸缩，调用方需持有锁
+        """
+        if now - self._last_scale < self._cooldown:
+            return
+        idle = len(self._idle_since) - self._retiring
+        oldest_wait = now - min(self._pending.values()) if self._pending else 0
+        if self._pending and self.size < self._max_workers \
+                and (idle <= 0 or oldest_wait > self._up_wait):
+            count = min(self._max_workers - self.size, max(len(self._pending) - max(idle, 0), 1))
+            self._spawn(count)
+            self._last_scale = now
+            Metrics().incr("pool.{}.scale_up".format(self._name))
+            log.i("pool {} scale up {} workers, size:{}, pending:{}, oldest wait:{:.3f}s".format(
+                self._name, count, self.size, len(self._pending), oldest_wait))
+        elif not self._pending and self.size > self._min_workers and self._idle_since \
+                and now - min(self._idle_since.values()) > self._down_idle:
+            self._retiring += 1
+            self._task_queue.put(None)
+            self._last_scale = now
+            Metrics().incr("pool.{}.scale_down".format(self._name))
+            log.i("pool {} scale down 1 worker, size:{}".format(self._name, self.size))
+
+    def _export(self):
+        """
+        记录进程池指标，调用方需持有锁
+        """
+        Metrics().set("pool.{}.size".format(self._name), self.size)
+        Metrics().set("pool.{}.pending".format(self._name), len(self._pending))
+        Metrics().set("pool.{}.busy".format(self._name), len(self._running))
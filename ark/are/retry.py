@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2018 Baidu.com, Inc. All Rights Reserved
+#
+################################################################################
+"""
+**retry** 执行失败操作的重试策略：
+
+* ``RetryPolicy`` 可重试的异常类型、最大执行次数及带随机抖动的指数退避
+* ``retry`` 为 ``BaseExecFuncSet`` 中的单个操作函数声明重试策略的装饰器
+
+执行器的重试策略通过类属性 ``retry_policy`` 声明::
+
+    class DeployExecutor(MultiProcessExecutor):
+        retry_policy = RetryPolicy(max_attempts=5, retry_on=(IOError, ))
+
+    class FuncSet(BaseExecFuncSet):
+        @retry(max_attempts=3, backoff=10)
+        def restart(self, params):
+            ...
+"""
+import random
+
+import ark.are.exception as exception
+
+
+class RetryPolicy(object):
+    """
+    重试策略。第n次执行失败后，等待 ``min(backoff * multiplier ** (n - 1), max_backoff)`` 秒后重试，
+    等待时间在此基础上随机增加至多 ``jitter`` 比例，避免大量操作同时重试
+    """
+
+    def __init__(self, max_attempts=3, retry_on=(Exception, ), backoff=1.0, multiplier=2.0,
+                 max_backoff=300.0, jitter=0.5):
+        """
+        初始化方法
+
+        :param int max_attempts: 最大执行次数（包括首次执行）
+        :param tuple retry_on: 可重试的异常类型
+        :param float backoff: 首次重试的等待时间，单位秒
+        :param float multiplier: 等待时间的增长倍数
+        :param float max_backoff: 最大等待时间，单位秒
+        :param float jitter: 随机抖动比例，取值0~1
+        :raises ETypeMismatch: 参数类型不匹配
+        """
+        if not isinstance(max_attempts, int) or max_attempts < 1:
+            raise exception.ETypeMismatch("param max_attempts must be positive integer")
+        if backoff < 0 or multiplier < 1 or max_backoff < 0 or not 0 <= jitter <= 1:
+            raise exception.ETypeMismatch("invalid retry backoff params")
+        self.max_attempts = max_attempts
+        self.retry_on = tuple(retry_on)
+        self.backoff = backoff
+        self.multiplier = multiplier
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+
+    def should_retry(self, error, attempt):
+        """
+        判断执行失败的操作是否重试
+
+        :param Exception error: 执行抛出的异常
+        :param int attempt: 已执行的次数（包括本次）
+        :return: 是否重试
+        :rtype: bool
+        """
+        return attempt < self.max_attempts and isinstance(error, self.retry_on)
+
+    def delay(self, attempt):
+        """
+        计算第attempt次执行失败后的等待时间
+
+        :param int attempt: 已执行的次数（包括本次）
+        :return: 等待时间，单位秒
+        :rtype: float
+        """
+        delay = min(self.backoff * self.multiplier ** (attempt - 1), self.max_backoff)
+        return delay * (1 + random.uniform(0, self.jitter))
+
+
+def retry(**kwargs):
+    """
+    为 ``BaseExecFuncSet`` 中的操作函数声明重试策略，优先于执行器的重试策略，参数与 ``RetryPolicy`` 相同
+
+    :return: 装饰器
+    :rtype: function
+    """
+    policy = RetryPolicy(**kwargs)
+
+    def decorator(func):
+        func.retry_policy = policy
+        return func
+    return decorator
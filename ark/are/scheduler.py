@@ -0,0 +1,232 @@
+# -*- coding: UTF-8 -*-
+################################################################################
+#
+# Copyright (c) 2018 Baidu.com, Inc. All Rights Reserved
+#
+################################################################################
+"""
+**scheduler** 执行器使用的准入调度：
+
+* ``AdmissionScheduler`` 按键（如操作所针对的服务、集群）限制并发执行的操作数，并限制总并发数，
+  超出限制的操作排队等待，有操作完成后按FIFO或优先级顺序准入
+
+并发限制及排队顺序通过以下配置项调整：
+
+* ``EXECUTOR_GLOBAL_LIMIT`` 总并发数，默认为执行器的最大进程（线程）数，0为不限制
+* ``EXECUTOR_KEY_LIMIT`` 每个键的并发数，默认0，即不限制
+* ``EXECUTOR_SCHEDULE_ORDER`` 排队顺序，可选fifo、priority，默认priority
+* ``EXECUTOR_AGING_INTERVAL`` priority顺序下，操作每等待该时间优先级提升一级，默认60秒，0为不提升
+"""
+import heapq
+import itertools
+import time
+
+import ark.are.exception as exception
+
+
+class AdmissionScheduler(object):
+    """
+    按键限制并发的准入调度器。键为None的操作不受键级限制，只受总并发数限制。
+    某个键达到并发限制时，只阻塞该键下排队的操作，不影响其他键
+
+    .. Note:: 调度器不加锁，只能在同一线程（执行器的消息泵线程）中使用
+    """
+    ORDER_FIFO = "fifo"
+    ORDER_PRIORITY = "priority"
+
+    def __init__(self, global_limit=0, key_limit=0, order=ORDER_PRIORITY, aging_interval=0):
+        """
+        初始化方法。priority顺序下依次按有效优先级从高到低、截止时间从早到晚、到达时间从早到晚排序，
+        有效优先级为优先级加上等待时间折算的提升级数，避免低优先级操作长期得不到执行
+
+        :param int global_limit: 总并发数，0为不限制
+        :param int key_limit: 每个键的默认并发数，0为不限制
+        :param str order: 排队顺序，fifo按提交顺序，priority按优先级排序
+        :param float aging_interval: 每等待该时间优先级提升一级，单位秒，0为不提升
+        :raises ETypeMismatch: 参数类型不匹配
+        """
+        if order not in (self.ORDER_FIFO, self.ORDER_PRIORITY):
+            raise exception.ETypeMismatch("unsupported schedule order:{}".format(order))
+        if global_limit < 0 or key_limit < 0:
+            raise exception.ETypeMismatch("concurrency limit must be non-negative")
+        self._global_limit = global_limit
+        self._key_limit = key_limit
+        self._order = order
+        self._aging_interval = aging_interval
+        self._ranked_at = time.time()
+        self._limits = {}
+        self._sequence = itertools.count()
+        # 键 -> 排队操作的堆，元素为(排序值, 提交序号, 操作id, 操作)
+        self._waiting = {}
+        # 排队操作id -> 键
+        self._waiting_keys = {}
+        # 操作id -> 键
+        self._running = {}
+        # 键 -> 执行中的操作数
+        self._running_count = {}
+
+    @property
+    def running(self):
+        """
+        执行中的操作数
+        """
+        return len(self._running)
+
+    @property
+    def waiting(self):
+        """
+        排队中的操作数
+        """
+        return len(self._waiting_keys)
+
+    def set_limit(self, key, limit):
+        """
+        设置指定键的并发数，覆盖默认的键级并发数
+
+        :param str key: 键
+        :param int limit: 并发数，0为不限制，None为恢复默认值
+        :return: 无返回
+        :rtype: None
+        """
+        if limit is None:
+            self._limits.pop(key, None)
+        else:
+            self._limits[key] = limit
+
+    def get_limit(self, key):
+        """
+        获取指定键的并发数
+
+        :param str key: 键
+        :return: 并发数，0为不限制
+        :rtype: int
+        """
+        if key is None:
+            return 0
+        return self._limits.get(key, self._key_limit)
+
+    def _key_full(self, key):
+        limit = self.get_limit(key)
+        return limit and self._running_count.get(key, 0) >= limit
+
+    def _global_full(self):
+        return self._global_limit and len(self._running) >= self._global_limit
+
+    def _rank(self, priority, deadline, arrival, now):
+        """
+        计算排序值，值越小越优先
+        """
+        if self._order != self.ORDER_PRIORITY:
+            return ()
+        if self._aging_interval:
+            priority += int(max(now - arrival, 0) / self._aging_interval)
+        return -priority, deadline if deadline is not None else float("inf"), arrival
+
+    def _rerank(self, now):
+        """
+        按当前时间重新计算所有排队操作的排序值。有效优先级只在等待时间跨过提升间隔时变化，
+        因此每个提升间隔至多重排一次
+        """
+        if self._order != self.ORDER_PRIORITY or not self._aging_interval \
+                or now - self._ranked_at < self._aging_interval:
+            return
+        self._ranked_at = now
+        for key, queue in self._waiting.iteritems():
+            queue[:] = [(self._rank(meta[0], meta[1], meta[2], now), seq, item_id, item, meta)
+                        for _, seq, item_id, item, meta in queue]
+            heapq.heapify(queue)
+
+    def submit(self, item_id, key, item, priority=0, deadline=None, arrival=None):
+        """
+        提交操作，操作进入排队，由admit准入
+
+        :param str item_id: 操作id
+        :param str key: 并发限制的键，None为不限制
+        :param object item: 操作
+        :param int priority: 优先级，值越大越优先，仅priority顺序下生效
+        :param float deadline: 截止时间（时间戳），同优先级下截止时间早的优先，None为无截止时间
+        :param float arrival: 到达时间（时间戳），用于计算等待时间，默认为当前时间。
+                              故障切换后恢复的操作应传入原到达时间，以保留已等待的时间
+        :return: 无返回
+        :rtype: None
+        :raises EInvalidOperation: 操作已在排队或执行中
+        """
+        if item_id in self._running:
+            raise exception.EInvalidOperation("operation {} is already running".format(item_id))
+        if item_id in self._waiting_keys:
+            raise exception.EInvalidOperation("operation {} is already waiting".format(item_id))
+        now = time.time()
+        arrival = arrival if arrival is not None else now
+        meta = (priority, deadline, arrival)
+        heapq.heappush(self._waiting.setdefault(key, []),
+                       (self._rank(priority, deadline, arrival, now), next(self._sequence), item_id, item, meta))
+        self._waiting_keys[item_id] = key
+
+    def admit(self):
+        """
+        按排队顺序准入未超出并发限制的操作，准入的操作计为执行中
+
+        :return: 准入的(操作id, 键, 操作)列表
+        :rtype: list
+        """
+        self._rerank(time.time())
+        admitted = []
+        heads = [(queue[0][:2], key) for key, queue in self._waiting.iteritems()
+                 if not self._key_full(key)]
+        heapq.heapify(heads)
+        while heads and not self._global_full():
+            _, key = heapq.heappop(heads)
+            queue = self._waiting[key]
+            _, _, item_id, item, _ = heapq.heappop(queue)
+            del self._waiting_keys[item_id]
+            self._running[item_id] = key
+            self._running_count[key] = self._running_count.get(key, 0) + 1
+            admitted.append((item_id, key, item))
+            if not queue:
+                del self._waiting[key]
+            elif not self._key_full(key):
+                heapq.heappush(heads, (queue[0][:2], key))
+        return admitted
+
+    def release(self, item_id):
+        """
+        释放执行完成的操作占用的并发数
+
+        :param str item_id: 操作id
+        :return: 操作是否在执行中
+        :rtype: bool
+        """
+        if item_id not in self._running:
+            return False
+        key = self._running.pop(item_id)
+        self._running_count[key] -= 1
+        if not self._running_count[key]:
+            del self._running_count[key]
+        return True
+
+    def clear(self):
+        """
+        清空排队及执行中的操作，并发限制保留
+
+        :return: 无返回
+        :rtype: None
+        """
+        self._waiting.clear()
+        self._waiting_keys.clear()
+        self._running.clear()
+        self._running_count.clear()
+
+    def stats(self):
+        """
+        获取准入情况
+
+        :return: 总执行中、排队中的操作数，及各键执行中、排队中的操作数
+        :rtype: dict
+        """
+        keys = {}
+        for key, count in self._running_count.iteritems():
+            keys[key] = {"running": count, "waiting": 0, "limit": self.get_limit(key)}
+        for key, queue in self._waiting.iteritems():
+            keys.setdefault(key, {"running": 0, "limit": self.get_limit(key)})["waiting"] = len(queue)
+        return {"running": len(self._running), "waiting": len(self._waiting_keys),
+                "limit": self._global_limit, "keys": keys}
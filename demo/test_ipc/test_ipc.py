@@ -0,0 +1,153 @@
+# -*- coding: UTF-8 -*-
+
+import os
+import random
+import time
+import unittest
+import zlib
+
+import ark.are.exception as exception
+import ark.are.ipc as ipc
+
+
+class TestControlTable(unittest.TestCase):
+    """
+    控制消息表与dict的一致性、删除标记回收及重建测试
+    """
+    SLOTS = 16
+
+    def setUp(self):
+        self.table = ipc.ControlTable(slots=self.SLOTS, slot_size=64)
+
+    def header(self):
+        """
+        表头：(generation, used, deleted)
+        """
+        return self.table._TABLE.unpack_from(self.table._mm, 0)
+
+    def states(self):
+        return [self.table._state(i) for i in range(self.SLOTS)]
+
+    def colliding_keys(self, count, home=0):
+        """
+        生成count个按crc32落在同一槽位的键，它们构成一条连续的探测链
+        """
+        keys = []
+        i = 0
+        while len(keys) < count:
+            key = "c%d" % i
+            if zlib.crc32(key) % self.SLOTS == home:
+                keys.append(key)
+            i += 1
+        return keys
+
+    def assert_same(self, ref, universe):
+        for key in universe:
+            self.assertEqual(key in self.table, key in ref)
+            self.assertEqual(self.table.get(key), ref.get(key))
+
+    def test_random_against_dict(self):
+        rand = random.Random(1)
+        universe = ["k%d" % i for i in range(30)]
+        ref = {}
+        for step in range(5000):
+            key = rand.choice(universe)
+            if rand.random() < 0.5 and (key in ref or len(ref) < self.SLOTS - 2):
+                self.table[key] = step
+                ref[key] = step
+            elif key in ref:
+                del self.table[key]
+                del ref[key]
+            else:
+                self.assertRaises(KeyError, self.table.__delitem__, key)
+            self.assert_same(ref, universe)
+        self.assertEqual(self.header()[1], len(ref))
+        for key in list(ref):
+            del self.table[key]
+        self.assertEqual(self.states(), [ipc.ControlTable._EMPTY] * self.SLOTS)
+        self.assertEqual(self.header()[1:], (0, 0))
+
+    def test_reclaim_chain_end(self):
+        first, middle, last = self.colliding_keys(3)
+        for key in (first, middle, last):
+            self.table[key] = key
+        self.assertEqual(self.states()[:4], [ipc.ControlTable._USED] * 3 + [ipc.ControlTable._EMPTY])
+        # 后面还有键，只能留下删除标记
+        del self.table[middle]
+        self.assertEqual(self.table._state(1), ipc.ControlTable._DELETED)
+        self.assertEqual(self.header()[1:], (2, 1))
+        self.assertEqual(self.table[last], last)
+        # 探测链在此结束，连同前面的删除标记一起回收
+        del self.table[last]
+        self.assertEqual(self.states()[:3], [ipc.ControlTable._USED] + [ipc.ControlTable._EMPTY] * 2)
+        self.assertEqual(self.header()[1:], (1, 0))
+        self.assertEqual(self.table[first], first)
+        # 回收后的槽位可以再次使用
+        self.table[middle] = 1
+        self.table[last] = 2
+        self.assertEqual((self.table[middle], self.table[last]), (1, 2))
+        self.assertEqual(self.header()[1:], (3, 0))
+
+    def test_rehash(self):
+        keys = self.colliding_keys(self.SLOTS // 4 + 3)
+        for key in keys:
+            self.table[key] = key
+        generation = self.header()[0]
+        # 保留链尾的键，删除其余的键只会留下删除标记，超过槽位数的1/4时重建
+        for key in keys[:self.SLOTS // 4]:
+            del self.table[key]
+        self.assertEqual(self.header(), (generation, 3, self.SLOTS // 4))
+        del self.table[keys[self.SLOTS // 4]]
+        self.assertEqual(self.header(), (generation + 2, 2, 0))
+        self.assertNotIn(ipc.ControlTable._DELETED, self.states())
+        ref = dict((key, key) for key in keys[-2:])
+        self.assert_same(ref, keys)
+        # 重建后继续插入、删除
+        self.table[keys[0]] = 0
+        del self.table[keys[-1]]
+        ref = {keys[0]: 0, keys[-2]: keys[-2]}
+        self.assert_same(ref, keys)
+
+    def test_full(self):
+        for i in range(self.SLOTS):
+            self.table["k%d" % i] = i
+        self.assertRaises(exception.EInvalidOperation, self.table.__setitem__, "other", 0)
+        # 已存在的键仍可更新，删除后可写入新键
+        self.table["k0"] = "new"
+        self.assertEqual(self.table["k0"], "new")
+        del self.table["k1"]
+        self.table["other"] = 0
+        self.assertEqual(self.table["other"], 0)
+        self.assertNotIn("k1", self.table)
+
+    def test_concurrent_reader(self):
+        table = ipc.ControlTable(slots=32, slot_size=64)
+        for i in range(8):
+            table["stable%d" % i] = i
+        pid = os.fork()
+        if pid == 0:
+            # 子进程不断插入、删除其他键，触发删除标记回收及重建
+            rand = random.Random(2)
+            end = time.time() + 1
+            while time.time() < end:
+                key = "tmp%d" % rand.randint(0, 40)
+                try:
+                    if rand.random() < 0.5:
+                        table[key] = 0
+                    else:
+                        del table[key]
+                except (KeyError, exception.EInvalidOperation):
+                    pass
+            os._exit(0)
+        misses = 0
+        end = time.time() + 1
+        while time.time() < end:
+            for i in range(8):
+                if table.get("stable%d" % i) != i:
+                    misses += 1
+        os.waitpid(pid, 0)
+        self.assertEqual(misses, 0)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,76 @@
+# -*- coding: UTF-8 -*-
+"""
+FilePersistence各持久化模式（none/atomic/durable）的写入吞吐对比
+
+用法: python bench_durability.py [persist_path] [count] [value_size] [threads]
+"""
+
+import sys
+import time
+import threading
+
+import ark.are.config as config
+import ark.are.persistence as persistence
+
+
+def make_driver(base, durability):
+    """
+    按持久化模式创建FilePersistence实例
+
+    :param str base: 持久化根目录
+    :param str durability: 持久化模式
+    :return: 持久化实例
+    :rtype: persistence.FilePersistence
+    """
+    cfg = {"LOG_CONF_DIR": "./", "LOG_ROOT": "./log",
+           "STATE_SERVICE_HOSTS": base,
+           "PERSIST_DURABILITY": durability}
+    config.GuardianConfig.set(cfg)
+    # FilePersistence为单例，切换模式时需要重新创建
+    persistence.FilePersistence._instance = None
+    return persistence.FilePersistence()
+
+
+def bench(driver, count, value, threads):
+    """
+    多线程并发save_data，返回每秒写入次数
+
+    :param persistence.FilePersistence driver: 持久化实例
+    :param int count: 每个线程写入的次数
+    :param str value: 写入的数据
+    :param int threads: 并发线程数
+    :return: 吞吐(ops/s)
+    :rtype: float
+    """
+    for i in range(threads):
+        path = "/bench/node%d" % i
+        if not driver.exists(path):
+            driver.create_node(path, makepath=True)
+
+    def _run(index):
+        path = "/bench/node%d" % index
+        for _ in range(count):
+            driver.save_data(path, value)
+
+    workers = [threading.Thread(target=_run, args=(i,)) for i in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    cost = time.time() - start
+    return count * threads / cost
+
+
+if __name__ == '__main__':
+    base = sys.argv[1] if len(sys.argv) > 1 else "/tmp/persist_bench"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    size = int(sys.argv[3]) if len(sys.argv) > 3 else 4096
+    threads = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+    value = "x" * size
+    for mode in ("none", "atomic", "durable"):
+        driver = make_driver(base, mode)
+        ops = bench(driver, count, value, threads)
+        driver.delete_node("/bench")
+        driver.disconnect()
+        print "%-8s %10.1f ops/s  (%d threads x %d writes, %d bytes)" % (mode, ops, threads, count, size)
@@ -23,6 +23,8 @@ def make_driver(driver_cls):
         driver_conf = {"STATE_SERVICE_HOSTS": "redis://127.0.0.1:6379/0"}
     elif driver_cls == persistence.ZkPersistence:
         driver_conf = {"STATE_SERVICE_HOSTS": "redis://127.0.0.1:6379/0"}
+    elif driver_cls == persistence.MemoryPersistence:
+        driver_conf = {}
     else:
         raise exception.ETypeMismatch("Unknown persistence class")
 
@@ -84,13 +86,49 @@ class TestRedisPersist(common.ParametrizedTestCase):
         def watcher(event):
             self.watch_list[event.path] = event.type
 
+        # test_delete会删除/gur1，此处不依赖测试顺序
+        if not self.driver.exists("/gur1/inst"):
+            self.driver.create_node("/gur1/inst", "", False, False, True)
         self.driver.get_children("/gur1/inst", watcher)
         result = self.driver.create_node("/gur1/inst/inst_", "{}", True, True, True)
         time.sleep(2)
-        self.assertEqual(self.watch_list["/gur1/inst"], "CREATED")
+        self.assertEqual(self.watch_list["/gur1/inst"], "CHILD")
+
+
+class TestPlainWatch(common.ParametrizedTestCase):
+    """
+    轮询方式实现的持久化驱动的监听测试
+    """
+    driver = None
+
+    def setUp(self):
+        self.driver = make_driver(self.param)
+        self.events = []
+
+    def tearDown(self):
+        if self.driver.exists("/gur2"):
+            self.driver.delete_node("/gur2", True)
+        self.driver.disconnect()
+
+    def test_watch_expired_ephemeral(self):
+        path = self.driver.create_node("/gur2/inst/inst_", "{}", True, True, True)
+        self.driver.exists(path, lambda event: self.events.append(event.type))
+        # 停止续约，使临时节点超时
+        with self.driver._lock:
+            self.driver._touch_paths.pop(path)
+        time.sleep(self.driver._timeout + 2)
+        self.assertEqual(self.events, ["DELETED"])
+        self.assertTrue(self.driver._session_thread.is_alive())
+        # 其他路径的监听不受影响
+        self.driver.get_children("/gur2/inst", lambda event: self.events.append(event.type))
+        self.driver.create_node("/gur2/inst/inst_", "{}", True, True)
+        time.sleep(2)
+        self.assertEqual(self.events, ["DELETED", "CHILD"])
 
 
 if __name__ == '__main__':
     suite = unittest.TestSuite()
     suite.addTest(common.ParametrizedTestCase.parametrize(TestRedisPersist, param=persistence.RedisPersistence))
+    suite.addTest(common.ParametrizedTestCase.parametrize(TestRedisPersist, param=persistence.MemoryPersistence))
+    suite.addTest(common.ParametrizedTestCase.parametrize(TestPlainWatch, param=persistence.FilePersistence))
     unittest.TextTestRunner(verbosity=2).run(suite)
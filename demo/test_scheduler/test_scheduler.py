@@ -0,0 +1,129 @@
+# -*- coding: UTF-8 -*-
+
+import ark.are.exception as exception
+import ark.are.scheduler as scheduler
+import unittest
+
+
+class FakeTime(object):
+    """
+    可控制的时钟，替换scheduler模块中的time
+    """
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class TestAdmissionScheduler(unittest.TestCase):
+    """
+    准入调度器的并发限制、排队顺序及重复提交测试
+    """
+    def setUp(self):
+        self.clock = FakeTime(1000.0)
+        self.origin_time = scheduler.time
+        scheduler.time = self.clock
+
+    def tearDown(self):
+        scheduler.time = self.origin_time
+
+    def admitted_ids(self, sched):
+        return [item_id for item_id, _, _ in sched.admit()]
+
+    def test_global_limit(self):
+        sched = scheduler.AdmissionScheduler(global_limit=2, order=scheduler.AdmissionScheduler.ORDER_FIFO)
+        for i in range(4):
+            sched.submit("op%d" % i, None, i)
+        self.assertEqual(self.admitted_ids(sched), ["op0", "op1"])
+        self.assertEqual(self.admitted_ids(sched), [])
+        self.assertEqual((sched.running, sched.waiting), (2, 2))
+        self.assertTrue(sched.release("op0"))
+        self.assertFalse(sched.release("op0"))
+        self.assertEqual(self.admitted_ids(sched), ["op2"])
+
+    def test_key_limit(self):
+        sched = scheduler.AdmissionScheduler(key_limit=1, order=scheduler.AdmissionScheduler.ORDER_FIFO)
+        sched.submit("a1", "a", None)
+        sched.submit("a2", "a", None)
+        sched.submit("b1", "b", None)
+        sched.set_limit("c", 2)
+        sched.submit("c1", "c", None)
+        sched.submit("c2", "c", None)
+        # 键a达到限制时不阻塞其他键
+        self.assertEqual(sorted(self.admitted_ids(sched)), ["a1", "b1", "c1", "c2"])
+        self.assertEqual(sched.stats()["keys"]["a"], {"running": 1, "waiting": 1, "limit": 1})
+        sched.release("a1")
+        self.assertEqual(self.admitted_ids(sched), ["a2"])
+
+    def test_priority_order(self):
+        sched = scheduler.AdmissionScheduler(global_limit=1)
+        sched.submit("low", None, None, priority=0)
+        sched.submit("high", None, None, priority=5)
+        sched.submit("middle", None, None, priority=3)
+        order = []
+        while sched.waiting:
+            order.extend(self.admitted_ids(sched))
+            sched.release(order[-1])
+        self.assertEqual(order, ["high", "middle", "low"])
+
+    def test_deadline_order(self):
+        sched = scheduler.AdmissionScheduler(global_limit=1)
+        sched.submit("none", None, None, priority=1)
+        sched.submit("late", None, None, priority=1, deadline=2000.0)
+        sched.submit("early", None, None, priority=1, deadline=1500.0)
+        sched.submit("urgent", None, None, priority=2)
+        order = []
+        while sched.waiting:
+            order.extend(self.admitted_ids(sched))
+            sched.release(order[-1])
+        # 截止时间只在同优先级下生效，无截止时间的排在最后
+        self.assertEqual(order, ["urgent", "early", "late", "none"])
+
+    def test_aging(self):
+        sched = scheduler.AdmissionScheduler(global_limit=1, aging_interval=10)
+        sched.submit("running", None, None)
+        self.admitted_ids(sched)
+        sched.submit("old", None, None, priority=0)
+        self.clock.now += 25
+        sched.submit("new", None, None, priority=2)
+        # 再过5秒后old已等待30秒，有效优先级为3，高于new的2
+        self.clock.now += 5
+        sched.release("running")
+        self.assertEqual(self.admitted_ids(sched), ["old"])
+        sched.release("old")
+        self.assertEqual(self.admitted_ids(sched), ["new"])
+
+    def test_arrival(self):
+        sched = scheduler.AdmissionScheduler(global_limit=1, aging_interval=10)
+        sched.submit("fresh", None, None, priority=2)
+        # 恢复的操作保留原到达时间
+        sched.submit("recovered", None, None, priority=0, arrival=self.clock.now - 30)
+        self.assertEqual(self.admitted_ids(sched), ["recovered"])
+
+    def test_duplicate_submit(self):
+        sched = scheduler.AdmissionScheduler(global_limit=1)
+        sched.submit("op1", "a", None)
+        sched.submit("op2", "b", None)
+        self.assertRaises(exception.EInvalidOperation, sched.submit, "op2", "a", None)
+        self.assertEqual(self.admitted_ids(sched), ["op1"])
+        self.assertRaises(exception.EInvalidOperation, sched.submit, "op1", "a", None)
+        sched.release("op1")
+        sched.submit("op1", "a", None)
+        self.assertEqual(sched.waiting, 2)
+
+    def test_clear(self):
+        sched = scheduler.AdmissionScheduler(key_limit=1)
+        sched.set_limit("a", 2)
+        sched.submit("op1", "a", None)
+        sched.admit()
+        sched.submit("op2", "a", None)
+        sched.clear()
+        self.assertEqual((sched.running, sched.waiting), (0, 0))
+        self.assertEqual(sched.get_limit("a"), 2)
+        sched.submit("op2", "a", None)
+        self.assertEqual(self.admitted_ids(sched), ["op2"])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)